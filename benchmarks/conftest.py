@@ -0,0 +1,36 @@
+"""Configuration of benchmarks.
+
+Benchmarks are not collected by plain pytest, run them by make bench.
+"""
+
+import pytest
+
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+"""Sizes of synthetic workloads in lines or items."""
+
+
+def pytest_addoption(parser):
+    parser.addoption('--max-size', type=int, default=SIZES[-1], help='Largest size of benchmarked workloads.')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'max_size(limit): largest size of workload of slow benchmark.')
+
+
+def pytest_generate_tests(metafunc):
+    if 'size' in metafunc.fixturenames:
+        marker = metafunc.definition.get_closest_marker('max_size')
+        limit = min(metafunc.config.getoption('max_size'), SIZES[-1] if marker is None else marker.args[0])
+        metafunc.parametrize('size', [size for size in SIZES if size <= limit])
+
+
+@pytest.fixture
+def measure(benchmark, size):
+    """Benchmarks function, running large workloads fewer times."""
+    def run(function, setup=None):
+        rounds = max(3, min(100, 1_000_000 // size))
+        if setup is None:
+            return benchmark.pedantic(function, rounds=rounds, warmup_rounds=1)
+        return benchmark.pedantic(function, setup=lambda: ((setup(),), {}), rounds=rounds, warmup_rounds=1)
+    return run
@@ -0,0 +1,89 @@
+"""Benchmarks of rendering hot paths at several sizes."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from mff_pytex.bib import Article, Bibliography
+from mff_pytex.packages import Package, PackageRegistry, activate_registry, add_package, deactivate_registry
+from mff_pytex.structure import Document, TexFile
+from mff_pytex.tables import List, Table
+
+
+def test_document_write(measure, size):
+    """Accumulating lines of text in document."""
+    lines = [f"Line {i} of text." for i in range(size)]
+
+    def write():
+        document = Document()
+        document.write(*lines)
+        return str(document)
+    measure(write)
+
+
+def test_list_items(measure, size):
+    """List of a large sequence."""
+    items = [f"item {i}" for i in range(size)]
+    measure(lambda: str(List(items)))
+
+
+def test_list_items_escaped(measure, size):
+    """List of a large sequence with escaping."""
+    items = [f"item_{i} & 50%" for i in range(size)]
+    measure(lambda: str(List(items, escape=True)))
+
+
+def test_list_description(measure, size):
+    """Description list of a large dict."""
+    items = {f"key {i}": f"value {i}" for i in range(size)}
+    measure(lambda: str(List(items, 'description')))
+
+
+def test_table_tall(measure, size):
+    """Table with many rows."""
+    df = pd.DataFrame({'int': np.arange(size), 'float': np.linspace(0, 1, size),
+                       'text': [f"row {i}" for i in range(size)]})
+    measure(lambda: str(Table(df)))
+
+
+@pytest.mark.max_size(10_000)
+def test_table_wide(measure, size):
+    """Table with many columns and 100 rows."""
+    df = pd.DataFrame(np.random.default_rng(0).random((100, size // 10)))
+    measure(lambda: str(Table(df)))
+
+
+@pytest.mark.max_size(100_000)
+def test_bibliography_create(measure, size, tmp_path):
+    """Writing bib file with many records."""
+    bib = Bibliography('refs')
+    bib.file_path = str(tmp_path / 'refs.bib')
+    bib.add(*(Article(f"key{i}", f"Title {i}", 2000 + i % 20, f"Author {i}", 'Journal', pages='1--10')
+              for i in range(size)))
+    measure(bib.create)
+
+
+@pytest.mark.max_size(100_000)
+def test_package_churn(measure, size):
+    """Adding packages repeatedly, as every Table, Picture and Bib does."""
+    names = [f"package{i % 50}" for i in range(size)]
+
+    def churn():
+        token = activate_registry(PackageRegistry())
+        try:
+            for name in names:
+                add_package(Package(name))
+        finally:
+            deactivate_registry(token)
+    measure(churn)
+
+
+def test_texfile_create(measure, size, tmp_path):
+    """Writing whole TeX file with text, list and table."""
+    def document():
+        tex = TexFile('doc')
+        tex.file_path = str(tmp_path / 'doc.tex')
+        tex.document.write(*(f"Paragraph {i}." for i in range(size // 2)))
+        tex.document.add(List([f"item {i}" for i in range(size // 4)]))
+        tex.document.add(Table(pd.DataFrame({'x': np.arange(size // 4)})))
+        return tex
+    measure(lambda tex: tex.create(), setup=document)
@@ -1,13 +1,72 @@
-"""Top-level package for MFF PyTeX."""
+"""Top-level package for MFF PyTeX.
+
+Submodules are imported lazily, when any of their names is used for the first time.
+"""
+
+from importlib import import_module
+from typing import Any
 
 __author__ = """Ondřej Chwiedziuk"""
 __email__ = 'ondrachwiedziuk@gmail.com'
 __version__ = '0.4.2'
 
-from mff_pytex.bib import *
-from mff_pytex.images import *
-from mff_pytex.packages import *
-from mff_pytex.structure import *
-from mff_pytex.tables import *
-from mff_pytex.utils import *
-from mff_pytex.exceptions import *
+_submodules = {
+    'bib': ['Bib', 'Article', 'Book', 'Booklet', 'Conference', 'InBook', 'InCollection', 'InProceedings', 'Manual',
+            'MasterThesis', 'Misc', 'PhdThesis', 'Proceedings', 'TechReport', 'Unpublished', 'BIB_TYPES', 'MONTHS', 'parse_bib',
+            'BIB_CACHE_VERSION', 'load_bib', 'Bibliography'],
+    'escaping': ['Raw', 'LATEX_ESCAPES', 'escape', 'escape_all', 'escape_series'],
+    'assets': ['RASTER_CONVERSIONS', 'VECTOR_CONVERSIONS', 'DOWNSAMPLED', 'IMAGE_EXTENSIONS', 'ASSET_CACHE_SIZE',
+               'SVG_CONVERTERS', 'AssetCache', 'AssetSettings', 'resolve_image', 'target_suffix', 'asset_key',
+               'convert_image', 'prepare_assets'],
+    'build': ['Engine', 'ENGINES', 'get_engine', 'engine_version', 'read_text', 'Build', 'BuildResult',
+              'MAX_CONCURRENT_BUILDS', 'get_compile_limit', 'build_all', 'build_all_async'],
+    'events': ['BuildEvent', 'BuildHook', 'add_hook', 'remove_hook', 'get_hooks', 'emit', 'timed'],
+    'cache': ['PDF_CACHE_SIZE', 'FORMAT_CACHE_SIZE', 'CacheEntry', 'FileCache', 'PdfCache', 'FormatCache'],
+    'fragments': ['FRAGMENT_CACHE_SIZE', 'FRAGMENT_CACHE_VERSION', 'Fragment', 'fragment_key', 'FragmentCache',
+                  'get_fragment_cache', 'memoize'],
+    'images': ['Picture'],
+    'logs': ['RERUN_PATTERN', 'MAX_PRINT_LINE', 'LogMessage', 'LogReport', 'unwrap_lines', 'parse_log', 'parse_blg',
+             'read_log'],
+    'merge': ['Placeholder', 'MergeTemplate', 'merge'],
+    'packages': ['Package', 'LATE_PACKAGES', 'PackageRegistry', 'default_registry', 'get_registry', 'activate_registry',
+                 'deactivate_registry', 'find_package', 'add_package', 'get_packages', 'order_packages', 'clear_packages'],
+    'server': ['WARM_MODULES', 'socket_path', 'texfile_from_spec', 'RenderHandler', 'RenderServer', 'warm_up', 'serve',
+               'submit'],
+    'structure': ['CHAPTER_CLASSES', 'DocumentClass', 'Preamble', 'Chapter', 'Document', 'TexFile'],
+    'tables': ['FAST_STYLES', 'render_table', 'Table', 'StreamingTable', 'List'],
+    'utils': ['BUFFER_SIZE', 'File', 'open_output', 'file_hash', 'get_cache_dir', 'get_func_name', 'get_dir',
+              'get_path', 'command', 'doublecommand', 'Writing', 'Environment'],
+    'watch': ['DEBOUNCE', 'BUILD_PRODUCTS', 'BUILD_STATE_SUFFIX', 'ScriptRun', 'is_input'],
+    'exceptions': ['WrongTypeListError', 'CompilationError', 'CompilationTimeoutError', 'UnknownEngineError', 'PackageOrderError',
+                   'DuplicateBibError', 'AssetError', 'MissingAssetError', 'RenderServerError'],
+}
+"""Public names of submodules."""
+
+_exports = {name: module for module, names in _submodules.items() for name in names}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str) -> Any:
+    """Imports submodule or name of submodule on first use.
+
+    Args:
+        name (str): Name of attribute.
+
+    Raises:
+        AttributeError: When there is no such name.
+
+    Returns:
+        Any: Submodule or its attribute.
+    """
+    if name in _submodules:
+        return import_module(f"{__name__}.{name}")
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f"{__name__}.{_exports[name]}"), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,270 @@
+"""Preparation of images for TeX: conversion, downsampling and caching."""
+
+from typing import Iterable, Optional
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+from os import path
+from mff_pytex.cache import FileCache
+from mff_pytex.exceptions import AssetError, MissingAssetError
+from mff_pytex.utils import file_hash
+
+
+RASTER_CONVERSIONS = {'.tif': '.png', '.tiff': '.png', '.bmp': '.png', '.gif': '.png', '.webp': '.png'}
+"""Raster formats which TeX can not read and formats they are converted to."""
+
+VECTOR_CONVERSIONS = {'.svg': '.pdf'}
+"""Vector formats which TeX can not read and formats they are converted to."""
+
+DOWNSAMPLED = frozenset({'.png', '.jpg', '.jpeg', *RASTER_CONVERSIONS})
+"""Raster formats which are downsampled."""
+
+IMAGE_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.eps', *VECTOR_CONVERSIONS, *RASTER_CONVERSIONS)
+"""Extensions tried for images referenced without extension."""
+
+ASSET_CACHE_SIZE = 1 << 30
+"""Default limit of size of cache of prepared images in bytes."""
+
+SVG_CONVERTERS = (
+    ('rsvg-convert', ('-f', 'pdf', '-o', '{output}', '{source}')),
+    ('inkscape', ('--export-type=pdf', '--export-filename={output}', '{source}')),
+)
+"""Programs converting svg to pdf and their arguments, the first installed one is used."""
+
+
+class AssetCache(FileCache):
+    """Cache of prepared images named by hashes of sources and settings, with their extension.
+
+    Attributes:
+        directory (str): Directory of cached files, assets directory in cache directory by default.
+        max_size (int): Limit of total size of cached files in bytes, MFF_PYTEX_ASSET_CACHE_SIZE environment
+            variable or ASSET_CACHE_SIZE by default.
+    """
+    subdirectory = 'assets'
+    default_size = ASSET_CACHE_SIZE
+    size_variable = 'MFF_PYTEX_ASSET_CACHE_SIZE'
+
+
+@dataclass(frozen=True)
+class AssetSettings:
+    """Settings of prepared images.
+
+    Attributes:
+        dpi (int): Target resolution of raster images.
+        width (float): Greatest printed width of image in inches, wider images are downsampled.
+        quality (int): Quality of downsampled JPEG images.
+    """
+    dpi: int = 300
+    width: float = 6.5
+    quality: int = 90
+
+    @property
+    def max_pixels(self) -> int:
+        """Greatest width of raster image in pixels."""
+        return round(self.dpi * self.width)
+
+
+def resolve_image(file_path: str) -> str:
+    """Returns path to image, trying known extensions if it has none, as graphicx does.
+
+    Args:
+        file_path (str): Path to image, possibly without extension.
+
+    Returns:
+        str: Path to existing image, or the given path if none exists.
+    """
+    if path.isfile(file_path) or path.splitext(file_path)[1]:
+        return file_path
+    return next((file_path + extension for extension in IMAGE_EXTENSIONS if path.isfile(file_path + extension)),
+                file_path)
+
+
+def target_suffix(file_path: str) -> str:
+    """Returns extension of prepared image.
+
+    Args:
+        file_path (str): Path to source image.
+
+    Returns:
+        str: Extension including dot.
+    """
+    suffix = path.splitext(file_path)[1].lower()
+    return RASTER_CONVERSIONS.get(suffix) or VECTOR_CONVERSIONS.get(suffix) or suffix
+
+
+def asset_key(digest: str, suffix: str, settings: AssetSettings) -> str:
+    """Returns key of prepared image in cache.
+
+    Args:
+        digest (str): Hash of source image.
+        suffix (str): Extension of source image.
+        settings (AssetSettings): Settings of preparation.
+
+    Returns:
+        str: Hex digest.
+    """
+    return hashlib.sha256(f"{digest}\n{suffix}\n{settings!r}".encode()).hexdigest()
+
+
+def _convert_svg(source: str, output: str) -> None:
+    """Converts svg to pdf by first installed program of SVG_CONVERTERS.
+
+    Args:
+        source (str): Path to svg.
+        output (str): Path to pdf.
+
+    Raises:
+        AssetError: When no converter is installed or conversion fails.
+    """
+    for program, args in SVG_CONVERTERS:
+        if shutil.which(program) is not None:
+            process = subprocess.run([program, *(arg.format(source=source, output=output) for arg in args)],
+                                     stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            if process.returncode != 0:
+                raise AssetError(f"{program} failed to convert {source}.")
+            return
+    raise AssetError(f"Converting {source} requires one of {', '.join(name for name, _ in SVG_CONVERTERS)}.")
+
+
+def _convert_raster(source: str, output: str, settings: AssetSettings) -> bool:
+    """Downsamples raster image and converts it to format readable by TeX.
+
+    Args:
+        source (str): Path to image.
+        output (str): Path to prepared image.
+        settings (AssetSettings): Settings of preparation.
+
+    Raises:
+        AssetError: When Pillow is not installed or image can not be read.
+
+    Returns:
+        bool: False if image is ready as it is and nothing was written.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        raise AssetError(f"Preparing {source} requires Pillow.") from None
+    try:
+        with Image.open(source) as image:
+            convert = path.splitext(source)[1].lower() in RASTER_CONVERSIONS
+            if image.width <= settings.max_pixels and not convert:
+                return False
+            if image.width > settings.max_pixels:
+                height = max(1, round(image.height * settings.max_pixels / image.width))
+                image = image.resize((settings.max_pixels, height), Image.LANCZOS)
+            if output.endswith(('.jpg', '.jpeg')):
+                image.convert('RGB').save(output, 'JPEG', quality=settings.quality, dpi=(settings.dpi, settings.dpi))
+            else:
+                if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+                image.save(output, 'PNG', optimize=True, dpi=(settings.dpi, settings.dpi))
+    except OSError as error:
+        raise AssetError(f"Can not prepare {source}: {error}") from error
+    return True
+
+
+def convert_image(source: str, output: str, settings: AssetSettings) -> str:
+    """Prepares one image.
+
+    Result is written to a temporary file first, which then atomically replaces output.
+
+    Args:
+        source (str): Path to image.
+        output (str): Path to prepared image.
+        settings (AssetSettings): Settings of preparation.
+
+    Raises:
+        AssetError: When image can not be converted.
+
+    Returns:
+        str: Path to prepared image, source if it needs no preparation.
+    """
+    suffix = path.splitext(source)[1].lower()
+    if suffix not in VECTOR_CONVERSIONS and suffix not in DOWNSAMPLED:
+        return source
+    directory, name = path.split(output)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=path.splitext(output)[1], dir=directory)
+    os.close(fd)
+    try:
+        if suffix in VECTOR_CONVERSIONS:
+            _convert_svg(source, tmp_path)
+        elif not _convert_raster(source, tmp_path, settings):
+            os.unlink(tmp_path)
+            return source
+        os.replace(tmp_path, output)
+    except BaseException:
+        if path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return output
+
+
+def prepare_assets(sources: Iterable[str], settings: Optional[AssetSettings] = None, jobs: Optional[int] = None,
+                   directory: Optional[str] = None) -> dict[str, str]:
+    """Prepares images for TeX in parallel.
+
+    All images are checked to exist before any conversion starts. Images with
+    identical content are prepared only once and prepared images are cached
+    in AssetCache under hash of source and settings, least recently used ones
+    are removed when it grows over its limit. Images which TeX reads as they
+    are, are used directly.
+
+    Args:
+        sources (Iterable[str]): Paths to images.
+        settings (AssetSettings | None, optional): Settings of preparation. Defaults to AssetSettings().
+        jobs (int | None, optional): Number of processes, number of CPUs if None. With 1, images are prepared in this process.
+        directory (str | None, optional): Directory of prepared images. Defaults to assets directory in cache directory.
+
+    Raises:
+        MissingAssetError: When some image does not exist.
+        AssetError: When image can not be converted.
+
+    Returns:
+        dict[str, str]: Paths to prepared images by paths to sources.
+    """
+    settings = settings or AssetSettings()
+    cache = AssetCache(directory)
+    sources = list(dict.fromkeys(sources))
+    missing = [source for source in sources if not path.isfile(source)]
+    if missing:
+        raise MissingAssetError(f"Referenced images do not exist: {', '.join(missing)}.")
+    by_key: dict[str, list[str]] = {}
+    for source in sources:
+        by_key.setdefault(asset_key(str(file_hash(source)), path.splitext(source)[1].lower(), settings), []).append(source)
+    prepared: dict[str, str] = {}
+    pending = []
+    for key, paths in by_key.items():
+        name = key + target_suffix(paths[0])
+        if cache.touch(name):
+            prepared.update(dict.fromkeys(paths, cache.path(name)))
+        else:
+            pending.append((paths, cache.path(name)))
+    if jobs == 1 or len(pending) <= 1:
+        results = [convert_image(paths[0], output, settings) for paths, output in pending]
+    else:
+        with ProcessPoolExecutor(jobs) as executor:
+            futures = [executor.submit(convert_image, paths[0], output, settings) for paths, output in pending]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in futures:
+                if future in done and future.exception() is not None:
+                    for other in futures:
+                        other.cancel()
+                    raise future.exception()
+            results = [future.result() for future in futures]
+    for (paths, _), result in zip(pending, results):
+        for source in paths:
+            prepared[source] = source if result == paths[0] else result
+    if pending:
+        # images of this document are used most recently, they are removed only if they alone exceed the limit
+        used = sum(path.getsize(output) for output in set(prepared.values()) if _is_cached(output, cache))
+        cache.prune(max(cache.max_size, used))
+    return prepared
+
+
+def _is_cached(file_path: str, cache: AssetCache) -> bool:
+    """Checks if file lies in directory of cache."""
+    return path.dirname(path.abspath(file_path)) == path.abspath(cache.directory)
@@ -1,16 +1,33 @@
 """Utilities for bibliography."""
 
-from typing import Optional, List
-from dataclasses import dataclass
-from mff_pytex.utils import File
+from typing import Any, Callable, Iterable, Iterator, Optional, TextIO
+from dataclasses import dataclass, field as dataclass_field, fields, MISSING
+from functools import lru_cache
+from operator import attrgetter
+from os import path
+import hashlib
+import os
+import pickle
+import re
+from mff_pytex.utils import BUFFER_SIZE, File, open_output, file_hash, get_cache_dir
+from mff_pytex.exceptions import DuplicateBibError
+from mff_pytex.escaping import escape as escape_latex
 from mff_pytex.packages import add_package, Package
 
 
-@dataclass
+@dataclass(slots=True)
 class Bib:
     """Abstract class for bibliography.
+
+    Attributes:
+        name (str): Key of record.
+        extra (dict[str, str]): Other fields, written as they are, e.g. doi or url.
+        entry_type (str | None): Type of entry written instead of the one of the class, e.g. for entries
+            of types without own class.
     """
     name: str
+    extra: dict[str, str] = dataclass_field(default_factory=dict, kw_only=True)
+    entry_type: Optional[str] = dataclass_field(default=None, kw_only=True)
 
     def __post_init__(self) -> None:
         add_package(Package('natbib'))
@@ -21,19 +38,47 @@ class Bib:
         Returns:
             str: Bib record
         """
-        text = '@' + self.__class__.__name__.lower() + '{'
-        for field in self.__dataclass_fields__:
-            if getattr(self, field) is not None:
-                if field == 'name':
-                    text += f"{getattr(self, field)},\n"
-                elif field == 'typ':
-                    text += f"  {field}e = \"{str(getattr(self, field))}\" ,\n"
-                else:
-                    text += f"  {field} = \"{str(getattr(self, field))}\" ,\n"
-        return text + '}'
-
-
-@dataclass
+        return self.render()
+
+    def render(self, escape: bool = False) -> str:
+        """Generate a record of given bibliography
+
+        Args:
+            escape (bool, optional): Escape LaTeX special characters in fields, except Raw ones. Defaults to False.
+
+        Returns:
+            str: Bib record
+        """
+        head, prefixes, values = _renderer(type(self))
+        if self.entry_type is not None:
+            head = f'@{self.entry_type}{{'
+        lines = [head, self.name, ',\n']
+        for prefix, value in zip(prefixes, values(self)):
+            if value is not None:
+                lines.append(f'{prefix}{escape_latex(value) if escape else value}" ,\n')
+        for key, value in self.extra.items():
+            lines.append(f'  {key} = {{{value}}} ,\n')
+        lines.append('}')
+        return ''.join(lines)
+
+
+@lru_cache(maxsize=None)
+def _renderer(cls: type[Bib]) -> tuple[str, tuple[str, ...], Callable[[Bib], Any]]:
+    """Prepares rendering of records of given class.
+
+    Args:
+        cls (type[Bib]): Class of record.
+
+    Returns:
+        tuple: Head of record, beginning of line of every field and function returning values of fields.
+    """
+    names = tuple(field.name for field in fields(cls) if field.name not in _META_FIELDS)
+    prefixes = tuple(f'  {_BIB_NAMES.get(name, name)} = "' for name in names)
+    # name is appended so that getter always returns tuple, zip with prefixes drops it
+    return f'@{ENTRY_TYPES.get(cls, cls.__name__.lower())}{{', prefixes, attrgetter(*names, 'name')
+
+
+@dataclass(slots=True)
 class Article(Bib):
     """An article from a magazine or a journal.
     """
@@ -48,7 +93,7 @@ class Article(Bib):
     volume: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Book(Bib):
     """A published book
     """
@@ -66,7 +111,7 @@ class Book(Bib):
     volume: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Booklet(Bib):
     """A bound work without a named publisher or sponsor.
     """
@@ -78,7 +123,7 @@ class Booklet(Bib):
     note: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Conference(Bib):
     """Equal to inproceedings
     """
@@ -98,7 +143,7 @@ class Conference(Bib):
     note: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class InBook(Bib):
     """A section of a book without its own title.
     """
@@ -118,7 +163,7 @@ class InBook(Bib):
     volume: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class InCollection(Bib):
     """A section of a book having its own title.
     """
@@ -143,10 +188,10 @@ class InCollection(Bib):
 class InProceedings(Conference):
     """An article in a conference proceedings.
     """
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class Manual(Bib):
     """Technical manual.
     """
@@ -160,7 +205,7 @@ class Manual(Bib):
     note: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class MasterThesis(Bib):
     """Master's thesis.
     """
@@ -174,7 +219,7 @@ class MasterThesis(Bib):
     note: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Misc(Bib):
     """Template useful for other kinds of publication.
     """
@@ -189,10 +234,10 @@ class Misc(Bib):
 class PhdThesis(MasterThesis):
     """Ph.D. thesis.
     """
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class Proceedings(Bib):
     """The proceedings of a conference.
     """
@@ -209,7 +254,7 @@ class Proceedings(Bib):
     note: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class TechReport(Bib):
     """Technical report from educational, commercial or standardization institution.
     """
@@ -224,7 +269,7 @@ class TechReport(Bib):
     note: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Unpublished(Bib):
     """An unpublished article, book, thesis, etc.
     """
@@ -235,30 +280,382 @@ class Unpublished(Bib):
     year: Optional[int] = None
 
 
+BIB_TYPES: dict[str, type[Bib]] = {cls.__name__.lower(): cls for cls in (
+    Article, Book, Booklet, Conference, InBook, InCollection, InProceedings, Manual,
+    MasterThesis, Misc, PhdThesis, Proceedings, TechReport, Unpublished)}
+"""Classes of records by names of entry types in .bib file."""
+BIB_TYPES['mastersthesis'] = MasterThesis
+
+ENTRY_TYPES: dict[type[Bib], str] = {MasterThesis: 'mastersthesis'}
+"""Names of entry types written for classes whose name differs from bibtex."""
+
+MONTHS = {month[:3].lower(): month for month in (
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December')}
+"""Predefined month macros of bibtex."""
+
+_BIB_NAMES = {'typ': 'type', 'page': 'pages'}
+_FIELD_ALIASES = {'typ': ('type',), 'page': ('pages', 'page')}
+_META_FIELDS = frozenset({'name', 'extra', 'entry_type'})
+_INT_FIELDS = frozenset({'year', 'number'})
+
+_ENTRY_START = re.compile(r'@\s*(\w+)\s*([{(])')
+_DELIMITERS = re.compile(r'[{}()]')
+_FIELD_NAME = re.compile(r'\s*([^\s=,{}"#]+)\s*=\s*')
+_SIMPLE_FIELD = re.compile(r'\s*([^\s=,{}"#]+)\s*=\s*(?:\{([^{}]*)\}|"([^"{}]*)"|(\d+))\s*(?:,|$)')
+_BARE_VALUE = re.compile(r'[^\s,#{}"]+')
+_QUOTE_DELIMITERS = re.compile(r'[{}"]')
+_SEPARATOR = re.compile(r'\s*([#,]?)\s*')
+
+
+def _read_entries(fp: TextIO) -> Iterator[tuple[str, str]]:
+    """Reads entries of .bib file in one pass, block by block.
+
+    Args:
+        fp (TextIO): Opened .bib file.
+
+    Yields:
+        tuple[str, str]: Lowercase type of entry and its body without delimiters.
+    """
+    buffer = ''
+    position = 0
+    eof = False
+
+    def read(keep: int) -> int:
+        """Drops text before keep and reads next block, returns number of dropped characters."""
+        nonlocal buffer, eof
+        block = fp.read(BUFFER_SIZE)
+        eof = not block
+        buffer = buffer[keep:] + block
+        return keep
+
+    while True:
+        match = _ENTRY_START.search(buffer, position)
+        if match is None:
+            if eof:
+                return
+            at = buffer.rfind('@', max(position, len(buffer) - 64))
+            read(at if at >= 0 else len(buffer))  # keep start of entry split by block
+            position = 0
+            continue
+        closing = ')' if match.group(2) == '(' else '}'
+        start, scan, depth, end = match.start(), match.end(), 0, -1
+        while end < 0:
+            for token in _DELIMITERS.finditer(buffer, scan):
+                char = token.group()
+                if depth == 0 and char == closing:
+                    end = token.start()
+                    break
+                elif char == '{':
+                    depth += 1
+                elif char == '}':
+                    depth -= 1
+            else:
+                if eof:
+                    return  # unterminated entry
+                scanned = len(buffer)
+                scan, start = scanned - read(start), 0
+                match = _ENTRY_START.match(buffer)
+        yield match.group(1).lower(), buffer[match.end():end]
+        position = end + 1
+
+
+def _parse_value(body: str, position: int, macros: dict[str, str]) -> tuple[str, int]:
+    """Parses value of field, which may be concatenated by #.
+
+    Args:
+        body (str): Body of entry.
+        position (int): Start of value.
+        macros (dict[str, str]): Known string macros.
+
+    Returns:
+        tuple[str, int]: Value and position after it.
+    """
+    parts = []
+    while position < len(body):
+        char = body[position]
+        if char in '{"':
+            depth = 0
+            delimiters = _DELIMITERS if char == '{' else _QUOTE_DELIMITERS
+            for token in delimiters.finditer(body, position + 1):
+                found = token.group()
+                if found == '{':
+                    depth += 1
+                elif depth == 0 and (found == '}' if char == '{' else found == '"'):
+                    break
+                elif found == '}':
+                    depth -= 1
+            else:
+                token = None
+            end = token.start() if token is not None else len(body)
+            parts.append(body[position + 1:end])
+            position = end + 1
+        else:
+            bare = _BARE_VALUE.match(body, position)
+            if bare is None:
+                break
+            word = bare.group()
+            parts.append(word if word.isdigit() else macros.get(word.lower(), word))
+            position = bare.end()
+        separator = _SEPARATOR.match(body, position)
+        position = separator.end()
+        if separator.group(1) != '#':
+            break
+    return ' '.join(''.join(parts).split()), position
+
+
+def _parse_fields(body: str, position: int, macros: dict[str, str]) -> dict[str, str]:
+    """Parses fields of entry.
+
+    Args:
+        body (str): Body of entry.
+        position (int): Start of first field.
+        macros (dict[str, str]): Known string macros.
+
+    Returns:
+        dict[str, str]: Lowercase names of fields and their values.
+    """
+    values = {}
+    while True:
+        match = _SIMPLE_FIELD.match(body, position)
+        if match is not None:
+            values[match.group(1).lower()] = ' '.join(match.group(match.lastindex).split())
+            position = match.end()
+            continue
+        match = _FIELD_NAME.match(body, position)
+        if match is None:
+            return values
+        value, position = _parse_value(body, match.end(), macros)
+        values[match.group(1).lower()] = value
+
+
+@lru_cache(maxsize=None)
+def _record_fields(cls: type[Bib]) -> tuple[tuple[str, tuple[str, ...], bool], ...]:
+    """Describes fields of record class for parser.
+
+    Args:
+        cls (type[Bib]): Class of record.
+
+    Returns:
+        tuple: Name of field, names of corresponding fields in .bib file and whether field is required.
+    """
+    return tuple((field.name, _FIELD_ALIASES.get(field.name, (field.name,)), field.default is MISSING)
+                 for field in fields(cls) if field.name not in _META_FIELDS)
+
+
+def _make_record(typ: str, name: str, values: dict[str, str]) -> Bib:
+    """Creates record of given type.
+
+    Entries of unknown types or missing required fields become Misc records
+    keeping their type. Fields which class of record does not have are kept
+    in extra, so record is written back with all its fields.
+
+    Args:
+        typ (str): Lowercase type of entry.
+        name (str): Key of entry.
+        values (dict[str, str]): Fields of entry.
+
+    Returns:
+        Bib: Record.
+    """
+    cls = BIB_TYPES.get(typ)
+    for candidate in (cls, Misc):
+        if candidate is None:
+            continue
+        kwargs: dict[str, Any] = {}
+        used = set()
+        for field, keys, required in _record_fields(candidate):
+            for key in keys:
+                value = values.get(key)
+                if value is not None:
+                    used.add(key)
+                    break
+            if value is None:
+                if required:
+                    break
+                continue
+            kwargs[field] = int(value) if field in _INT_FIELDS and value.isdigit() else value
+        else:
+            extra = {key: value for key, value in values.items() if key not in used}
+            written = ENTRY_TYPES.get(candidate, candidate.__name__.lower())
+            return candidate(name, **kwargs, extra=extra, entry_type=None if typ == written else typ)
+    raise AssertionError('Misc has no required fields')  # pragma: no cover
+
+
+def parse_bib(fp: TextIO) -> Iterator[Bib]:
+    """Parses records of .bib file in one pass.
+
+    Entries of unknown types and entries missing required fields become Misc records of their type.
+    String macros are expanded, comments and preambles are skipped.
+
+    Args:
+        fp (TextIO): Opened .bib file.
+
+    Yields:
+        Bib: Successive records.
+    """
+    macros = dict(MONTHS)
+    for typ, body in _read_entries(fp):
+        if typ in ('comment', 'preamble'):
+            continue
+        if typ == 'string':
+            macros.update((key, value) for key, value in _parse_fields(body, 0, macros).items())
+            continue
+        comma = body.find(',')
+        if comma < 0:
+            continue
+        yield _make_record(typ, body[:comma].strip(), _parse_fields(body, comma + 1, macros))
+
+
+BIB_CACHE_VERSION = 3
+"""Version of format of cached records, cache of other versions is ignored."""
+
+
+def load_bib(file_path: str, cache: bool = True) -> list[Bib]:
+    """Loads records of .bib file.
+
+    Parsed records are cached on disk. Cache is used while modification time and size
+    of the file are unchanged, or when its content has the same hash.
+
+    Args:
+        file_path (str): Path to .bib file.
+        cache (bool, optional): Use and update cache of parsed records. Defaults to True.
+
+    Returns:
+        list[Bib]: Records in order of the file.
+    """
+    add_package(Package('natbib'))
+    if not cache:
+        with open(file_path, encoding='utf-8') as fp:
+            return list(parse_bib(fp))
+    file_path = path.abspath(file_path)
+    stat = os.stat(file_path)
+    cache_path = path.join(get_cache_dir('bib'), hashlib.sha256(file_path.encode()).hexdigest() + '.pickle')
+    state = None
+    if path.isfile(cache_path):
+        try:
+            with open(cache_path, 'rb') as fp:
+                state = pickle.load(fp)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, TypeError):
+            state = None
+    if state is not None and state.get('version') != BIB_CACHE_VERSION:
+        state = None
+    if state is not None and (state['mtime'], state['size']) == (stat.st_mtime_ns, stat.st_size):
+        return state['records']
+    digest = file_hash(file_path)
+    if state is None or state['hash'] != digest:
+        with open(file_path, encoding='utf-8') as fp:
+            records = list(parse_bib(fp))
+    else:
+        records = state['records']
+    state = {'version': BIB_CACHE_VERSION, 'mtime': stat.st_mtime_ns, 'size': stat.st_size,
+             'hash': digest, 'records': records}
+    with open_output(cache_path, 'wb') as fp:
+        pickle.dump(state, fp, pickle.HIGHEST_PROTOCOL)
+    return records
+
+
 class Bibliography(File):
     """Bib file
 
+    Records are indexed by their names, so lookup and detection of duplicates are fast.
+
+    Attributes:
+        records (dict[str, Bib]): Records by their names, in order of adding.
+        documents (list[Document]): Documents which use this bibliography, see Document.bibliography.
+
     Note:
         Requires natbib package to import, added with autopackage management.
     """
     file_type = 'bib'
-    bib_list: List[Bib] = []
 
-    def create(self, mode: str = 'w+') -> None:
+    def __init__(self, file_name: str, escape: bool = False) -> None:
+        """Initialize Bibliography
+
+        Args:
+            file_name (str): Name of file which will be created.
+            escape (bool, optional): Escape LaTeX special characters in fields of records, except Raw ones. Defaults to False.
+        """
+        super().__init__(file_name)
+        self.records: dict[str, Bib] = {}
+        self.escape = escape
+        self.documents: list = []
+
+    @property
+    def bib_list(self) -> tuple[Bib, ...]:
+        """Records in order of adding, read-only, add them by add."""
+        return tuple(self.records.values())
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.records
+
+    def __getitem__(self, name: str) -> Bib:
+        return self.records[name]
+
+    def __iter__(self) -> Iterator[Bib]:
+        return iter(self.records.values())
+
+    def cited(self) -> dict[str, None]:
+        """Keys cited by documents which use this bibliography, in order of citing.
+
+        Returns:
+            dict[str, None]: Cited keys as ordered set.
+        """
+        keys: dict[str, None] = {}
+        for document in self.documents:
+            keys.update(document.citations)
+        return keys
+
+    def create(self, mode: str = 'w+', only_cited: bool = False, cited: Optional[Iterable[str]] = None) -> None:
         """Creates .bib file
 
+        Records are streamed to the file one by one. With only_cited, only records
+        cited by documents which use this bibliography are written, in order of citing.
+
         Args:
             mode (str, optional): Mode of given file. Same as open() function. Defaults to 'w+'
+            only_cited (bool, optional): Write only cited records. Defaults to False.
+            cited (Iterable[str] | None, optional): Keys to write instead of cited ones. Defaults to None.
         """
-        bib = open(self.file_path, mode)
-        bib.write(*map(str, self.bib_list))
-        bib.close()
+        if cited is not None:
+            records = (self.records[key] for key in dict.fromkeys(cited) if key in self.records)
+        elif only_cited:
+            records = (self.records[key] for key in self.cited() if key in self.records)
+        else:
+            records = iter(self.records.values())
+        with open_output(self.file_path, mode) as bib:
+            bib.writelines(f"{record.render(self.escape)}\n" for record in records)
+
+    def load(self, file_path: str, cache: bool = True) -> None:
+        """Adds records of existing .bib file, see load_bib.
+
+        Args:
+            file_path (str): Path to .bib file.
+            cache (bool, optional): Use and update cache of parsed records. Defaults to True.
+
+        Raises:
+            DuplicateBibError: Different record with the same name was already added.
+        """
+        self.add(*load_bib(file_path, cache))
 
     def add(self, *bibs: Bib) -> None:
         """Adds a book, etc. to the list of bibliohraphy.
 
+        Record equal to already added one is skipped.
+
         Args:
             *bibs (Bib): A Bib object
+
+        Raises:
+            DuplicateBibError: Different record with the same name was already added.
         """
+        records = self.records
         for bib in bibs:
-            self.bib_list.append(bib)
+            other = records.get(bib.name)
+            if other is None:
+                records[bib.name] = bib
+            elif other != bib:
+                raise DuplicateBibError(f"Bibliography already contains a different record named '{bib.name}'.")
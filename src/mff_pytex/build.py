@@ -0,0 +1,971 @@
+"""Incremental compilation of TeX files to pdf."""
+
+from typing import Optional, Any, Generator, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from weakref import WeakKeyDictionary
+import asyncio
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+from os import path
+from functools import lru_cache
+from mff_pytex.cache import FormatCache, PdfCache
+from mff_pytex.events import BuildEvent, BuildHook, emit, get_hooks
+from mff_pytex.exceptions import CompilationError, CompilationTimeoutError, UnknownEngineError
+from mff_pytex.logs import RERUN_PATTERN, LogReport, read_log
+from mff_pytex.utils import file_hash
+
+
+BIB_PATTERN = re.compile(r"^\\(?:citation|bibdata|bibstyle)\{.*\}$", re.MULTILINE)
+"""Lines of aux file which are read by bibtex."""
+
+DEPENDENCY_PATTERN = re.compile(r"\\(bibliography|includegraphics|include|input)(?:\[[^\]]*\])?\{([^}]*)\}")
+"""Commands of TeX file which read bib files, images and other TeX files."""
+
+AUX_INPUT_PATTERN = re.compile(r"^\\@input\{(.*)\}$", re.MULTILINE)
+"""Lines of aux file which read aux files of included TeX files."""
+
+GRAPHICS_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.eps')
+"""Extensions tried for images included without extension."""
+
+
+@dataclass(frozen=True)
+class Engine:
+    """TeX engine and its command line conventions.
+
+    Attributes:
+        name (str): Name of executable.
+        draft (tuple[str, ...]): Arguments of pass which does not write pdf.
+        options (tuple[str, ...]): Arguments used for every pass.
+        ini (tuple[str, ...] | None): Arguments dumping preamble to format, None if not supported.
+    """
+    name: str
+    draft: tuple[str, ...]
+    options: tuple[str, ...] = ('-interaction=nonstopmode', '-halt-on-error')
+    ini: Optional[tuple[str, ...]] = None
+
+    def args(self, tex_path: str, draft: bool = False, fmt: Optional[str] = None, output_dir: Optional[str] = None) -> list[str]:
+        """Returns command line of one pass.
+
+        Args:
+            tex_path (str): Path to TeX file.
+            draft (bool, optional): Run pass without writing pdf. Defaults to False.
+            fmt (str | None, optional): Name of precompiled format to load. Defaults to None.
+            output_dir (str | None, optional): Directory for output files. Defaults to None.
+
+        Returns:
+            list[str]: Program and its arguments.
+        """
+        args = [self.name, *self.options]
+        if draft:
+            args.extend(self.draft)
+        if fmt is not None:
+            args.append(f"-fmt={fmt}")
+        if output_dir is not None:
+            args.append(f"-output-directory={output_dir}")
+        args.append(tex_path)
+        return args
+
+    def ini_args(self, tex_path: str, fmt: str, directory: str) -> list[str]:
+        """Returns command line dumping preamble of TeX file to format.
+
+        Args:
+            tex_path (str): Path to TeX file.
+            fmt (str): Name of format.
+            directory (str): Directory where format is written.
+
+        Returns:
+            list[str]: Program and its arguments.
+        """
+        return [self.name, *self.options, f"-jobname={fmt}", f"-output-directory={directory}", *(self.ini or ()), tex_path]
+
+    def version(self) -> Optional[str]:
+        """Returns version of installed engine.
+
+        Returns:
+            str | None: First line printed by --version, None if engine is not installed.
+        """
+        return engine_version(self.name)
+
+
+@lru_cache(maxsize=None)
+def engine_version(name: str) -> Optional[str]:
+    """Returns version of installed program, it is asked only once.
+
+    Args:
+        name (str): Name of executable.
+
+    Returns:
+        str | None: First line printed by --version, None if program is not installed.
+    """
+    try:
+        process = subprocess.run([name, '--version'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, text=True, errors='replace')
+    except OSError:
+        return None
+    return process.stdout.partition('\n')[0].strip()
+
+
+ENGINES = {
+    'pdflatex': Engine('pdflatex', ('-draftmode',), ini=('-ini', '&pdflatex', 'mylatexformat.ltx')),
+    'xelatex': Engine('xelatex', ('-no-pdf',), ini=('-ini', '&xelatex', 'mylatexformat.ltx')),
+    'lualatex': Engine('lualatex', ('--draftmode',)),
+}
+"""Supported TeX engines by name."""
+
+
+def get_engine(engine: str | Engine) -> Engine:
+    """Returns engine of given name.
+
+    Args:
+        engine (str | Engine): Name of engine or engine itself.
+
+    Raises:
+        UnknownEngineError: When engine is not supported.
+
+    Returns:
+        Engine: TeX engine.
+    """
+    if isinstance(engine, Engine):
+        return engine
+    try:
+        return ENGINES[engine]
+    except KeyError:
+        raise UnknownEngineError(f"Unknown TeX engine {engine}, use one of {', '.join(ENGINES)}.") from None
+
+
+def read_text(file_path: str) -> str:
+    """Returns content of text file or empty string, if file does not exist.
+
+    Args:
+        file_path (str): Path to file.
+
+    Returns:
+        str: Content of file.
+    """
+    if not path.isfile(file_path):
+        return ''
+    with open(file_path, encoding='utf-8', errors='replace') as fp:
+        return fp.read()
+
+
+class Build:
+    """Incremental build of single TeX file.
+
+    State of the last build is stored in the output directory. Compilation is
+    skipped when the output is up to date, bibtex runs only when citations or
+    bib files change and the engine is run again only while the aux file keeps
+    changing or the log file requests a rerun. Passes which only settle
+    references run in draft mode and do not write pdf.
+
+    With precompile, preamble is dumped with mylatexformat to a format file
+    in FormatCache under hash of the preamble, so packages are not loaded
+    again on every pass while the preamble stays the same. Formats of other
+    preambles are kept until the cache grows over its limit, so documents
+    sharing the cache do not remove formats of each other.
+
+    With cache, built pdf is stored in PdfCache under hash of TeX file, bib
+    files and images it reads, and engine with its version. When the same
+    sources are built again, cached pdf is linked into place without compiling.
+
+    Every step of the build emits BuildEvent with its duration to hooks, events
+    of the last run are kept in events. The same steps are run by run, which
+    blocks, and by run_async, which awaits programs on event loop.
+
+    Attributes:
+        tex_path (str): Path to TeX file.
+        engine (Engine): TeX engine.
+        draft (bool): Run intermediate passes in draft mode.
+        max_passes (int): Maximal number of engine passes.
+        precompile (bool): Load preamble from cached precompiled format.
+        formats (FormatCache | None): Cache of precompiled formats, None without precompile.
+        output_dir (str): Directory for pdf and auxiliary files.
+        cache (PdfCache | None): Cache of compiled pdf files.
+        pass_timeout (float | None): Limit of duration of one program run in seconds.
+        timeout (float | None): Limit of duration of the whole build in seconds.
+        hooks (list[BuildHook]): Hooks receiving events.
+        events (list[BuildEvent]): Events of the last run.
+        returncode (int | None): Return code of the last program run.
+    """
+
+    def __init__(self, tex_path: str, engine: str | Engine = 'pdflatex', draft: bool = True, max_passes: int = 5,
+                 precompile: bool = False, output_dir: Optional[str] = None, cache: bool | PdfCache = False,
+                 pass_timeout: Optional[float] = None, timeout: Optional[float] = None,
+                 hooks: Optional[Iterable[BuildHook]] = None) -> None:
+        """Initialize Build.
+
+        Args:
+            tex_path (str): Path to TeX file.
+            engine (str | Engine, optional): TeX engine, one of ENGINES. Defaults to 'pdflatex'.
+            draft (bool, optional): Run intermediate passes in draft mode. Defaults to True.
+            max_passes (int, optional): Maximal number of engine passes. Defaults to 5.
+            precompile (bool, optional): Load preamble from cached precompiled format. Defaults to False.
+            output_dir (str | None, optional): Directory for pdf and auxiliary files. Defaults to directory of TeX file.
+            cache (bool | PdfCache, optional): Reuse pdf compiled from the same sources, True for default PdfCache.
+                Defaults to False.
+            pass_timeout (float | None, optional): Limit of duration of one program run in seconds. Defaults to None.
+            timeout (float | None, optional): Limit of duration of the whole build in seconds. Defaults to None.
+            hooks (Iterable[BuildHook] | None, optional): Hooks receiving events. Defaults to hooks registered by add_hook.
+        """
+        self.tex_path = path.abspath(tex_path)
+        self.engine = get_engine(engine)
+        self.draft = draft
+        self.max_passes = max_passes
+        self.precompile = precompile
+        self.formats = FormatCache() if precompile else None
+        self.fmt: Optional[str] = None
+        self.directory, name = path.split(self.tex_path)
+        self.job_name = path.splitext(name)[0]
+        self.output_dir = self.directory if output_dir is None else path.abspath(output_dir)
+        self.cache = PdfCache() if cache is True else cache or None
+        self.pass_timeout = pass_timeout
+        self.timeout = timeout
+        self.hooks = get_hooks() if hooks is None else list(hooks)
+        self.events: list[BuildEvent] = []
+        self.returncode: Optional[int] = None
+        self._deadline: Optional[float] = None
+        self._key: Optional[str] = None
+
+    def job_file(self, extension: str) -> str:
+        """Returns path to file of this job with given extension.
+
+        Args:
+            extension (str): Extension of file, eg. 'aux'.
+
+        Returns:
+            str: Path to file.
+        """
+        return path.join(self.output_dir, f"{self.job_name}.{extension}")
+
+    def load_state(self) -> dict[str, Any]:
+        """Returns state of the last build.
+
+        Returns:
+            dict[str, Any]: Stored state, empty if there is none.
+        """
+        try:
+            with open(self.job_file('mff_pytex.json')) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self, state: dict[str, Any]) -> None:
+        """Stores state of the build.
+
+        Args:
+            state (dict[str, Any]): State to store.
+        """
+        with open(self.job_file('mff_pytex.json'), 'w') as fp:
+            json.dump(state, fp)
+
+    def bib_files(self) -> list[str]:
+        """Returns paths to bib files used by document according to aux file.
+
+        Returns:
+            list[str]: Paths to bib files.
+        """
+        files = []
+        for match in re.finditer(r"^\\bibdata\{(.*)\}$", read_text(self.job_file('aux')), re.MULTILINE):
+            for name in match.group(1).split(','):
+                name = name.strip()
+                if not name.endswith('.bib'):
+                    name += '.bib'
+                files.append(path.join(self.directory, name))
+        return files
+
+    def inputs(self) -> dict[str, Optional[str]]:
+        """Returns hashes of files the output depends on.
+
+        Returns:
+            dict[str, str | None]: Hashes of TeX file, bib files and images.
+        """
+        inputs = {self.tex_path: file_hash(self.tex_path)}
+        for dependency in [*self.bib_files(), *self.dependencies()]:
+            inputs[dependency] = file_hash(dependency)
+        return inputs
+
+    def dependencies(self) -> list[str]:
+        """Returns paths to bib files, images and TeX files read by TeX file.
+
+        TeX files read by include and input commands are searched too.
+
+        Returns:
+            list[str]: Paths to files, which may not exist.
+        """
+        files: list[str] = []
+        pending = [self.tex_path]
+        while pending:
+            for command, names in DEPENDENCY_PATTERN.findall(read_text(pending.pop())):
+                for name in names.split(',') if command == 'bibliography' else [names]:
+                    file_path = path.join(self.directory, name.strip())
+                    if command == 'bibliography':
+                        if not file_path.endswith('.bib'):
+                            file_path += '.bib'
+                    elif command in ('include', 'input'):
+                        if not path.splitext(file_path)[1]:
+                            file_path += '.tex'
+                        if file_path in files or file_path == self.tex_path:
+                            continue
+                        pending.append(file_path)
+                    elif not path.splitext(file_path)[1]:
+                        file_path = next((file_path + extension for extension in GRAPHICS_EXTENSIONS
+                                          if path.isfile(file_path + extension)), file_path)
+                    files.append(file_path)
+        return files
+
+    def aux_files(self) -> list[str]:
+        """Returns paths to aux file and aux files of included TeX files.
+
+        Returns:
+            list[str]: Paths to aux files, which may not exist.
+        """
+        aux = self.job_file('aux')
+        return [aux, *(path.join(self.output_dir, name) for name in AUX_INPUT_PATTERN.findall(read_text(aux)))]
+
+    def cache_key(self) -> str:
+        """Returns key of pdf in cache.
+
+        Returns:
+            str: Hash of TeX file, files it reads and engine with its version.
+        """
+        digest = hashlib.sha256(f"{self.engine.name}\n{self.engine.version()}\n".encode())
+        digest.update(str(file_hash(self.tex_path)).encode())
+        for dependency in self.dependencies():
+            digest.update(f"\n{path.relpath(dependency, self.directory)}:{file_hash(dependency)}".encode())
+        return digest.hexdigest()
+
+    def bib_key(self) -> Optional[str]:
+        """Returns hash of everything bibtex reads.
+
+        Returns:
+            str | None: Hash of citations and bib files, None if document has no bibliography.
+        """
+        lines = [line for aux in self.aux_files() for line in BIB_PATTERN.findall(read_text(aux))]
+        if not any(line.startswith('\\bibdata') for line in lines):
+            return None
+        digest = hashlib.sha256('\n'.join(lines).encode())
+        for bib in self.bib_files():
+            digest.update(str(file_hash(bib)).encode())
+        return digest.hexdigest()
+
+    def up_to_date(self) -> bool:
+        """Checks if pdf was built from current inputs.
+
+        Returns:
+            bool: True if compilation can be skipped.
+        """
+        state = self.load_state()
+        return (path.isfile(self.job_file('pdf'))
+                and state.get('complete', False)
+                and state.get('engine') == self.engine.name
+                and state.get('inputs') == self.inputs())
+
+    def rerun_requested(self) -> bool:
+        """Checks if log of the last pass asks for another pass.
+
+        Returns:
+            bool: True if another pass is needed.
+        """
+        return RERUN_PATTERN.search(read_text(self.job_file('log'))) is not None
+
+    def preamble_key(self) -> str:
+        """Returns hash of preamble of TeX file and engine.
+
+        Returns:
+            str: Hex digest of everything before beginning of document.
+        """
+        digest = hashlib.sha256(self.engine.name.encode())
+        with open(self.tex_path, 'rb') as fp:
+            for line in fp:
+                if line.strip() == b'\\begin{document}':
+                    break
+                digest.update(line)
+        return digest.hexdigest()
+
+    def format_name(self) -> Optional[str]:
+        """Returns name of precompiled format of preamble.
+
+        Returns:
+            str | None: Name of format, None if engine does not support formats.
+        """
+        if self.engine.ini is None:
+            return None
+        return self.preamble_key()
+
+    def dump_format(self, fmt: str) -> None:
+        """Dumps preamble to precompiled format.
+
+        Args:
+            fmt (str): Name of format.
+        """
+        self._call(self.engine.ini_args(self.tex_path, fmt, self._formats().directory), 'log')
+
+    async def dump_format_async(self, fmt: str) -> None:
+        """Dumps preamble to precompiled format, see dump_format.
+
+        Args:
+            fmt (str): Name of format.
+        """
+        await self._call_async(self.engine.ini_args(self.tex_path, fmt, self._formats().directory), 'log')
+
+    def _formats(self) -> FormatCache:
+        """Returns cache of formats, created when precompile was set after initialization."""
+        if self.formats is None:
+            self.formats = FormatCache()
+        return self.formats
+
+    def engine_args(self, draft: bool = False) -> list[str]:
+        """Returns command line of one pass of TeX engine.
+
+        Args:
+            draft (bool, optional): Run pass without writing pdf. Defaults to False.
+
+        Returns:
+            list[str]: Program and its arguments.
+        """
+        output_dir = None if self.output_dir == self.directory else self.output_dir
+        return self.engine.args(self.tex_path, draft, self.fmt, output_dir)
+
+    def run_engine(self, draft: bool = False) -> None:
+        """Runs one pass of TeX engine.
+
+        Args:
+            draft (bool, optional): Run pass without writing pdf. Defaults to False.
+        """
+        self._call(self.engine_args(draft), 'log')
+
+    async def run_engine_async(self, draft: bool = False) -> None:
+        """Runs one pass of TeX engine, see run_engine.
+
+        Args:
+            draft (bool, optional): Run pass without writing pdf. Defaults to False.
+        """
+        await self._call_async(self.engine_args(draft), 'log')
+
+    def run_bibtex(self) -> None:
+        """Runs bibtex."""
+        self._call(['bibtex', self.job_name], 'blg', allowed=1, cwd=self.output_dir)
+
+    async def run_bibtex_async(self) -> None:
+        """Runs bibtex, see run_bibtex."""
+        await self._call_async(['bibtex', self.job_name], 'blg', allowed=1, cwd=self.output_dir)
+
+    def environment(self) -> dict[str, str]:
+        """Returns environment variables for TeX programs.
+
+        Returns:
+            dict[str, str]: Environment in which programs run.
+        """
+        env = dict(os.environ)
+        # Empty component at the end of search path stands for default path.
+        env['BIBINPUTS'] = self.directory + os.pathsep + env.get('BIBINPUTS', '')
+        if self.precompile:
+            env['TEXFORMATS'] = self._formats().directory + os.pathsep + env.get('TEXFORMATS', '')
+        return env
+
+    def report(self) -> LogReport:
+        """Parses log files of the last run.
+
+        Returns:
+            LogReport: Content of log of TeX engine, with errors and warnings of bibtex appended.
+        """
+        report = read_log(self.job_file('log'))
+        bibtex = read_log(self.job_file('blg'))
+        report.errors.extend(bibtex.errors)
+        report.warnings.extend(bibtex.warnings)
+        report.undefined_citations.extend(key for key in bibtex.undefined_citations
+                                          if key not in report.undefined_citations)
+        return report
+
+    def _time_left(self) -> Optional[float]:
+        """Returns limit of duration of next program run.
+
+        Raises:
+            CompilationTimeoutError: When the whole build is out of time.
+
+        Returns:
+            float | None: Seconds, None if there is no limit.
+        """
+        if self._deadline is None:
+            return self.pass_timeout
+        left = self._deadline - time.monotonic()
+        if left <= 0:
+            raise CompilationTimeoutError(f"Build of {self.tex_path} exceeded {self.timeout} s.")
+        return left if self.pass_timeout is None else min(left, self.pass_timeout)
+
+    def _failure(self, args: list[str], log: str, allowed: int) -> None:
+        """Checks return code of the last program run.
+
+        Raises:
+            CompilationError: When program failed.
+        """
+        if self.returncode is not None and self.returncode > allowed:
+            raise CompilationError(f"{args[0]} failed on {self.tex_path}, see {self.job_file(log)}.")
+
+    def _call(self, args: list[str], log: str, allowed: int = 0, cwd: Optional[str] = None) -> None:
+        """Calls external program.
+
+        Args:
+            args (list[str]): Program and its arguments.
+            log (str): Extension of log file written by program.
+            allowed (int, optional): Greatest return code which is not an error. Defaults to 0.
+            cwd (str | None, optional): Working directory. Defaults to directory of TeX file.
+
+        Raises:
+            CompilationError: When program fails.
+            CompilationTimeoutError: When program runs out of time.
+        """
+        try:
+            process = subprocess.run(args, cwd=cwd or self.directory, stdin=subprocess.DEVNULL, env=self.environment(),
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=self._time_left())
+        except subprocess.TimeoutExpired:
+            self.returncode = None
+            raise CompilationTimeoutError(f"{args[0]} timed out on {self.tex_path}, see {self.job_file(log)}.") from None
+        self.returncode = process.returncode
+        self._failure(args, log, allowed)
+
+    async def _call_async(self, args: list[str], log: str, allowed: int = 0, cwd: Optional[str] = None) -> None:
+        """Calls external program without blocking event loop, see _call.
+
+        When waiting is cancelled or times out, the program is killed.
+
+        Args:
+            args (list[str]): Program and its arguments.
+            log (str): Extension of log file written by program.
+            allowed (int, optional): Greatest return code which is not an error. Defaults to 0.
+            cwd (str | None, optional): Working directory. Defaults to directory of TeX file.
+
+        Raises:
+            CompilationError: When program fails.
+            CompilationTimeoutError: When program runs out of time.
+        """
+        process = await asyncio.create_subprocess_exec(*args, cwd=cwd or self.directory, stdin=subprocess.DEVNULL,
+                                                       env=self.environment(), stdout=subprocess.DEVNULL,
+                                                       stderr=subprocess.DEVNULL)
+        try:
+            self.returncode = await asyncio.wait_for(process.wait(), self._time_left())
+        except asyncio.TimeoutError:
+            self.returncode = None
+            raise CompilationTimeoutError(f"{args[0]} timed out on {self.tex_path}, see {self.job_file(log)}.") from None
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await asyncio.shield(process.wait())
+        self._failure(args, log, allowed)
+
+    def _emit(self, name: str, duration: float, index: int = 0, draft: bool = False) -> None:
+        """Records event and delivers it to hooks.
+
+        Args:
+            name (str): Step.
+            duration (float): Duration of step in seconds.
+            index (int, optional): Number of engine pass. Defaults to 0.
+            draft (bool, optional): Engine pass ran in draft mode. Defaults to False.
+        """
+        event = BuildEvent(name, self.job_name, duration, index, draft)
+        self.events.append(event)
+        emit(event, self.hooks)
+
+    def _start(self, force: bool) -> Optional[dict[str, Any]]:
+        """Prepares build, takes pdf from cache if possible.
+
+        Args:
+            force (bool): Build even if output is up to date.
+
+        Raises:
+            FileNotFoundError: When TeX file does not exist.
+
+        Returns:
+            dict[str, Any] | None: State of the build, None if there is nothing to compile.
+        """
+        if not path.isfile(self.tex_path):
+            raise FileNotFoundError(f"TeX file {self.tex_path} does not exist.")
+        self.events = []
+        self.returncode = None
+        self._deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        if not force and self.up_to_date():
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        state = self.load_state()
+        self._key = None if self.cache is None else self.cache_key()
+        if self._key is not None and not force:
+            start = time.perf_counter()
+            if self.cache.get(self._key, self.job_file('pdf')):
+                self._emit('cache', time.perf_counter() - start)
+                self._finish(state)
+                return None
+        pdf = self.job_file('pdf')
+        if path.isfile(pdf) and os.stat(pdf).st_nlink > 1:
+            os.remove(pdf)  # pdf linked from cache must not be overwritten in place
+        state['complete'] = False
+        self.save_state(state)
+        return state
+
+    def _steps(self, state: dict[str, Any]) -> Generator[tuple[str, Any], None, int]:
+        """Decides which programs run, without running them.
+
+        Yields ('format', name), ('engine', draft) or ('bibtex', None), the caller
+        runs the step and resumes the generator, or throws CompilationError into it.
+
+        Args:
+            state (dict[str, Any]): State of the build.
+
+        Returns:
+            int: Number of engine passes.
+        """
+        if self.precompile:
+            self.fmt = self.format_name()
+            if self.fmt is not None and not self._formats().touch(self.fmt):
+                try:
+                    yield 'format', self.fmt
+                except CompilationError:
+                    self.fmt = None
+                else:
+                    self._formats().prune()
+        passes = 0
+        # Without aux file, at least one more pass is certainly needed.
+        draft = self.draft and self.max_passes > 1 and not path.isfile(self.job_file('aux'))
+        while True:
+            aux = [file_hash(file_path) for file_path in self.aux_files()]
+            yield 'engine', draft
+            passes += 1
+            rerun = [file_hash(file_path) for file_path in self.aux_files()] != aux or self.rerun_requested()
+            bib_key = self.bib_key()
+            if bib_key is not None and (bib_key != state.get('bibtex') or not path.isfile(self.job_file('bbl'))):
+                bbl = file_hash(self.job_file('bbl'))
+                yield 'bibtex', None
+                state['bibtex'] = bib_key
+                rerun = rerun or file_hash(self.job_file('bbl')) != bbl
+            if not draft and (not rerun or passes >= self.max_passes):
+                break
+            # The final pass is never a draft and counts against the limit too.
+            draft = self.draft and rerun and passes < self.max_passes - 1
+        return passes
+
+    def run(self, force: bool = False) -> int:
+        """Builds pdf, running only passes which are needed.
+
+        Args:
+            force (bool, optional): Build even if output is up to date. Defaults to False.
+
+        Raises:
+            FileNotFoundError: When TeX file does not exist.
+            CompilationError: When program fails.
+            CompilationTimeoutError: When program or the whole build runs out of time.
+
+        Returns:
+            int: Number of engine passes.
+        """
+        state = self._start(force)
+        if state is None:
+            return 0
+        steps = self._steps(state)
+        error = None
+        try:
+            while True:
+                name, argument = steps.send(None) if error is None else steps.throw(error)
+                error = None
+                start = time.perf_counter()
+                try:
+                    if name == 'format':
+                        self.dump_format(argument)
+                    elif name == 'engine':
+                        self.run_engine(argument)
+                    else:
+                        self.run_bibtex()
+                except CompilationError as failure:
+                    error = failure
+                self._emit_step(name, argument, time.perf_counter() - start)
+        except StopIteration as stop:
+            passes = stop.value
+        self._complete(state)
+        return passes
+
+    async def run_async(self, force: bool = False, limit: Optional[asyncio.Semaphore] = None) -> 'BuildResult':
+        """Builds pdf like run, awaiting programs without blocking event loop.
+
+        Failures and timeouts are reported in result. When the task is cancelled,
+        running program is killed and CancelledError propagates.
+
+        Args:
+            force (bool, optional): Build even if output is up to date. Defaults to False.
+            limit (asyncio.Semaphore | None, optional): Limit of concurrent builds. Defaults to get_compile_limit().
+
+        Returns:
+            BuildResult: Outcome of build.
+        """
+        async with limit or get_compile_limit():
+            start = time.perf_counter()
+            try:
+                state = self._start(force)
+                if state is None:
+                    return self.result(True, 0, time.perf_counter() - start)
+                steps = self._steps(state)
+                error = None
+                try:
+                    while True:
+                        name, argument = steps.send(None) if error is None else steps.throw(error)
+                        error = None
+                        step_start = time.perf_counter()
+                        try:
+                            if name == 'format':
+                                await self.dump_format_async(argument)
+                            elif name == 'engine':
+                                await self.run_engine_async(argument)
+                            else:
+                                await self.run_bibtex_async()
+                        except CompilationError as failure:
+                            error = failure
+                        self._emit_step(name, argument, time.perf_counter() - step_start)
+                except StopIteration as stop:
+                    passes = stop.value
+                self._complete(state)
+            except (CompilationError, OSError) as failure:
+                passes = sum(event.name == 'engine' for event in self.events)
+                return self.result(False, passes, time.perf_counter() - start, f"{type(failure).__name__}: {failure}")
+            return self.result(True, passes, time.perf_counter() - start)
+
+    def _emit_step(self, name: str, argument: Any, duration: float) -> None:
+        """Records event of finished step of _steps.
+
+        Args:
+            name (str): Step.
+            argument (Any): Argument of step, draft for engine passes.
+            duration (float): Duration of step in seconds.
+        """
+        if name == 'engine':
+            self._emit(name, duration, sum(event.name == 'engine' for event in self.events) + 1, argument)
+        else:
+            self._emit(name, duration)
+
+    def result(self, ok: bool, passes: int, duration: float, error: Optional[str] = None) -> 'BuildResult':
+        """Returns outcome of the last run.
+
+        Args:
+            ok (bool): True if pdf was built.
+            passes (int): Number of engine passes.
+            duration (float): Duration of build in seconds.
+            error (str | None, optional): Description of failure. Defaults to None.
+
+        Returns:
+            BuildResult: Outcome of build.
+        """
+        return BuildResult(self.job_name, ok, passes, duration, self.job_file('pdf') if ok else None, error,
+                           self.returncode, [event.duration for event in self.events if event.name == 'engine'],
+                           self.job_file('log'), list(self.events))
+
+    def _complete(self, state: dict[str, Any]) -> None:
+        """Stores compiled pdf in cache and state of complete build.
+
+        Args:
+            state (dict[str, Any]): State of the build.
+        """
+        if self._key is not None:
+            self.cache.put(self._key, self.job_file('pdf'))
+        self._finish(state)
+
+    def _finish(self, state: dict[str, Any]) -> None:
+        """Stores state of complete build.
+
+        Args:
+            state (dict[str, Any]): State of the build.
+        """
+        state['inputs'] = self.inputs()
+        state['engine'] = self.engine.name
+        state['complete'] = True
+        self.save_state(state)
+
+
+@dataclass
+class BuildResult:
+    """Outcome of building single document.
+
+    Attributes:
+        name (str): Name of document.
+        ok (bool): True if pdf was built.
+        passes (int): Number of engine passes.
+        duration (float): Time of rendering and compilation in seconds.
+        pdf_path (str | None): Path to pdf.
+        error (str | None): Description of failure.
+        returncode (int | None): Return code of the last program run, None if none finished.
+        pass_durations (list[float]): Durations of engine passes in seconds.
+        log_path (str | None): Path to log file of TeX engine.
+        events (list[BuildEvent]): Timing events of the build.
+    """
+    name: str
+    ok: bool
+    passes: int = 0
+    duration: float = 0.0
+    pdf_path: Optional[str] = None
+    error: Optional[str] = None
+    returncode: Optional[int] = None
+    pass_durations: list[float] = field(default_factory=list)
+    log_path: Optional[str] = None
+    events: list[BuildEvent] = field(default_factory=list)
+
+    def report(self) -> LogReport:
+        """Parses log file of TeX engine.
+
+        Returns:
+            LogReport: Content of log, empty if there is none.
+        """
+        return LogReport() if self.log_path is None else read_log(self.log_path)
+
+
+MAX_CONCURRENT_BUILDS: Optional[int] = None
+"""Default limit of builds running at once on one event loop, number of CPUs if None."""
+
+_limits: 'WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]' = WeakKeyDictionary()
+
+
+def get_compile_limit() -> asyncio.Semaphore:
+    """Returns semaphore limiting builds running at once on the running event loop.
+
+    Returns:
+        asyncio.Semaphore: Semaphore shared by builds which are not given their own limit.
+    """
+    loop = asyncio.get_running_loop()
+    limit = _limits.get(loop)
+    if limit is None:
+        limit = _limits[loop] = asyncio.Semaphore(MAX_CONCURRENT_BUILDS or os.cpu_count() or 1)
+    return limit
+
+
+def _tex_path(source: Any) -> str:
+    """Returns path to TeX file of document.
+
+    Args:
+        source (TexFile | str): Document or path to TeX file.
+
+    Returns:
+        str: Path to TeX file.
+    """
+    return source if isinstance(source, str) else source.file_path
+
+
+def _job_dir(output_dir: Optional[str], tex_path: str) -> Optional[str]:
+    """Returns directory of build of one document in batch.
+
+    Name of directory contains hash of absolute path to TeX file, so
+    documents of the same name from different directories do not collide.
+
+    Args:
+        output_dir (str | None): Parent of job directories.
+        tex_path (str): Path to TeX file.
+
+    Returns:
+        str | None: Job directory, None if output_dir is None.
+    """
+    if output_dir is None:
+        return None
+    name = path.splitext(path.basename(tex_path))[0]
+    return path.join(output_dir, f"{name}-{hashlib.sha256(path.abspath(tex_path).encode()).hexdigest()[:12]}")
+
+
+def _build_job(source: Any, output_dir: Optional[str], force: bool, options: dict[str, Any],
+               collect: bool = False) -> BuildResult:
+    """Renders and compiles one document, catching its failure.
+
+    Args:
+        source (TexFile | str): Document or path to TeX file.
+        output_dir (str | None): Parent of job directories, see _job_dir, directory of TeX file if None.
+        force (bool): Build even if output is up to date.
+        options (dict[str, Any]): Keyword arguments of Build.
+        collect (bool, optional): Only collect events in result instead of calling hooks. Defaults to False.
+
+    Returns:
+        BuildResult: Outcome of build.
+    """
+    start = time.perf_counter()
+    tex_path = _tex_path(source)
+    name = path.splitext(path.basename(tex_path))[0]
+    events: list[BuildEvent] = []
+    hooks = [events.append] if collect else None
+    build = None
+    try:
+        if not isinstance(source, str):
+            source.create(hooks=hooks)
+        build = Build(tex_path, output_dir=_job_dir(output_dir, tex_path), hooks=hooks, **options)
+        passes = build.run(force)
+        result = build.result(True, passes, time.perf_counter() - start)
+    except Exception as error:
+        failure = f"{type(error).__name__}: {error}"
+        if build is None:
+            return BuildResult(name, False, duration=time.perf_counter() - start, error=failure, events=events)
+        passes = sum(event.name == 'engine' for event in build.events)
+        result = build.result(False, passes, time.perf_counter() - start, failure)
+    if collect:
+        result.events = events
+    return result
+
+
+def build_all(sources: Iterable[Any], jobs: Optional[int] = None, output_dir: Optional[str] = None,
+              force: bool = False, **options: Any) -> list[BuildResult]:
+    """Renders and compiles many documents in parallel.
+
+    Every document is built in its own process. Failure of one document does
+    not stop the others, it is reported in its result. Events of builds in
+    other processes are delivered to hooks of this process when they finish.
+
+    Args:
+        sources (Iterable[TexFile | str]): Documents or paths to TeX files.
+        jobs (int | None, optional): Number of processes, number of CPUs if None. With 1, documents are built in this process.
+        output_dir (str | None, optional): Each document is built in its own subdirectory of it. Defaults to directory of TeX file.
+        force (bool, optional): Build even if output is up to date. Defaults to False.
+        **options (Any): Keyword arguments of Build, eg. engine.
+
+    Returns:
+        list[BuildResult]: Results in order of sources.
+    """
+    sources = list(sources)
+    if jobs == 1:
+        return [_build_job(source, output_dir, force, options) for source in sources]
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [executor.submit(_build_job, source, output_dir, force, options, True) for source in sources]
+        results = []
+        for source, future in zip(sources, futures):
+            try:
+                result = future.result()
+            except Exception as error:
+                name = path.splitext(path.basename(_tex_path(source)))[0]
+                result = BuildResult(name, False, error=f"{type(error).__name__}: {error}")
+            for event in result.events:
+                emit(event)
+            results.append(result)
+        return results
+
+
+async def build_all_async(sources: Iterable[Any], jobs: Optional[int] = None, output_dir: Optional[str] = None,
+                          force: bool = False, **options: Any) -> list[BuildResult]:
+    """Renders and compiles many documents concurrently on the running event loop.
+
+    Documents are rendered in worker threads and compiled by run_async.
+
+    Args:
+        sources (Iterable[TexFile | str]): Documents or paths to TeX files.
+        jobs (int | None, optional): Number of builds running at once. Defaults to get_compile_limit().
+        output_dir (str | None, optional): Each document is built in its own subdirectory of it. Defaults to directory of TeX file.
+        force (bool, optional): Build even if output is up to date. Defaults to False.
+        **options (Any): Keyword arguments of Build, eg. engine or timeout.
+
+    Returns:
+        list[BuildResult]: Results in order of sources.
+    """
+    limit = get_compile_limit() if jobs is None else asyncio.Semaphore(jobs)
+
+    async def job(source: Any) -> BuildResult:
+        tex_path = _tex_path(source)
+        name = path.splitext(path.basename(tex_path))[0]
+        try:
+            if not isinstance(source, str):
+                await asyncio.to_thread(source.create)
+            build = Build(tex_path, output_dir=_job_dir(output_dir, tex_path), **options)
+        except Exception as error:
+            return BuildResult(name, False, error=f"{type(error).__name__}: {error}")
+        return await build.run_async(force, limit)
+
+    return list(await asyncio.gather(*(job(source) for source in sources)))
@@ -0,0 +1,232 @@
+"""Content-addressed caches of compiled pdf files, precompiled formats and other generated files."""
+
+from typing import Optional
+from dataclasses import dataclass
+import os
+import shutil
+import time
+from os import path
+from mff_pytex.utils import _create_temporary, get_cache_dir
+
+
+PDF_CACHE_SIZE = 1 << 30
+"""Default limit of size of pdf cache in bytes."""
+
+FORMAT_CACHE_SIZE = 1 << 30
+"""Default limit of size of cache of precompiled formats in bytes."""
+
+
+@dataclass
+class CacheEntry:
+    """Cached file.
+
+    Attributes:
+        key (str): Hash of everything the pdf was built from.
+        size (int): Size of file in bytes.
+        last_used (float): Time of last storing or use of the entry.
+    """
+    key: str
+    size: int
+    last_used: float
+
+
+class FileCache:
+    """Directory of generated files named by hashes of their sources.
+
+    Using an entry updates its modification time, so when the cache grows over
+    its limit, least recently used entries are removed first.
+
+    Attributes:
+        directory (str): Directory of cached files.
+        max_size (int): Limit of total size of cached files in bytes.
+    """
+    subdirectory = 'files'
+    suffix = ''
+    default_size = PDF_CACHE_SIZE
+    size_variable = 'MFF_PYTEX_CACHE_SIZE'
+
+    def __init__(self, directory: Optional[str] = None, max_size: Optional[int] = None) -> None:
+        """Initialize FileCache.
+
+        Args:
+            directory (str | None, optional): Directory of cached files. Defaults to subdirectory of cache directory.
+            max_size (int | None, optional): Limit of total size in bytes. Defaults to environment variable
+                size_variable or default_size.
+        """
+        if directory is None:
+            directory = get_cache_dir(self.subdirectory)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        if max_size is None:
+            max_size = int(os.environ.get(self.size_variable, self.default_size))
+        self.max_size = max_size
+
+    def path(self, key: str) -> str:
+        """Returns path to cached file.
+
+        Args:
+            key (str): Key of entry.
+
+        Returns:
+            str: Path to file.
+        """
+        return path.join(self.directory, f"{key}{self.suffix}")
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and path.isfile(self.path(key))
+
+    def touch(self, key: str) -> bool:
+        """Marks entry as recently used.
+
+        Args:
+            key (str): Key of entry.
+
+        Returns:
+            bool: True if entry was found.
+        """
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def entries(self) -> list[CacheEntry]:
+        """Returns cached entries, the most recently used first.
+
+        Returns:
+            list[CacheEntry]: Cached entries.
+        """
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for item in scan:
+                if item.name.endswith(self.suffix) and not item.name.startswith('.'):
+                    try:
+                        stat = item.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append(CacheEntry(item.name[:len(item.name) - len(self.suffix)], stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry.last_used, reverse=True)
+        return entries
+
+    def size(self) -> int:
+        """Returns total size of cached files.
+
+        Returns:
+            int: Size in bytes.
+        """
+        return sum(entry.size for entry in self.entries())
+
+    def prune(self, max_size: Optional[int] = None, max_age: Optional[float] = None) -> list[CacheEntry]:
+        """Removes least recently used entries until cache fits into its limit.
+
+        Args:
+            max_size (int | None, optional): Limit of total size in bytes. Defaults to max_size of cache.
+            max_age (float | None, optional): Also remove entries unused for more seconds. Defaults to None.
+
+        Returns:
+            list[CacheEntry]: Removed entries.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        oldest = None if max_age is None else time.time() - max_age
+        removed = []
+        total = 0
+        for entry in self.entries():
+            total += entry.size
+            if total > max_size or (oldest is not None and entry.last_used < oldest):
+                try:
+                    os.remove(self.path(entry.key))
+                except FileNotFoundError:
+                    pass
+                removed.append(entry)
+                total -= entry.size
+        return removed
+
+    def clear(self) -> list[CacheEntry]:
+        """Removes all entries.
+
+        Returns:
+            list[CacheEntry]: Removed entries.
+        """
+        return self.prune(0)
+
+
+class PdfCache(FileCache):
+    """Cache of compiled pdf files named by hashes of everything they were built from.
+
+    Attributes:
+        directory (str): Directory of cached files, pdf directory in cache directory by default.
+        max_size (int): Limit of total size of cached files in bytes, MFF_PYTEX_CACHE_SIZE environment
+            variable or PDF_CACHE_SIZE by default.
+    """
+    subdirectory = 'pdf'
+    suffix = '.pdf'
+
+    def get(self, key: str, target: str) -> bool:
+        """Places cached pdf to target path.
+
+        Pdf is hard-linked if possible, otherwise copied. Target is replaced atomically.
+
+        Args:
+            key (str): Key of entry.
+            target (str): Path where pdf is placed.
+
+        Returns:
+            bool: True if entry was found.
+        """
+        cached = self.path(key)
+        fd, tmp_path = _create_temporary(target)
+        os.close(fd)
+        os.unlink(tmp_path)
+        try:
+            try:
+                os.link(cached, tmp_path)
+            except FileNotFoundError:
+                return False
+            except OSError:
+                shutil.copyfile(cached, tmp_path)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if path.lexists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        try:
+            os.utime(cached)
+        except OSError:
+            pass  # entry was pruned meanwhile, target is complete anyway
+        return True
+
+    def put(self, key: str, source: str) -> None:
+        """Stores copy of pdf and prunes the cache.
+
+        Args:
+            key (str): Key of entry.
+            source (str): Path to pdf.
+        """
+        fd, tmp_path = _create_temporary(self.path(key))
+        os.close(fd)
+        try:
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.prune()
+
+
+class FormatCache(FileCache):
+    """Cache of precompiled formats named by hashes of preambles they were dumped from.
+
+    Formats are written by TeX engine directly into directory of the cache,
+    which is then pruned.
+
+    Attributes:
+        directory (str): Directory of cached files, formats directory in cache directory by default.
+        max_size (int): Limit of total size of cached files in bytes, MFF_PYTEX_FORMAT_CACHE_SIZE environment
+            variable or FORMAT_CACHE_SIZE by default.
+    """
+    subdirectory = 'formats'
+    suffix = '.fmt'
+    default_size = FORMAT_CACHE_SIZE
+    size_variable = 'MFF_PYTEX_FORMAT_CACHE_SIZE'
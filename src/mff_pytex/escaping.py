@@ -0,0 +1,110 @@
+"""Escaping of LaTeX special characters in user text."""
+
+from typing import Any, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pandas import Series
+
+
+class Raw(str):
+    """Text which is already valid LaTeX and must not be escaped.
+    """
+    __slots__ = ()
+
+
+_BACKSLASH = 'ab2§=§8yz'
+"""Rare placeholder of backslash, so that backslashes of replacements are not escaped again."""
+
+LATEX_ESCAPES = (
+    ('\\', _BACKSLASH),
+    (_BACKSLASH + ' ', _BACKSLASH + '\\space '),
+    ('&', '\\&'),
+    ('%', '\\%'),
+    ('$', '\\$'),
+    ('#', '\\#'),
+    ('_', '\\_'),
+    ('{', '\\{'),
+    ('}', '\\}'),
+    ('~ ', '~\\space '),
+    ('~', '\\textasciitilde '),
+    ('^ ', '^\\space '),
+    ('^', '\\textasciicircum '),
+    (_BACKSLASH, '\\textbackslash '),
+)
+"""Replacements of LaTeX special characters in order of application, same as used by pandas.
+
+Commands like \\textbackslash gobble following space, so it is kept by \\space.
+"""
+
+_SPECIAL = frozenset('\\&%$#_{}~^')
+
+_SEPARATOR = '\x00'
+
+
+def _replace(text: str) -> str:
+    """Applies LATEX_ESCAPES to text.
+
+    Args:
+        text (str): Text to escape.
+
+    Returns:
+        str: Escaped text.
+    """
+    for old, new in LATEX_ESCAPES:
+        if old in text:
+            text = text.replace(old, new)
+    return text
+
+
+def escape(text: Any) -> str:
+    """Escapes LaTeX special characters in text.
+
+    Text marked as Raw is returned unchanged, other objects are converted to string first.
+
+    Args:
+        text (Any): Text to escape.
+
+    Returns:
+        str: Escaped text.
+    """
+    if isinstance(text, Raw):
+        return text
+    text = str(text)
+    if _SPECIAL.isdisjoint(text):
+        return text
+    return _replace(text)
+
+
+def escape_all(texts: Iterable[Any]) -> list[str]:
+    """Escapes LaTeX special characters in many texts at once.
+
+    Texts are joined and escaped by one pass of every replacement, which is
+    much faster than escaping them one by one. Raw texts are kept unchanged.
+
+    Args:
+        texts (Iterable[Any]): Texts to escape.
+
+    Returns:
+        list[str]: Escaped texts.
+    """
+    texts = [text if isinstance(text, Raw) else str(text) for text in texts]
+    joined = _SEPARATOR.join(texts)
+    if joined.count(_SEPARATOR) != max(len(texts) - 1, 0) or any(isinstance(text, Raw) for text in texts):
+        return [escape(text) for text in texts]
+    return _replace(joined).split(_SEPARATOR) if texts else []
+
+
+def escape_series(series: 'Series') -> 'Series':
+    """Escapes LaTeX special characters in every string of series at once.
+
+    Missing values are kept.
+
+    Args:
+        series (Series): Series of strings.
+
+    Returns:
+        Series: Escaped series.
+    """
+    for old, new in LATEX_ESCAPES:
+        series = series.str.replace(old, new, regex=False)
+    return series
@@ -0,0 +1,85 @@
+"""Timing events of builds, delivered to pluggable hooks."""
+
+from typing import Callable, Iterable, Iterator, Optional
+from contextlib import contextmanager
+from dataclasses import dataclass
+import time
+
+
+@dataclass
+class BuildEvent:
+    """Timing of one step of build.
+
+    Attributes:
+        name (str): Step, one of 'assets', 'render', 'write', 'cache', 'format', 'engine' and 'bibtex'.
+        job (str): Name of document.
+        duration (float): Duration of step in seconds.
+        index (int): Number of pass for engine steps, 0 otherwise.
+        draft (bool): Engine pass ran in draft mode.
+    """
+    name: str
+    job: str
+    duration: float
+    index: int = 0
+    draft: bool = False
+
+
+BuildHook = Callable[[BuildEvent], None]
+"""Callback receiving build events."""
+
+_hooks: list[BuildHook] = []
+
+
+def add_hook(hook: BuildHook) -> None:
+    """Registers hook called with every build event of this process.
+
+    Args:
+        hook (BuildHook): Callback.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook: BuildHook) -> None:
+    """Unregisters hook.
+
+    Args:
+        hook (BuildHook): Callback registered by add_hook.
+    """
+    _hooks.remove(hook)
+
+
+def get_hooks() -> list[BuildHook]:
+    """Returns registered hooks.
+
+    Returns:
+        list[BuildHook]: Copy of list of hooks.
+    """
+    return list(_hooks)
+
+
+def emit(event: BuildEvent, hooks: Optional[Iterable[BuildHook]] = None) -> None:
+    """Delivers event to hooks.
+
+    Args:
+        event (BuildEvent): Event.
+        hooks (Iterable[BuildHook] | None, optional): Hooks to call. Defaults to registered hooks.
+    """
+    for hook in _hooks if hooks is None else hooks:
+        hook(event)
+
+
+@contextmanager
+def timed(name: str, job: str, hooks: Optional[Iterable[BuildHook]] = None, **fields) -> Iterator[None]:
+    """Measures duration of with block and emits it as event, also when block fails.
+
+    Args:
+        name (str): Step.
+        job (str): Name of document.
+        hooks (Iterable[BuildHook] | None, optional): Hooks to call. Defaults to registered hooks.
+        **fields: Other fields of BuildEvent.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit(BuildEvent(name, job, time.perf_counter() - start, **fields), hooks)
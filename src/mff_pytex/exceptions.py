@@ -3,3 +3,59 @@ class WrongTypeListError(Exception):
     """
     def __init__(self, message: str = 'Wrong type of iterable. You probably use dictionay istead of Sequence.') -> None:
         super().__init__(message)
+
+
+class CompilationError(Exception):
+    """Raised when TeX engine or bibtex fails to compile document.
+    """
+    def __init__(self, message: str = 'Compilation of TeX file failed.') -> None:
+        super().__init__(message)
+
+
+class UnknownEngineError(Exception):
+    """Raised when unsupported TeX engine was requested.
+    """
+    def __init__(self, message: str = 'Unknown TeX engine.') -> None:
+        super().__init__(message)
+
+
+class PackageOrderError(Exception):
+    """Raised when constraints on order of packages contain a cycle.
+    """
+    def __init__(self, message: str = 'Order of packages can not be satisfied, constraints contain a cycle.') -> None:
+        super().__init__(message)
+
+
+class DuplicateBibError(Exception):
+    """Raised when bibliography already contains a different record with the same name.
+    """
+    def __init__(self, message: str = 'Bibliography already contains a different record with the same name.') -> None:
+        super().__init__(message)
+
+
+class AssetError(Exception):
+    """Raised when image can not be prepared for TeX.
+    """
+    def __init__(self, message: str = 'Image can not be prepared for TeX.') -> None:
+        super().__init__(message)
+
+
+class MissingAssetError(AssetError):
+    """Raised when referenced image does not exist.
+    """
+    def __init__(self, message: str = 'Referenced image does not exist.') -> None:
+        super().__init__(message)
+
+
+class CompilationTimeoutError(CompilationError):
+    """Raised when TeX engine or bibtex runs out of time.
+    """
+    def __init__(self, message: str = 'Compilation of TeX file timed out.') -> None:
+        super().__init__(message)
+
+
+class RenderServerError(Exception):
+    """Raised when render server is not running or its connection fails.
+    """
+    def __init__(self, message: str = 'Render server is not running.') -> None:
+        super().__init__(message)
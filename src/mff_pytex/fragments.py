@@ -0,0 +1,330 @@
+"""Memoization of rendered fragments of documents in a disk cache."""
+
+from typing import Any, Callable, Iterator, Optional
+from dataclasses import fields, is_dataclass
+import functools
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import mff_pytex
+from mff_pytex.cache import FileCache
+from mff_pytex.images import Picture
+from mff_pytex.packages import Package, PackageRegistry, activate_registry, add_package, deactivate_registry
+from mff_pytex.utils import Writing, file_hash
+
+
+FRAGMENT_CACHE_SIZE = 1 << 28
+"""Default limit of size of fragment cache in bytes."""
+
+FRAGMENT_CACHE_VERSION = 2
+"""Version of format of cached fragments, changing it invalidates them."""
+
+
+class Fragment(Writing):
+    """Rendered LaTeX spliced into document as it is.
+
+    Pictures of fragment are kept as nodes, so they are found by walk, their
+    images are prepared by prepare_assets and watched by watch.
+
+    Attributes:
+        packages (list[Package]): Packages the fragment needs.
+    """
+
+    def __init__(self, text: str | list[str | Picture], packages: Optional[list[Package]] = None) -> None:
+        """Initialize Fragment.
+
+        Args:
+            text (str | list[str | Picture]): Rendered LaTeX, or its pieces and pictures between them.
+            packages (list[Package] | None, optional): Packages the fragment needs. Defaults to None.
+        """
+        super().__init__()
+        for part in [text] if isinstance(text, str) else text:
+            self._chunks.append(part)
+            if isinstance(part, Picture):
+                self._nodes.append(part)
+        self.packages = packages or []
+
+    @property
+    def parts(self) -> list[str | Picture]:
+        """Rendered pieces of fragment and pictures between them."""
+        return list(self._chunks)
+
+
+def _render(result: Any) -> Iterator[str | Picture]:
+    """Iterate over rendered result of producer of fragment, pictures are yielded as nodes.
+
+    Args:
+        result (Any): Writing, Environment or any object with TeX form.
+
+    Yields:
+        str | Picture: Successive pieces of content and pictures.
+    """
+    if isinstance(result, Picture):
+        yield result
+    elif isinstance(result, Writing):
+        for part in result._parts():
+            if isinstance(part, str):
+                yield part
+            else:
+                yield from _render(part)
+    elif hasattr(result, 'iter_chunks'):
+        yield from result.iter_chunks()
+    else:
+        yield str(result)
+
+
+def _join(parts: Iterator[str | Picture]) -> list[str | Picture]:
+    """Joins successive pieces of text."""
+    joined: list[str | Picture] = []
+    for part in parts:
+        if isinstance(part, str) and joined and isinstance(joined[-1], str):
+            joined[-1] += part
+        else:
+            joined.append(part)
+    return joined
+
+
+def _feed(digest: Any, value: Any) -> None:
+    """Updates hash by value, recursively for containers.
+
+    Args:
+        digest (Any): Hash object.
+        value (Any): Hashed value.
+
+    Raises:
+        TypeError: When value can not be hashed.
+    """
+    kind = type(value)
+    digest.update(f"\x00{kind.__module__}.{kind.__qualname__}:".encode())
+    if value is None or isinstance(value, (bool, int, float, complex)):
+        digest.update(repr(value).encode())
+    elif isinstance(value, str):
+        digest.update(value.encode('utf-8', 'surrogatepass'))
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        digest.update(value)
+    elif isinstance(value, os.PathLike):
+        file_path = os.fsdecode(value)
+        digest.update(f"{file_path}\x00{file_hash(file_path)}".encode('utf-8', 'surrogatepass'))
+    elif isinstance(value, (list, tuple)):
+        digest.update(str(len(value)).encode())
+        for item in value:
+            _feed(digest, item)
+    elif isinstance(value, dict):
+        digest.update(str(len(value)).encode())
+        for key, item in value.items():
+            _feed(digest, key)
+            _feed(digest, item)
+    elif isinstance(value, (set, frozenset)):
+        for item in sorted(repr(item) for item in value):
+            digest.update(item.encode())
+    elif (pd := sys.modules.get('pandas')) is not None and isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        if isinstance(value, pd.DataFrame):
+            _feed(digest, [str(column) for column in value.columns])
+            digest.update(str(list(value.dtypes)).encode())
+        else:
+            digest.update(f"{value.name!r}{value.dtype}".encode())
+        if not isinstance(value, pd.Index):
+            _feed(digest, [str(name) for name in value.index.names])
+        digest.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+    elif (np := sys.modules.get('numpy')) is not None and isinstance(value, np.ndarray):
+        digest.update(f"{value.dtype}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, Writing):
+        for chunk in value.iter_chunks():
+            digest.update(chunk.encode('utf-8', 'surrogatepass'))
+    elif is_dataclass(value):
+        for item in fields(value):
+            _feed(digest, getattr(value, item.name))
+    else:
+        try:
+            digest.update(pickle.dumps(value, protocol=4))
+        except Exception as error:
+            raise TypeError(f"Can not hash argument of type {kind.__qualname__}.") from error
+
+
+def fragment_key(func: Callable[..., Any], args: tuple, kwargs: dict[str, Any], version: Any = None) -> str:
+    """Returns key of fragment produced by function called with given arguments.
+
+    Key depends on name of function, its version, version of mff_pytex and
+    values of arguments. DataFrames and arrays are hashed by content, paths
+    given as os.PathLike, e.g. pathlib.Path, by content of their files, other
+    values by content of containers, rendered text or pickle. Files given by
+    paths in str are not read, so pass paths of inputs as pathlib.Path.
+
+    Args:
+        func (Callable[..., Any]): Producer of fragment.
+        args (tuple): Positional arguments.
+        kwargs (dict[str, Any]): Keyword arguments.
+        version (Any, optional): Version of producer, change it when producer changes. Defaults to None.
+
+    Raises:
+        TypeError: When some argument can not be hashed.
+
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha256(f"{FRAGMENT_CACHE_VERSION}\n{mff_pytex.__version__}\n"
+                            f"{func.__module__}.{func.__qualname__}\n{version!r}\n".encode())
+    _feed(digest, args)
+    _feed(digest, sorted(kwargs.items()))
+    return digest.hexdigest()
+
+
+class FragmentCache(FileCache):
+    """Cache of rendered fragments keyed by hashes of inputs of their producers.
+
+    Attributes:
+        directory (str): Directory of cached files, fragments directory in cache directory by default.
+        max_size (int): Limit of total size of cached files in bytes, MFF_PYTEX_FRAGMENT_CACHE_SIZE environment
+            variable or FRAGMENT_CACHE_SIZE by default.
+    """
+    subdirectory = 'fragments'
+    suffix = '.pickle'
+    default_size = FRAGMENT_CACHE_SIZE
+    size_variable = 'MFF_PYTEX_FRAGMENT_CACHE_SIZE'
+
+    def __init__(self, directory: Optional[str] = None, max_size: Optional[int] = None) -> None:
+        """Initialize FragmentCache.
+
+        Args:
+            directory (str | None, optional): Directory of cached files. Defaults to fragments directory in cache directory.
+            max_size (int | None, optional): Limit of total size in bytes. Defaults to MFF_PYTEX_FRAGMENT_CACHE_SIZE
+                environment variable or FRAGMENT_CACHE_SIZE.
+        """
+        super().__init__(directory, max_size)
+        self._size: Optional[int] = None
+
+    def get(self, key: str) -> Optional[Fragment]:
+        """Returns cached fragment.
+
+        Args:
+            key (str): Key of entry.
+
+        Returns:
+            Fragment | None: Fragment, None if it is not cached.
+        """
+        try:
+            with open(self.path(key), 'rb') as fp:
+                parts, packages = pickle.load(fp)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError):
+            return None
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass  # entry was pruned meanwhile
+        return Fragment(parts, [Package(name, *params) for name, params in packages])
+
+    def put(self, key: str, fragment: Fragment) -> None:
+        """Stores fragment and prunes the cache when it grows over its limit.
+
+        Args:
+            key (str): Key of entry.
+            fragment (Fragment): Rendered fragment.
+        """
+        data = pickle.dumps((fragment.parts, [(package.name, package.optional) for package in fragment.packages]),
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{key}.", suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_size:
+            self.prune()
+            self._size = self.size()
+
+    def fragment(self, func: Callable[..., Any], *args: Any, version: Any = None, **kwargs: Any) -> Fragment:
+        """Returns fragment produced by function, rendered from cache if possible.
+
+        On miss, function is called and its result rendered while packages it
+        adds are recorded, pictures in the result are kept with the fragment.
+        Packages of fragment are added to active registry on hit and on miss
+        alike.
+
+        Args:
+            func (Callable[..., Any]): Producer of Writing, Environment or any object with TeX form.
+            *args (Any): Positional arguments of producer.
+            version (Any, optional): Version of producer, change it when producer changes. Defaults to None.
+            **kwargs (Any): Keyword arguments of producer.
+
+        Raises:
+            TypeError: When some argument can not be hashed.
+
+        Returns:
+            Fragment: Rendered fragment.
+        """
+        key = fragment_key(func, args, kwargs, version)
+        fragment = self.get(key)
+        if fragment is None:
+            registry = PackageRegistry()
+            token = activate_registry(registry)
+            try:
+                parts = _join(_render(func(*args, **kwargs)))
+            finally:
+                deactivate_registry(token)
+            fragment = Fragment(parts, list(registry))
+            self.put(key, fragment)
+        add_package(*fragment.packages)
+        return fragment
+
+    def memoize(self, func: Optional[Callable[..., Any]] = None, *, version: Any = None) -> Any:
+        """Decorator caching fragments produced by function, see fragment.
+
+        Args:
+            func (Callable[..., Any] | None, optional): Producer of fragment. Defaults to None.
+            version (Any, optional): Version of producer, change it when producer changes. Defaults to None.
+
+        Returns:
+            Any: Decorated function returning Fragment, or decorator if func is None.
+        """
+        if func is None:
+            return functools.partial(self.memoize, version=version)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Fragment:
+            return self.fragment(func, *args, version=version, **kwargs)
+        return wrapper
+
+
+_default_cache: Optional[FragmentCache] = None
+
+
+def get_fragment_cache() -> FragmentCache:
+    """Returns fragment cache in default location, created on first use.
+
+    Returns:
+        FragmentCache: Shared cache.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = FragmentCache()
+    return _default_cache
+
+
+def memoize(func: Optional[Callable[..., Any]] = None, *, cache: Optional[FragmentCache] = None,
+            version: Any = None) -> Any:
+    """Decorator caching rendered fragments of function on disk, see FragmentCache.fragment.
+
+    Args:
+        func (Callable[..., Any] | None, optional): Producer of fragment. Defaults to None.
+        cache (FragmentCache | None, optional): Cache of fragments. Defaults to get_fragment_cache().
+        version (Any, optional): Version of producer, change it when producer changes. Defaults to None.
+
+    Returns:
+        Any: Decorated function returning Fragment, or decorator if func is None.
+    """
+    if func is None:
+        return functools.partial(memoize, cache=cache, version=version)
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Fragment:
+        return (cache or get_fragment_cache()).fragment(func, *args, version=version, **kwargs)
+    return wrapper
@@ -1,15 +1,20 @@
 """Utilities for using images, graphs etc. in text."""
 
 
-from typing import Optional
+from typing import Iterator, Optional
 from mff_pytex.utils import Environment, command
 from mff_pytex.packages import add_package, Package
+from mff_pytex.escaping import escape as escape_latex
 
 
 class Picture(Environment):
     """Picture environment for including pictures, graphs etc.
+
+    Attributes:
+        prepared_path (str | None): Path to image prepared by asset pipeline, included instead of picture_path.
     """
-    def __init__(self, picture_path: str, *params: str, caption: Optional[str] = None, label: Optional[str] = None, settings: Optional[list] = None) -> None:
+    def __init__(self, picture_path: str, *params: str, caption: Optional[str] = None, label: Optional[str] = None, settings: Optional[list] = None,
+                 escape: bool = False) -> None:
         """Initialize picture
 
         Args:
@@ -18,30 +23,30 @@ class Picture(Environment):
             caption (str | None, optional): Caption of picture. Defaults to None.
             label (str | None, optional): Label of picture. Defaults to None.
             settings (str | None, optional): settings for picture eg. width. Defaults to None.
+            escape (bool, optional): Escape LaTeX special characters in caption, unless it is Raw. Defaults to False.
         """
         add_package(Package('graphicx'))
-        self.en_type = 'figure'
-        if params:
-            self.write(command('begin', self.en_type, *params))
-        else:
-            self.write(command('begin', self.en_type))
+        super().__init__('figure', *params)
         self.picture_path = picture_path
         self.caption = caption
         self.label = label
         self.settings = settings
+        self.escape = escape
+        self.prepared_path: Optional[str] = None
 
-    def __str__(self) -> str:
-        """Returns content string encapsuled by picture environment.
+    def _closing(self) -> Iterator[str]:
+        """Iterate over lines closing the picture environment.
 
-        Returns:
-            str: Content.
+        Yields:
+            str: Picture, its label and caption and the end of environment.
         """
+        picture_path = self.picture_path if self.prepared_path is None else self.prepared_path
         if self.settings:
-            self.write(command('includegraphics', self.picture_path, *self.settings))
+            yield command('includegraphics', picture_path, *self.settings) + '\n'
         else:
-            self.write(command('includegraphics', self.picture_path))
+            yield command('includegraphics', picture_path) + '\n'
         if self.label is not None:
-            self.write(command('label', self.label))
+            yield command('label', self.label) + '\n'
         if self.caption is not None:
-            self.write(command('caption', self.caption))
-        return self._text + command('end', self.en_type) + '\n'
+            yield command('caption', escape_latex(self.caption) if self.escape else self.caption) + '\n'
+        yield from super()._closing()
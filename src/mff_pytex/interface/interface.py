@@ -1,6 +1,56 @@
 """Interface module."""
+import json
+import sys
+from os import path
+import time
+import traceback
 import click
 import mff_pytex
+from mff_pytex.build import ENGINES, build_all
+from mff_pytex.cache import PdfCache
+from mff_pytex.exceptions import RenderServerError
+from mff_pytex.server import serve as serve_forever, submit as submit_job
+from mff_pytex.watch import DEBOUNCE, watch as watch_script
+
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+"""Multiples of sizes given on command line."""
+
+
+def parse_size(size: str) -> int:
+    """Converts size like 500M to bytes.
+
+    Args:
+        size (str): Number with optional unit K, M or G.
+
+    Raises:
+        click.BadParameter: When size is not valid.
+
+    Returns:
+        int: Size in bytes.
+    """
+    size = size.strip().upper().removesuffix('B')
+    unit = size[-1:] if size[-1:] in SIZE_UNITS else ''
+    try:
+        return int(float(size[:len(size) - len(unit)]) * SIZE_UNITS[unit])
+    except ValueError:
+        raise click.BadParameter(f"{size} is not a size, use e.g. 500M.") from None
+
+
+def format_size(size: float) -> str:
+    """Converts size in bytes to human readable form.
+
+    Args:
+        size (float): Size in bytes.
+
+    Returns:
+        str: Size with unit.
+    """
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
 
 
 @click.group()
@@ -8,3 +58,142 @@ import mff_pytex
 @click.pass_context
 def cli(ctx):
     pass
+
+
+@cli.command()
+@click.argument('files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('-j', '--jobs', type=int, default=None, help='Number of parallel builds, defaults to number of CPUs.')
+@click.option('-e', '--engine', type=click.Choice(list(ENGINES)), default='pdflatex', help='TeX engine.')
+@click.option('-o', '--output-dir', type=click.Path(file_okay=False), default=None,
+              help='Build every document in its own subdirectory of this directory.')
+@click.option('-f', '--force', is_flag=True, help='Build even if pdf is up to date.')
+@click.option('--precompile', is_flag=True, help='Load preamble from cached precompiled format.')
+@click.option('--cache', 'use_cache', is_flag=True, help='Reuse pdf compiled from the same sources.')
+@click.option('--pass-timeout', type=float, default=None, help='Stop program running longer than this many seconds.')
+@click.option('--timeout', type=float, default=None, help='Stop build of document running longer than this many seconds.')
+def build(files, jobs, engine, output_dir, force, precompile, use_cache, pass_timeout, timeout):
+    """Compile TeX FILES to pdf in parallel."""
+    results = build_all(files, jobs=jobs, output_dir=output_dir, force=force, engine=engine, precompile=precompile,
+                        cache=use_cache, pass_timeout=pass_timeout, timeout=timeout)
+    for result in results:
+        if result.ok:
+            passes = ', '.join(f"{duration:.2f}" for duration in result.pass_durations)
+            click.echo(f"{result.name}: ok, {result.passes} passes in {result.duration:.2f} s"
+                       + (f" ({passes})" if passes else ''))
+        else:
+            click.echo(f"{result.name}: failed in {result.duration:.2f} s, {result.error}", err=True)
+            for error in result.report().errors[:3]:
+                location = f"{error.file or result.name}:{error.line}" if error.line else error.file or result.name
+                click.echo(f"  {location}: {error.message}", err=True)
+    if not all(result.ok for result in results):
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument('script', type=click.Path(exists=True, dir_okay=False))
+@click.option('--debounce', type=float, default=DEBOUNCE, show_default=True,
+              help='Seconds to wait for further changes before running script.')
+def watch(script, debounce):
+    """Run SCRIPT again whenever it, its data files or images change."""
+    try:
+        import watchdog  # noqa: F401
+    except ImportError:
+        raise click.ClickException('Watching requires watchdog, install it by pip install watchdog.') from None
+
+    def report(run):
+        stamp = time.strftime('%H:%M:%S')
+        if run.error is None:
+            click.echo(f"[{stamp}] {path.basename(run.script)}: ok in {run.duration:.2f} s, "
+                       f"watching {len(run.inputs)} files")
+        else:
+            click.echo(f"[{stamp}] {path.basename(run.script)}: failed in {run.duration:.2f} s", err=True)
+            click.echo(''.join(traceback.format_exception(run.error)).rstrip(), err=True)
+    try:
+        watch_script(script, debounce, report)
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.option('-s', '--socket', 'socket_file', type=click.Path(dir_okay=False), default=None,
+              help='Path to socket, defaults to MFF_PYTEX_SOCKET or mff_pytex.sock in runtime directory.')
+@click.option('-e', '--engine', 'engines', multiple=True, type=click.Choice(list(ENGINES)),
+              help='Ask for version of TeX engine before serving jobs, can be repeated.')
+def serve(socket_file, engines):
+    """Keep warm interpreter running jobs submitted by mff_pytex submit."""
+    click.echo('Serving, stop by Ctrl+C.', err=True)
+    try:
+        serve_forever(socket_file, tuple(engines))
+    except RenderServerError as error:
+        raise click.ClickException(str(error)) from None
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command(context_settings={'ignore_unknown_options': True})
+@click.argument('target', type=click.Path(exists=True, dir_okay=False))
+@click.argument('args', nargs=-1, type=click.UNPROCESSED)
+@click.option('-s', '--socket', 'socket_file', type=click.Path(dir_okay=False), default=None,
+              help='Path to socket of render server.')
+def submit(target, args, socket_file):
+    """Run TARGET script with ARGS in render server.
+
+    TARGET ending with .json is a document description, which is rendered and
+    compiled, and TARGET ending with .tex is compiled.
+    """
+    if target.endswith('.json'):
+        with open(target) as fp:
+            job = {'action': 'render', 'spec': json.load(fp)}
+    elif target.endswith('.tex'):
+        job = {'action': 'build', 'files': [path.abspath(target)]}
+    else:
+        job = {'action': 'run', 'script': target, 'args': list(args)}
+    try:
+        for message in submit_job(job, socket_file):
+            if message['type'] != 'result':
+                click.echo(message['text'], nl=False, err=message['type'] == 'stderr')
+    except RenderServerError as error:
+        raise click.ClickException(str(error)) from None
+    for result in message.get('results', []):
+        if result['ok']:
+            click.echo(f"{result['name']}: ok, {result['passes']} passes in {result['duration']:.2f} s")
+        else:
+            click.echo(f"{result['name']}: failed in {result['duration']:.2f} s, {result['error']}", err=True)
+    if 'traceback' in message:
+        click.echo(message['traceback'].rstrip(), err=True)
+    if not message['ok']:
+        sys.exit(message.get('returncode') or 1)
+
+
+@cli.group()
+def cache():
+    """Inspect and prune cache of compiled pdf files."""
+
+
+@cache.command()
+@click.option('-l', '--list', 'show', is_flag=True, help='List entries, the most recently used first.')
+def info(show):
+    """Show location and size of the cache."""
+    pdf_cache = PdfCache()
+    entries = pdf_cache.entries()
+    click.echo(f"{pdf_cache.directory}: {len(entries)} entries, "
+               f"{format_size(sum(entry.size for entry in entries))} of {format_size(pdf_cache.max_size)}")
+    if show:
+        for entry in entries:
+            used = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.last_used))
+            click.echo(f"{entry.key[:16]}  {format_size(entry.size):>10}  {used}")
+
+
+@cache.command()
+@click.option('--max-size', default=None, help='Remove least recently used entries over this size, e.g. 500M.')
+@click.option('--max-age', type=float, default=None, help='Remove entries unused for more days.')
+@click.option('--all', 'remove_all', is_flag=True, help='Remove all entries.')
+def prune(max_size, max_age, remove_all):
+    """Remove least recently used entries."""
+    pdf_cache = PdfCache()
+    if remove_all:
+        removed = pdf_cache.clear()
+    else:
+        removed = pdf_cache.prune(None if max_size is None else parse_size(max_size),
+                                  None if max_age is None else max_age * 86400)
+    click.echo(f"Removed {len(removed)} entries, {format_size(sum(entry.size for entry in removed))}.")
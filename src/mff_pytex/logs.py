@@ -0,0 +1,195 @@
+"""Parsing of log files written by TeX engines and bibtex."""
+
+from typing import Iterable, Optional
+from dataclasses import dataclass, field
+import re
+from os import path
+
+
+RERUN_PATTERN = re.compile(r"Rerun to get|Please \(?re\)?run|Rerun LaTeX|Label\(s\) may have changed")
+"""Messages in log file which request another pass."""
+
+MAX_PRINT_LINE = 79
+"""Length at which TeX wraps lines of log file."""
+
+_WARNING = re.compile(r"(LaTeX|LaTeX Font|Package (\S+)|Class (\S+)) Warning: (.*)")
+_BADBOX = re.compile(r"(?:Over|Under)full \\[hv]box \((.*?)\)(?:.*?lines? (\d+))?")
+_INPUT_LINE = re.compile(r"on input line (\d+)")
+_ERROR_LINE = re.compile(r"l\.(\d+)")
+_REFERENCE = re.compile(r"(Reference|Citation) `(.*?)' on page")
+_OUTPUT = re.compile(r"Output written on .*\((\d+) pages?")
+_FILE = re.compile(r"\(([^()\s]+\.[A-Za-z]\w*)|\)")
+_BIBTEX_ERROR = re.compile(r"(.*?)-{3}(?:line (\d+) of file (.*)|while reading file (.*))$")
+
+
+@dataclass
+class LogMessage:
+    """Single error or warning from log file.
+
+    Attributes:
+        level (str): One of 'error', 'warning' and 'badbox'.
+        message (str): Text of message.
+        source (str | None): Package or program which reported the message.
+        file (str | None): File which was read when message was reported.
+        line (int | None): Line of that file.
+    """
+    level: str
+    message: str
+    source: Optional[str] = None
+    file: Optional[str] = None
+    line: Optional[int] = None
+
+
+@dataclass
+class LogReport:
+    """Structured content of log file.
+
+    Attributes:
+        errors (list[LogMessage]): Errors.
+        warnings (list[LogMessage]): Warnings.
+        badboxes (list[LogMessage]): Overfull and underfull boxes.
+        undefined_references (list[str]): Labels of undefined references.
+        undefined_citations (list[str]): Keys of undefined citations.
+        rerun (bool): Log asks for another pass.
+        pages (int | None): Number of pages of output, None if it is not known.
+    """
+    errors: list[LogMessage] = field(default_factory=list)
+    warnings: list[LogMessage] = field(default_factory=list)
+    badboxes: list[LogMessage] = field(default_factory=list)
+    undefined_references: list[str] = field(default_factory=list)
+    undefined_citations: list[str] = field(default_factory=list)
+    rerun: bool = False
+    pages: Optional[int] = None
+
+    @property
+    def ok(self) -> bool:
+        """True if log contains no errors."""
+        return not self.errors
+
+
+def unwrap_lines(lines: Iterable[str]) -> list[str]:
+    """Joins lines which TeX wrapped at MAX_PRINT_LINE characters.
+
+    Args:
+        lines (Iterable[str]): Lines of log file.
+
+    Returns:
+        list[str]: Lines as they were reported.
+    """
+    result = []
+    pending = ''
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if len(line) == MAX_PRINT_LINE:
+            pending += line
+        else:
+            result.append(pending + line)
+            pending = ''
+    if pending:
+        result.append(pending)
+    return result
+
+
+def parse_log(lines: Iterable[str]) -> LogReport:
+    """Parses log file of TeX engine.
+
+    Files are tracked by parentheses TeX writes when it opens and closes them,
+    which is a heuristic, so file of a message may be missing.
+
+    Args:
+        lines (Iterable[str]): Lines of log file.
+
+    Returns:
+        LogReport: Errors, warnings and other information from log.
+    """
+    report = LogReport()
+    lines = unwrap_lines(lines)
+    files: list[str] = []
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        current = files[-1] if files else None
+        if line.startswith('! '):
+            number = None
+            for following in lines[index + 1:index + 12]:
+                match = _ERROR_LINE.match(following)
+                if match is not None:
+                    number = int(match.group(1))
+                    break
+            report.errors.append(LogMessage('error', line[2:], 'TeX', current, number))
+        elif (match := _WARNING.match(line)) is not None:
+            source = match.group(2) or match.group(3) or 'LaTeX'
+            message = match.group(4)
+            prefix = f"({source})"
+            while index + 1 < len(lines) and lines[index + 1].startswith(prefix) and match.group(1) != 'LaTeX':
+                index += 1
+                message += ' ' + lines[index][len(prefix):].strip()
+            number = _INPUT_LINE.search(message)
+            report.warnings.append(LogMessage('warning', message, source, current, number and int(number.group(1))))
+            reference = _REFERENCE.search(message)
+            if reference is not None:
+                undefined = report.undefined_references if reference.group(1) == 'Reference' else report.undefined_citations
+                if reference.group(2) not in undefined:
+                    undefined.append(reference.group(2))
+        elif (match := _BADBOX.match(line)) is not None:
+            report.badboxes.append(LogMessage('badbox', line, 'TeX', current, match.group(2) and int(match.group(2))))
+        elif (match := _OUTPUT.match(line)) is not None:
+            report.pages = int(match.group(1))
+        elif line.startswith('No pages of output'):
+            report.pages = 0
+        else:
+            for match in _FILE.finditer(line):
+                if match.group(1) is not None:
+                    files.append(match.group(1))
+                elif files:
+                    files.pop()
+        if RERUN_PATTERN.search(line):
+            report.rerun = True
+        index += 1
+    return report
+
+
+def parse_blg(lines: Iterable[str]) -> LogReport:
+    """Parses log file of bibtex.
+
+    Args:
+        lines (Iterable[str]): Lines of log file.
+
+    Returns:
+        LogReport: Errors and warnings from log.
+    """
+    report = LogReport()
+    previous = ''
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.startswith('Warning--'):
+            report.warnings.append(LogMessage('warning', line[9:], 'bibtex'))
+            citation = re.search(r'entry for "(.*?)"', line)
+            if citation is not None:
+                report.undefined_citations.append(citation.group(1))
+        elif (match := _BIBTEX_ERROR.match(line)) is not None:
+            message = match.group(1).strip() or previous
+            number = match.group(2)
+            report.errors.append(LogMessage('error', message, 'bibtex', match.group(3) or match.group(4),
+                                            number and int(number)))
+        elif line.startswith('--line') and report.warnings:
+            match = re.match(r'--line (\d+) of file (.*)', line)
+            if match is not None:
+                report.warnings[-1].line, report.warnings[-1].file = int(match.group(1)), match.group(2)
+        previous = line.strip()
+    return report
+
+
+def read_log(file_path: str) -> LogReport:
+    """Parses log file, bibtex log if it ends with .blg.
+
+    Args:
+        file_path (str): Path to log file.
+
+    Returns:
+        LogReport: Content of log, empty if file does not exist.
+    """
+    if not path.isfile(file_path):
+        return LogReport()
+    with open(file_path, encoding='utf-8', errors='replace') as fp:
+        return parse_blg(fp) if file_path.endswith('.blg') else parse_log(fp)
@@ -0,0 +1,281 @@
+"""Mail merge: many documents generated from one template and records of data."""
+
+from typing import Any, Callable, Iterable, Iterator, Mapping, Optional
+import math
+import os
+import re
+import sys
+from os import path
+from mff_pytex.escaping import Raw, escape_all
+from mff_pytex.structure import TexFile
+from mff_pytex.utils import open_output
+
+
+_MARK = '\x1a'
+_SLOT = re.compile(f"{_MARK}([0-9a-f]*){_MARK}")
+
+_BEGIN = '\\begin{document}\n'
+_END = '\\end{document}'
+
+
+class Placeholder(Raw):
+    """Slot of template replaced by field of record.
+
+    It is a text, which can be written or concatenated anywhere in template,
+    even in escaped text or cells of tables.
+    """
+    __slots__ = ()
+
+    def __new__(cls, name: str) -> 'Placeholder':
+        """Creates placeholder of field.
+
+        Args:
+            name (str): Name of field of records.
+        """
+        return super().__new__(cls, f"{_MARK}{name.encode().hex()}{_MARK}")
+
+    @property
+    def name(self) -> str:
+        """Name of field."""
+        return bytes.fromhex(self[1:-1]).decode()
+
+
+def _is_missing(value: Any) -> bool:
+    """Checks if value is None or missing value of pandas or numpy, e.g. NaN or NaT."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return True
+    pd = sys.modules.get('pandas')
+    try:
+        return pd is not None and pd.isna(value) is True
+    except (TypeError, ValueError):
+        return False
+
+
+def _records(records: Any) -> Iterator[Mapping[str, Any]]:
+    """Iterates over records, rows of DataFrame are converted one by one."""
+    if hasattr(records, 'itertuples') and hasattr(records, 'columns'):
+        columns = [str(column) for column in records.columns]
+        for row in records.itertuples(index=False, name=None):
+            yield dict(zip(columns, row))
+    else:
+        yield from records
+
+
+class MergeTemplate:
+    """TeX file with placeholders, rendered once and filled by records.
+
+    Rendered text is split at placeholders, so filling a record only joins
+    static parts with values of its fields.
+
+    Attributes:
+        file_name (str): Name of template file.
+        directory (str): Directory of template file, where outputs are written by default.
+        fields (list[str]): Names of fields used by template, in order of first use.
+        escape (bool): Escape LaTeX special characters in values, except Raw ones.
+        na_rep (str): Representation of missing values, e.g. None or NaN.
+    """
+
+    def __init__(self, template: TexFile, escape: bool = True, na_rep: str = '') -> None:
+        """Initialize MergeTemplate.
+
+        Args:
+            template (TexFile): Template with placeholders.
+            escape (bool, optional): Escape LaTeX special characters in values, except Raw ones. Defaults to True.
+            na_rep (str, optional): Representation of missing values, e.g. None or NaN. Defaults to ''.
+        """
+        self.file_name = template.file_name
+        self.directory = path.dirname(template.file_path)
+        self.escape = escape
+        self.na_rep = na_rep
+        text = ''.join(template.iter_chunks())
+        self._parts, self._slots = self._split(text)
+        self.fields = list(dict.fromkeys(self._slots))
+        head, begin, rest = text.partition(_BEGIN)
+        self._preamble: Optional[str] = None
+        self._body: tuple[list[str], list[str]] = ([], [])
+        if begin and _MARK not in head:
+            self._preamble = head + begin
+            self._body = self._split(rest[:rest.rfind(_END)])
+
+    @staticmethod
+    def _split(text: str) -> tuple[list[str], list[str]]:
+        """Splits text to static parts and names of slots between them.
+
+        Args:
+            text (str): Rendered template.
+
+        Returns:
+            tuple[list[str], list[str]]: Static parts, one more than slots, and names of slots.
+        """
+        pieces = _SLOT.split(text)
+        return pieces[::2], [bytes.fromhex(name).decode() for name in pieces[1::2]]
+
+    def values(self, record: Mapping[str, Any]) -> dict[str, str]:
+        """Returns TeX form of fields of record used by template.
+
+        Missing values, e.g. None, NaN of pandas or NaT, are replaced by na_rep.
+
+        Args:
+            record (Mapping[str, Any]): Record.
+
+        Raises:
+            KeyError: When record lacks some field of template.
+
+        Returns:
+            dict[str, str]: Values by names of fields.
+        """
+        try:
+            values = [record[name] for name in self.fields]
+        except KeyError as error:
+            raise KeyError(f"Record has no field {error.args[0]!r} used by template {self.file_name}.") from None
+        missing = [not isinstance(value, str) and _is_missing(value) for value in values]
+        texts = [value if isinstance(value, str) else '' if gap else str(value) for value, gap in zip(values, missing)]
+        texts = escape_all(texts) if self.escape else texts
+        return {name: self.na_rep if gap else text for name, text, gap in zip(self.fields, texts, missing)}
+
+    def iter_chunks(self, record: Mapping[str, Any]) -> Iterator[str]:
+        """Iterate over content of document of one record.
+
+        Args:
+            record (Mapping[str, Any]): Record.
+
+        Yields:
+            str: Successive pieces of content.
+        """
+        yield from self._fill(self._parts, self._slots, self.values(record))
+
+    @staticmethod
+    def _fill(parts: list[str], slots: list[str], values: dict[str, str]) -> Iterator[str]:
+        """Iterate over static parts with values of slots between them."""
+        yield parts[0]
+        for name, part in zip(slots, parts[1:]):
+            yield values[name]
+            yield part
+
+    def render(self, record: Mapping[str, Any]) -> str:
+        """Returns content of document of one record.
+
+        Args:
+            record (Mapping[str, Any]): Record.
+
+        Returns:
+            str: TeX content.
+        """
+        return ''.join(self.iter_chunks(record))
+
+    def output_name(self, record: Mapping[str, Any], index: int,
+                    name: Optional[str | Callable[[Mapping[str, Any]], str]] = None) -> str:
+        """Returns name of file of one record.
+
+        Args:
+            record (Mapping[str, Any]): Record.
+            index (int): Number of record, from 0.
+            name (str | Callable | None, optional): Format string with fields of record and index, or function of
+                record. Defaults to name of template with index.
+
+        Returns:
+            str: Name of file without extension.
+        """
+        if name is None:
+            return f"{self.file_name}_{index}"
+        if callable(name):
+            return name(record)
+        return name.format_map({**record, 'index': index})
+
+    def write_all(self, records: Iterable[Mapping[str, Any]] | Any,
+                  name: Optional[str | Callable[[Mapping[str, Any]], str]] = None,
+                  directory: Optional[str] = None) -> Iterator[str]:
+        """Writes TeX file for every record, lazily as the result is iterated.
+
+        Records are read one by one, so they may be a generator or a large
+        DataFrame. Files whose content did not change are not rewritten.
+        Record whose name repeats an earlier one is not written and stops
+        writing.
+
+        Args:
+            records (Iterable[Mapping[str, Any]] | DataFrame): Records, e.g. dicts or rows of DataFrame.
+            name (str | Callable | None, optional): Names of files, see output_name. Defaults to None.
+            directory (str | None, optional): Directory of files. Defaults to directory of template.
+
+        Raises:
+            KeyError: When record lacks some field of template.
+            ValueError: When two records have the same name of file.
+
+        Yields:
+            str: Paths to written files.
+        """
+        directory = self.directory if directory is None else directory
+        os.makedirs(directory or '.', exist_ok=True)
+        written: set[str] = set()
+        for index, record in enumerate(_records(records)):
+            file_path = path.join(directory, f"{self.output_name(record, index, name)}.tex")
+            if file_path in written:
+                raise ValueError(f"Record {index} of template {self.file_name} has the same file {file_path} as an "
+                                 "earlier record, make names unique, e.g. by {index}.")
+            written.add(file_path)
+            with open_output(file_path, 'w+', keep_unchanged=True) as fp:
+                fp.writelines(self.iter_chunks(record))
+            yield file_path
+
+    def write_combined(self, records: Iterable[Mapping[str, Any]] | Any, file_path: Optional[str] = None,
+                       separator: str = '\\clearpage\n') -> str:
+        """Writes one document containing body of template for every record.
+
+        Preamble is written once, so placeholders may be used only in document.
+
+        Args:
+            records (Iterable[Mapping[str, Any]] | DataFrame): Records, e.g. dicts or rows of DataFrame.
+            file_path (str | None, optional): Path to file. Defaults to name of template with _all in its directory.
+            separator (str, optional): TeX between bodies of records. Defaults to '\\clearpage\\n'.
+
+        Raises:
+            ValueError: When preamble contains placeholders or template has no document.
+            KeyError: When record lacks some field of template.
+
+        Returns:
+            str: Path to written file.
+        """
+        if self._preamble is None:
+            raise ValueError(f"Preamble of template {self.file_name} contains placeholders or it has no document.")
+        if file_path is None:
+            file_path = path.join(self.directory, f"{self.file_name}_all.tex")
+        parts, slots = self._body
+        with open_output(file_path, 'w+', keep_unchanged=True) as fp:
+            fp.write(self._preamble)
+            for index, record in enumerate(_records(records)):
+                if index:
+                    fp.write(separator)
+                fp.writelines(self._fill(parts, slots, self.values(record)))
+            fp.write(_END + '\n')
+        return file_path
+
+
+def merge(template: TexFile, records: Iterable[Mapping[str, Any]] | Any,
+          name: Optional[str | Callable[[Mapping[str, Any]], str]] = None, directory: Optional[str] = None,
+          escape: bool = True, combined: bool = False, na_rep: str = '') -> list[str]:
+    """Generates TeX file of template for every record, or one combined file.
+
+    Args:
+        template (TexFile): Template with placeholders.
+        records (Iterable[Mapping[str, Any]] | DataFrame): Records, e.g. dicts or rows of DataFrame.
+        name (str | Callable | None, optional): Names of files, see MergeTemplate.output_name, or name of combined
+            file. Defaults to None.
+        directory (str | None, optional): Directory of files. Defaults to directory of template.
+        escape (bool, optional): Escape LaTeX special characters in values, except Raw ones. Defaults to True.
+        combined (bool, optional): Write one document with pages of all records. Defaults to False.
+        na_rep (str, optional): Representation of missing values, e.g. None or NaN. Defaults to ''.
+
+    Raises:
+        KeyError: When record lacks some field of template.
+        ValueError: When combined and preamble contains placeholders, or when two records have the same name of file.
+
+    Returns:
+        list[str]: Paths to written files, compile them e.g. by build_all.
+    """
+    merged = MergeTemplate(template, escape, na_rep)
+    if combined:
+        if name is None or callable(name):
+            name = f"{merged.file_name}_all"
+        file_path = path.join(merged.directory if directory is None else directory, f"{name}.tex")
+        return [merged.write_combined(records, file_path)]
+    return list(merged.write_all(records, name, directory))
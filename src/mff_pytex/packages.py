@@ -2,7 +2,10 @@
 
 
 from mff_pytex.utils import command
-from typing import List
+from typing import Dict, Iterator, List, Optional
+from contextvars import ContextVar, Token
+import heapq
+from mff_pytex.exceptions import PackageOrderError
 
 
 class Package:
@@ -27,12 +30,200 @@ class Package:
         return command('usepackage', self.name, *self.optional)
 
 
-package_list: List[Package] = list()
-"""Package_list contains all packages used in tex document."""
+LATE_PACKAGES = {'hyperref': 1, 'cleveref': 2}
+"""Packages which have to be loaded after all others, in order of their rank."""
+
+
+class PackageRegistry:
+    """Packages used by single tex document.
+
+    Packages are indexed by name. Options of package added repeatedly are
+    merged. Packages are loaded in order of registration, except packages in
+    LATE_PACKAGES, which come last, and constraints declared by order().
+
+    Registry with parent uses packages and constraints of parent as well,
+    parent's ones first, even those added to parent later.
+
+    Attributes:
+        parent (PackageRegistry | None): Registry whose packages this one inherits.
+    """
+    def __init__(self, parent: Optional['PackageRegistry'] = None) -> None:
+        """Initialize empty PackageRegistry.
+
+        Args:
+            parent (PackageRegistry | None, optional): Registry whose packages this one inherits. Defaults to None.
+        """
+        self.parent = parent
+        self._packages: Dict[str, Package] = {}
+        self._after: Dict[str, List[str]] = {}
+        self._ordered: Optional[List[Package]] = None
+
+    def __iter__(self) -> Iterator[Package]:
+        return iter(self.packages)
+
+    def __len__(self) -> int:
+        return len(self._merged()._packages)
+
+    def __contains__(self, name: str) -> bool:
+        return any(name in registry._packages for registry in self._chain())
+
+    def _chain(self) -> List['PackageRegistry']:
+        """Returns ancestors of registry from the root one, and registry itself."""
+        chain = []
+        registry: Optional[PackageRegistry] = self
+        while registry is not None:
+            chain.append(registry)
+            registry = registry.parent
+        return chain[::-1]
+
+    def _merged(self) -> 'PackageRegistry':
+        """Returns registry with packages and constraints of ancestors merged, itself if it has no parent."""
+        if self.parent is None:
+            return self
+        merged = PackageRegistry()
+        for registry in self._chain():
+            merged.add(*registry._packages.values())
+            for first, seconds in registry._after.items():
+                merged._after.setdefault(first, []).extend(seconds)
+        return merged
+
+    @property
+    def packages(self) -> List[Package]:
+        """Registered packages in order of loading.
+
+        Raises:
+            PackageOrderError: When order constraints contain cycle.
+
+        Returns:
+            list[Package]: Ordered packages.
+        """
+        if self.parent is not None:
+            return self._merged().packages
+        if self._ordered is None:
+            self._ordered = self._sort()
+        return self._ordered
+
+    def _sort(self) -> List[Package]:
+        """Sorts packages by order constraints, keeping order of registration where possible.
+
+        Raises:
+            PackageOrderError: When order constraints contain cycle.
+
+        Returns:
+            list[Package]: Ordered packages.
+        """
+        names = sorted(self._packages, key=lambda name: LATE_PACKAGES.get(name, 0))
+        position = {name: index for index, name in enumerate(names)}
+        waiting = {name: 0 for name in names}
+        for first, seconds in self._after.items():
+            if first in waiting:
+                for second in seconds:
+                    if second in waiting:
+                        waiting[second] += 1
+        ready = [position[name] for name in names if waiting[name] == 0]
+        heapq.heapify(ready)
+        ordered = []
+        while ready:
+            name = names[heapq.heappop(ready)]
+            ordered.append(self._packages[name])
+            for second in self._after.get(name, ()):
+                if second in waiting:
+                    waiting[second] -= 1
+                    if waiting[second] == 0:
+                        heapq.heappush(ready, position[second])
+        if len(ordered) != len(names):
+            raise PackageOrderError()
+        return ordered
+
+    def find(self, package: Package) -> bool:
+        """Find package in registry
+
+        Args:
+            package (Package)
+
+        Returns:
+            bool
+        """
+        return package.name in self
+
+    def add(self, *packages: Package) -> None:
+        """Adds packages to registry, merging options of packages already added.
+
+        Args:
+            *packages (Package): packages to add.
+        """
+        for package in packages:
+            registered = self._packages.get(package.name)
+            if registered is None:
+                self._packages[package.name] = package
+            elif not set(package.optional) <= set(registered.optional):
+                options = dict.fromkeys(registered.optional + package.optional)
+                self._packages[package.name] = Package(package.name, *options)
+            else:
+                continue
+            self._ordered = None
+
+    def order(self, first: str, second: str) -> None:
+        """Declares that package first has to be loaded before package second.
+
+        Constraint applies, when both packages are registered.
+
+        Args:
+            first (str): Name of package loaded earlier.
+            second (str): Name of package loaded later.
+        """
+        self._after.setdefault(first, []).append(second)
+        self._ordered = None
+
+    def clear(self) -> None:
+        """Clears registry, packages of parent are kept.
+        """
+        self._packages.clear()
+        self._after.clear()
+        self._ordered = None
+
+
+default_registry = PackageRegistry()
+"""Registry used when no document is active."""
+
+_active_registry: ContextVar[PackageRegistry] = ContextVar('active_registry')
+
+
+def get_registry() -> PackageRegistry:
+    """Returns registry of active document.
+
+    Every thread and asyncio task has its own active registry, so documents
+    built concurrently do not share packages.
+
+    Returns:
+        PackageRegistry: Active registry, default_registry if no document is active.
+    """
+    return _active_registry.get(default_registry)
+
+
+def activate_registry(registry: PackageRegistry) -> Token:
+    """Makes registry active in current context.
+
+    Args:
+        registry (PackageRegistry): Registry to activate.
+
+    Returns:
+        Token: Token restoring previous registry with deactivate_registry.
+    """
+    return _active_registry.set(registry)
+
+
+def deactivate_registry(token: Token) -> None:
+    """Restores registry which was active before activate_registry.
+
+    Args:
+        token (Token): Token returned by activate_registry.
+    """
+    _active_registry.reset(token)
 
 
 def find_package(package: Package) -> bool:
-    """Find package in package_list
+    """Find package in active registry
 
     Args:
         package (Package)
@@ -40,37 +231,38 @@ def find_package(package: Package) -> bool:
     Returns:
         bool
     """
-    global package_list
-    for pkg in package_list:
-        if pkg.name == package.name:
-            return True
-    return False
+    return get_registry().find(package)
 
 
 def add_package(*packages: Package) -> None:
-    """Adds packages to package_list
+    """Adds packages to active registry
 
     Args:
         *packages (Package): packages to add.
     """
-    global package_list
-    for package in packages:
-        if not find_package(package):
-            package_list.append(package)
+    get_registry().add(*packages)
 
 
 def get_packages() -> List[Package]:
-    """Returns package_list
+    """Returns packages of active registry
 
     Returns:
-        list[Package]: package_list
+        list[Package]: packages
+    """
+    return get_registry().packages
+
+
+def order_packages(first: str, second: str) -> None:
+    """Declares in active registry that package first has to be loaded before package second.
+
+    Args:
+        first (str): Name of package loaded earlier.
+        second (str): Name of package loaded later.
     """
-    global package_list
-    return package_list
+    get_registry().order(first, second)
 
 
 def clear_packages() -> None:
-    """Clears package_list
+    """Clears active registry
     """
-    global package_list
-    package_list.clear()
+    get_registry().clear()
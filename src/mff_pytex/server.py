@@ -0,0 +1,263 @@
+"""Render server keeping a warm interpreter, which runs jobs submitted over a Unix socket.
+
+Jobs and their results are sent as JSON objects, one per line. Every job runs
+in a process forked from the server, so it starts with all modules imported
+and caches filled, but it can not change state of the server.
+"""
+
+from typing import Any, Iterator, Optional
+from dataclasses import asdict
+from datetime import date
+import contextlib
+import importlib
+import io
+import json
+import os
+import runpy
+import socket
+import socketserver
+import sys
+import time
+import traceback
+from os import path
+from mff_pytex.build import ENGINES, _build_job, engine_version
+from mff_pytex.exceptions import RenderServerError
+from mff_pytex.packages import Package, add_package
+from mff_pytex.structure import DocumentClass, TexFile
+from mff_pytex.utils import get_cache_dir
+
+
+WARM_MODULES = ('numpy', 'pandas', 'mff_pytex.structure', 'mff_pytex.tables', 'mff_pytex.bib', 'mff_pytex.images',
+                'mff_pytex.assets', 'mff_pytex.fragments')
+"""Modules imported by server before it accepts jobs, missing ones are skipped."""
+
+
+def socket_path() -> str:
+    """Returns path to socket of render server.
+
+    Location is given by MFF_PYTEX_SOCKET environment variable, defaults to
+    mff_pytex.sock in XDG runtime directory or in cache directory.
+
+    Returns:
+        str: Path to socket.
+    """
+    socket_file = os.environ.get('MFF_PYTEX_SOCKET')
+    if socket_file is not None:
+        return socket_file
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    return path.join(runtime if runtime and path.isdir(runtime) else get_cache_dir(), 'mff_pytex.sock')
+
+
+def texfile_from_spec(spec: dict[str, Any]) -> TexFile:
+    """Creates TeX file from its description.
+
+    Description is a dict with keys name, directory, documentclass (name and
+    its options), title, author, date (ISO format), packages (lists of name and
+    options) and body (lines of document).
+
+    Args:
+        spec (dict[str, Any]): Description of document.
+
+    Returns:
+        TexFile: Document.
+    """
+    texfile = TexFile(spec['name'])
+    texfile.file_path = path.join(spec.get('directory', '.'), f"{spec['name']}.tex")
+    documentclass = spec.get('documentclass')
+    if documentclass is not None:
+        documentclass = [documentclass] if isinstance(documentclass, str) else documentclass
+        texfile.preamble.documentclass = DocumentClass(*documentclass)
+    texfile.preamble.title = spec.get('title')
+    texfile.preamble.author = spec.get('author')
+    if spec.get('date') is not None:
+        texfile.preamble.date = date.fromisoformat(spec['date'])
+    with texfile:
+        for package in spec.get('packages', []):
+            add_package(Package(*([package] if isinstance(package, str) else package)))
+    texfile.document.write(*spec.get('body', []))
+    return texfile
+
+
+class _Stream(io.TextIOBase):
+    """Text stream sending written lines to client as messages."""
+
+    def __init__(self, send: Any, name: str) -> None:
+        self.send = send
+        self.name = name
+        self.buffer = ''
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self.buffer += text
+        if '\n' in text:
+            end = self.buffer.rindex('\n') + 1
+            self.send({'type': self.name, 'text': self.buffer[:end]})
+            self.buffer = self.buffer[end:]
+        return len(text)
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.send({'type': self.name, 'text': self.buffer})
+            self.buffer = ''
+
+
+class RenderHandler(socketserver.StreamRequestHandler):
+    """Runs single job of client in forked process and streams back its output and result."""
+
+    def send(self, message: dict[str, Any]) -> None:
+        """Sends message to client.
+
+        Args:
+            message (dict[str, Any]): JSON serializable message.
+        """
+        self.wfile.write(json.dumps(message).encode() + b'\n')
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        start = time.perf_counter()
+        try:
+            job = json.loads(line)
+            os.chdir(job.get('cwd', os.getcwd()))
+            stdout, stderr = _Stream(self.send, 'stdout'), _Stream(self.send, 'stderr')
+            try:
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                    result = self.run_job(job)
+            finally:
+                stdout.flush()
+                stderr.flush()
+            result.setdefault('ok', True)
+        except Exception as error:
+            result = {'ok': False, 'error': f"{type(error).__name__}: {error}", 'traceback': traceback.format_exc()}
+        result.update(type='result', duration=time.perf_counter() - start)
+        try:
+            self.send(result)
+        except OSError:
+            pass  # client is gone
+
+    def run_job(self, job: dict[str, Any]) -> dict[str, Any]:
+        """Runs job and returns its result.
+
+        Args:
+            job (dict[str, Any]): Job with action 'run' and script and args, action 'build' and files and options,
+                or action 'render' and spec and options.
+
+        Raises:
+            ValueError: When action is not known.
+
+        Returns:
+            dict[str, Any]: Fields of result message.
+        """
+        action = job.get('action')
+        if action == 'run':
+            script = path.abspath(job['script'])
+            sys.argv = [script, *job.get('args', [])]
+            sys.path.insert(0, path.dirname(script))
+            try:
+                runpy.run_path(script, run_name='__main__')
+            except SystemExit as error:
+                code = error.code if isinstance(error.code, int) else (error.code is not None)
+                return {'ok': code == 0, 'returncode': code}
+            return {'returncode': 0}
+        if action == 'build':
+            options = job.get('options', {})
+            results = [asdict(_build_job(file_path, job.get('output_dir'), job.get('force', False), options))
+                       for file_path in job['files']]
+            return {'ok': all(result['ok'] for result in results), 'results': results}
+        if action == 'render':
+            texfile = texfile_from_spec(job['spec'])
+            texfile.create()
+            if not job.get('pdf', True):
+                return {'tex_path': texfile.file_path}
+            result = asdict(_build_job(texfile.file_path, None, job.get('force', False), job.get('options', {})))
+            return {'ok': result['ok'], 'tex_path': texfile.file_path, 'results': [result]}
+        raise ValueError(f"Unknown action {action!r}.")
+
+
+class RenderServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """Server forking a process for every job from its warm interpreter."""
+
+    def server_bind(self) -> None:
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+
+def warm_up(engines: tuple[str, ...] = ()) -> None:
+    """Imports WARM_MODULES and fills caches shared by jobs.
+
+    Args:
+        engines (tuple[str, ...], optional): TeX engines whose versions are cached. Defaults to ().
+    """
+    for name in WARM_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    for engine in engines:
+        engine_version(ENGINES[engine].name)
+
+
+def serve(socket_file: Optional[str] = None, engines: tuple[str, ...] = ()) -> None:
+    """Runs render server until it is interrupted.
+
+    Args:
+        socket_file (str | None, optional): Path to socket. Defaults to socket_path().
+        engines (tuple[str, ...], optional): TeX engines whose versions are cached. Defaults to ().
+
+    Raises:
+        RenderServerError: When another server is already listening on the socket.
+    """
+    socket_file = socket_file or socket_path()
+    if path.exists(socket_file):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(socket_file)
+            except OSError:
+                os.unlink(socket_file)  # left by server which did not stop cleanly
+            else:
+                raise RenderServerError(f"Render server is already listening on {socket_file}.")
+    warm_up(engines)
+    try:
+        with RenderServer(socket_file, RenderHandler) as server:
+            server.serve_forever()
+    finally:
+        if path.exists(socket_file):
+            os.unlink(socket_file)
+
+
+def submit(job: dict[str, Any], socket_file: Optional[str] = None) -> Iterator[dict[str, Any]]:
+    """Sends job to render server and yields its messages as they come.
+
+    Messages have type 'stdout' or 'stderr' with text, and the last one type
+    'result' with ok, duration and other fields of result.
+
+    Args:
+        job (dict[str, Any]): Job, see RenderHandler.run_job. Working directory of job defaults to current one.
+        socket_file (str | None, optional): Path to socket. Defaults to socket_path().
+
+    Raises:
+        RenderServerError: When server is not running or connection is lost.
+
+    Yields:
+        dict[str, Any]: Messages of server.
+    """
+    socket_file = socket_file or socket_path()
+    job = {'cwd': os.getcwd(), **job}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_file)
+        except OSError:
+            raise RenderServerError(f"Render server is not running on {socket_file}, start it by mff_pytex serve.") from None
+        client.sendall(json.dumps(job).encode() + b'\n')
+        with client.makefile('rb') as stream:
+            for line in stream:
+                message = json.loads(line)
+                yield message
+                if message['type'] == 'result':
+                    return
+    raise RenderServerError('Render server closed connection before sending result.')
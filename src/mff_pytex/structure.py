@@ -1,16 +1,29 @@
 """Module containing basic structure of file."""
 
 from datetime import date as datum
-from typing import Optional
-from mff_pytex.utils import command, Writing, Environment, get_func_name, File
-import os
-from dataclasses import dataclass
-from mff_pytex.packages import get_packages
+from typing import Any, Iterable, Iterator, Optional
+import asyncio
+import time
+from mff_pytex.utils import command, Writing, Environment, get_func_name, File, open_output
+from contextvars import Token
+from dataclasses import dataclass, field
+from mff_pytex.packages import PackageRegistry, default_registry, get_registry, activate_registry, deactivate_registry
+from mff_pytex.build import Build, BuildResult, Engine
+from mff_pytex.events import BuildEvent, BuildHook, emit, get_hooks, timed
+from mff_pytex.cache import PdfCache
+from mff_pytex.images import Picture
+from mff_pytex.assets import AssetSettings, prepare_assets, resolve_image
+from os import path
+from mff_pytex.bib import Bibliography
 
 
 # TODO document structuring
 
 
+CHAPTER_CLASSES = frozenset({'book', 'report', 'memoir', 'scrbook', 'scrreprt'})
+"""Document classes which have chapter command."""
+
+
 class DocumentClass:
     """Document class command.
     """
@@ -32,44 +45,152 @@ class DocumentClass:
         """
         return command('documentclass', self.name, *self.params)
 
+    @property
+    def top_level(self) -> str:
+        """Highest sectioning command used for chapters, chapter if class has it, section otherwise."""
+        return 'chapter' if self.name in CHAPTER_CLASSES else 'section'
+
 
 @dataclass
 class Preamble(Writing):
     """Preamble contains basic info about author and document.
+
+    Note:
+        Packages are taken from packages registry, if it is None, from registry active while rendering.
     """
-    documentclass: DocumentClass = DocumentClass('article')
+    documentclass: DocumentClass = field(default_factory=lambda: DocumentClass('article'))
     author: Optional[str] = None
     title: Optional[str] = None
     date: Optional[datum] = None
+    includeonly: Optional[list[str]] = None
+    packages: Optional[PackageRegistry] = field(default=None, repr=False, compare=False)
 
-    def __str__(self) -> str:
-        """Returns Preamble as string in TeX form.
+    def __post_init__(self) -> None:
+        Writing.__init__(self)
 
-        Returns:
-            str: Preamble in TeX form.
+    def _revision(self) -> Optional[int]:
+        """Preamble depends on registered packages, so it is always rendered again."""
+        return None
+
+    def _parts(self) -> Iterator[Any]:
+        """Iterate over Preamble in TeX form.
+
+        Yields:
+            str | Any: Successive pieces of preamble.
+        """
+        yield f"{self.documentclass}\n\n"
+        for package in get_registry() if self.packages is None else self.packages:
+            yield f"{package}\n"
+        yield '\n'
+        yield from super()._parts()
+        yield '\n\n'
+        yield f"{command('title', self.title)}\n"
+        yield f"{command('author', self.author)}\n"
+        yield f"{command('date', str(self.date))}\n"
+        if self.includeonly is not None:
+            yield f"{command('includeonly', ','.join(self.includeonly))}\n"
+
+
+class Chapter(Writing):
+    """Part of document written to its own TeX file, which document includes.
+
+    Attributes:
+        name (str): Name of TeX file of chapter without extension, relative to directory of main TeX file.
+        title (str | None): Title of chapter, None for no heading.
+        level (str | None): Sectioning command of heading, e.g. 'chapter', 'part' or 'section', None for
+            DocumentClass.top_level of document, whose TeX file then writes the heading.
+    """
+
+    def __init__(self, name: str, title: Optional[str] = None, level: Optional[str] = None) -> None:
+        """Initialize Chapter.
+
+        Args:
+            name (str): Name of TeX file without extension.
+            title (str | None, optional): Title of chapter. Defaults to None.
+            level (str | None, optional): Sectioning command of heading. Defaults to top level of document class.
+        """
+        super().__init__()
+        self.name = name
+        self.title = title
+        self.level = level
+
+    def _parts(self) -> Iterator[Any]:
+        """Iterate over heading and content of chapter.
+
+        Yields:
+            str | Any: Chunk of text or child node.
         """
-        text = Writing()
-        text.write(str(self.documentclass))
-        text.write('')
-        text.write(*map(str, get_packages()))
-        text.write('')
-        text.write(self._text)
-        text.write('')
-        text.write(command('title', self.title))
-        text.write(command('author', self.author))
-        text.write(command('date', str(self.date)))
-        return str(text)
+        if self.title is not None and self.level is not None:
+            yield f"{command(self.level, self.title)}\n"
+        yield from super()._parts()
 
 
 class Document(Environment):
-    """Content of document."""
+    """Content of document.
+
+    Attributes:
+        citations (dict[str, None]): Keys cited by cite method, in order of citing.
+        chapters (list[Chapter]): Chapters included by include method, written to their own files.
+    """
 
     def __init__(self) -> None:
         """Initialize document.
         """
-        self._text = ""
-        self.en_type = "document"
-        self.write(command('begin', self.en_type))
+        super().__init__('document')
+        self.citations: dict[str, None] = {}
+        self.chapters: list[Chapter] = []
+
+    def walk(self) -> Iterator[Any]:
+        """Iterate over document, its descendants and included chapters.
+
+        Yields:
+            Writing | Any: Successive nodes.
+        """
+        yield from super().walk()
+        for chapter in self.chapters:
+            yield from chapter.walk()
+
+    def include(self, chapter: Chapter) -> Chapter:
+        """Adds an include command of chapter written to its own TeX file.
+
+        Args:
+            chapter (Chapter): Included chapter.
+
+        Returns:
+            Chapter: The chapter.
+        """
+        self.chapters.append(chapter)
+        self.write(command(get_func_name(), chapter.name))
+        return chapter
+
+    def chapter(self, name: str, title: Optional[str] = None, level: Optional[str] = None) -> Chapter:
+        """Creates chapter written to its own TeX file and includes it.
+
+        Args:
+            name (str): Name of TeX file without extension.
+            title (str | None, optional): Title of chapter. Defaults to None.
+            level (str | None, optional): Sectioning command of heading. Defaults to top level of document class.
+
+        Returns:
+            Chapter: New chapter, to be filled by write, add etc.
+        """
+        return self.include(Chapter(name, title, level))
+
+    def cite(self, *keys: str, note: Optional[str] = None, name: str = 'cite') -> str:
+        """Creates a cite command and records cited keys.
+
+        Args:
+            *keys (str): Names of cited records.
+            note (str | None, optional): Note after citation, e.g. page. Defaults to None.
+            name (str, optional): Name of command, e.g. 'citep' or 'citet' of natbib. Defaults to 'cite'.
+
+        Returns:
+            str: Cite command, which can be included in written text.
+        """
+        self.citations.update(dict.fromkeys(keys))
+        if note is None:
+            return command(name, ','.join(keys))
+        return command(name, ','.join(keys), note)
 
     def tableofcontents(self) -> None:
         """Adds a tableofcontents command to the TeX file."""
@@ -87,12 +208,18 @@ class Document(Environment):
         """Adds a clearpage command to the TeX file."""
         self.write(command(get_func_name()))
 
-    def bibliography(self, name: str) -> None:
+    def bibliography(self, name: str | Bibliography) -> None:
         """Adds a bibliography command to the TeX file.
 
+        Given Bibliography learns keys cited in this document, so it can write only them.
+
         Args:
-            name (str): Name of a bib file
+            name (str | Bibliography): Name of a bib file or Bibliography
         """
+        if isinstance(name, Bibliography):
+            if not any(document is self for document in name.documents):
+                name.documents.append(self)
+            name = name.file_name
         self.write(command(get_func_name(), name))
 
     def listoffigures(self) -> None:
@@ -106,35 +233,232 @@ class Document(Environment):
 
 class TexFile(File):
     """TeX file.
+
+    Every TeX file has its own preamble, document and registry of packages.
+    Used as context manager, it activates its registry inside with block in
+    current thread or asyncio task, so packages added there by add_package,
+    Table, Picture etc. belong only to it. Packages added outside of any with
+    block go to default_registry, which is inherited by all TeX files.
+
+    Attributes:
+        packages (PackageRegistry): Packages used by this file.
+        preamble (Preamble): Preamble of this file.
+        document (Document): Content of this file.
     """
     file_type = 'tex'
-    preamble: Preamble = Preamble()
-    document: Document = Document()
 
-    def create(self, mode: str = 'w+') -> None:
+    def __init__(self, file_name: str) -> None:
+        """Initialize TexFile
+
+        Args:
+            file_name (str): Name of file which will be created.
+        """
+        super().__init__(file_name)
+        self.packages = PackageRegistry(parent=default_registry)
+        self.preamble = Preamble(packages=self.packages)
+        self.document = Document()
+        self._tokens: list[Token] = []
+
+    def __enter__(self) -> 'TexFile':
+        self._tokens.append(activate_registry(self.packages))
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        deactivate_registry(self._tokens.pop())
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state['_tokens'] = []
+        return state
+
+    def iter_chunks(self) -> Iterator[str]:
+        """Iterate over content of the whole file, preamble first.
+
+        Yields:
+            str: Successive pieces of content.
+        """
+        yield from self.preamble.iter_chunks()
+        yield from self.document.iter_chunks()
+
+    def chapter_path(self, chapter: Chapter) -> str:
+        """Returns path to TeX file of chapter.
+
+        Args:
+            chapter (Chapter): Chapter of document.
+
+        Returns:
+            str: Path next to this TeX file.
+        """
+        return path.join(path.dirname(self.file_path), f"{chapter.name}.tex")
+
+    def include_only(self, only: Optional[Iterable[str | Chapter]]) -> None:
+        """Sets chapters compiled by includeonly command, the others keep pages and references of the last build.
+
+        Setting is kept for all following writes, unlike only argument of create and make_pdf.
+
+        Args:
+            only (Iterable[str | Chapter] | None): Chapters or their names, None to compile all chapters.
+        """
+        self.preamble.includeonly = None if only is None else [getattr(chapter, 'name', chapter) for chapter in only]
+
+    def _outputs(self) -> Iterator[tuple[str, Iterator[str]]]:
+        """Iterate over written files, this file first and then files of chapters.
+
+        Yields:
+            tuple[str, Iterator[str]]: Path to file and its content.
+        """
+        yield self.file_path, self.iter_chunks()
+        for chapter in self.document.chapters:
+            yield self.chapter_path(chapter), self._chapter_chunks(chapter)
+
+    def _chapter_chunks(self, chapter: Chapter) -> Iterator[str]:
+        """Iterate over content of file of chapter, with heading of top level of document class if chapter has no level.
+
+        Yields:
+            str: Successive pieces of content.
+        """
+        if chapter.title is not None and chapter.level is None:
+            yield f"{command(self.preamble.documentclass.top_level, chapter.title)}\n"
+        yield from chapter.iter_chunks()
+
+    def create(self, mode: str = 'w+', hooks: Optional[Iterable[BuildHook]] = None,
+               only: Optional[Iterable[str | Chapter]] = None) -> None:
         """Creates file and writes its content.
 
+        Content is streamed chunk by chunk through a buffered file. When the file
+        is overwritten, it is written to a temporary file first, which then
+        atomically replaces the old one, unless its content is the same, so
+        timestamp of unchanged file is kept. Included chapters are written to
+        their own files the same way. When there are hooks, time spent by
+        rendering and by writing is emitted as 'render' and 'write' events.
+
         Args:
             mode (str, optional): Mode of given file. Same as open() function. Defaults to 'w+'
+            hooks (Iterable[BuildHook] | None, optional): Hooks receiving events. Defaults to hooks registered by add_hook.
+            only (Iterable[str | Chapter] | None, optional): Compile only these chapters in this write, see include_only.
+                Defaults to None, chapters set by include_only, all of them unless it was called.
+        """
+        if only is not None:
+            includeonly = self.preamble.includeonly
+            self.include_only(only)
+            try:
+                self.create(mode, hooks)
+            finally:
+                self.preamble.includeonly = includeonly
+            return
+        hooks = get_hooks() if hooks is None else list(hooks)
+        if not hooks:
+            for file_path, chunks in self._outputs():
+                with open_output(file_path, mode, keep_unchanged=True) as tex:
+                    tex.writelines(chunks)
+            return
+        clock = time.perf_counter
+        render = 0.0
+        start = clock()
+        for file_path, chunks in self._outputs():
+            with open_output(file_path, mode, keep_unchanged=True) as tex:
+                mark = clock()
+                for chunk in chunks:
+                    rendered = clock()
+                    render += rendered - mark
+                    tex.write(chunk)
+                    mark = clock()
+        total = clock() - start
+        emit(BuildEvent('render', self.file_name, render), hooks)
+        emit(BuildEvent('write', self.file_name, total - render), hooks)
+
+    def prepare_assets(self, settings: Optional[AssetSettings] = None, jobs: Optional[int] = None) -> dict[str, str]:
+        """Prepares images of all pictures in document and includes prepared ones instead.
+
+        Paths of pictures are relative to directory of TeX file. See prepare_assets.
+
+        Args:
+            settings (AssetSettings | None, optional): Settings of preparation. Defaults to AssetSettings().
+            jobs (int | None, optional): Number of processes, number of CPUs if None.
+
+        Raises:
+            MissingAssetError: When some image does not exist.
+            AssetError: When image can not be converted.
+
+        Returns:
+            dict[str, str]: Paths to prepared images by paths to sources.
         """
-        tex = open(self.file_path, mode)
-        tex.write(str(self.preamble))
-        tex.write(str(self.document))
-        tex.close()
+        directory = path.dirname(self.file_path)
+        pictures = {picture: resolve_image(path.join(directory, picture.picture_path))
+                    for picture in self.document.walk() if isinstance(picture, Picture)}
+        with timed('assets', self.file_name):
+            prepared = prepare_assets(pictures.values(), settings, jobs)
+        for picture, source in pictures.items():
+            picture.prepared_path = None if prepared[source] == source else prepared[source]
+        return prepared
 
-    def make_pdf(self, mode: str = 'r') -> None:
+    def make_pdf(self, mode: str = 'r', force: bool = False, engine: str | Engine = 'pdflatex', draft: bool = True,
+                 precompile: bool = False, cache: bool | PdfCache = False, assets: bool | AssetSettings = False,
+                 pass_timeout: Optional[float] = None, timeout: Optional[float] = None,
+                 only: Optional[Iterable[str | Chapter]] = None) -> int:
         """Creates pdf file, if neccessary writes its content and create pdf document.
 
+        Build is incremental, only passes of TeX engine and bibtex which are needed are run.
+
         Args:
             mode (str, optional): mode of given file. Same as open() function. Defaults to 'r'.
+            force (bool, optional): Compile even if pdf is up to date. Defaults to False.
+            engine (str | Engine, optional): TeX engine, one of 'pdflatex', 'xelatex' and 'lualatex'. Defaults to 'pdflatex'.
+            draft (bool, optional): Run intermediate passes in draft mode. Defaults to True.
+            precompile (bool, optional): Load preamble from cached format dumped by mylatexformat. Defaults to False.
+            cache (bool | PdfCache, optional): Reuse pdf compiled from the same sources. Defaults to False.
+            assets (bool | AssetSettings, optional): Prepare images of pictures before writing file, requires writing
+                mode. Defaults to False.
+            pass_timeout (float | None, optional): Limit of duration of one program run in seconds. Defaults to None.
+            timeout (float | None, optional): Limit of duration of compilation in seconds. Defaults to None.
+            only (Iterable[str | Chapter] | None, optional): Compile only these chapters when file is written, see create.
+                Defaults to None.
+
+        Raises:
+            ValueError: When assets are prepared with mode 'r', which does not write file including them.
+            CompilationError: When compilation fails.
+            CompilationTimeoutError: When compilation runs out of time.
+
+        Returns:
+            int: Number of engine passes.
+        """
+        if assets and mode in ['r']:
+            raise ValueError("Prepared assets are included only when TeX file is written, use mode 'w+'.")
+        if assets:
+            self.prepare_assets(None if assets is True else assets)
+        if mode not in ['r']:
+            self.create(mode, only=only)
+        return Build(self.file_path, engine, draft, precompile=precompile, cache=cache, pass_timeout=pass_timeout,
+                     timeout=timeout).run(force)
+
+    async def make_pdf_async(self, mode: str = 'r', force: bool = False, engine: str | Engine = 'pdflatex',
+                             draft: bool = True, precompile: bool = False, cache: bool | PdfCache = False,
+                             pass_timeout: Optional[float] = None, timeout: Optional[float] = None,
+                             limit: Optional[asyncio.Semaphore] = None,
+                             only: Optional[Iterable[str | Chapter]] = None) -> BuildResult:
+        """Creates pdf file like make_pdf without blocking event loop.
+
+        File is written in a worker thread and programs are awaited as subprocesses.
+        Cancelling the task kills running program.
+
+        Args:
+            mode (str, optional): mode of given file. Same as open() function. Defaults to 'r'.
+            force (bool, optional): Compile even if pdf is up to date. Defaults to False.
+            engine (str | Engine, optional): TeX engine, one of 'pdflatex', 'xelatex' and 'lualatex'. Defaults to 'pdflatex'.
+            draft (bool, optional): Run intermediate passes in draft mode. Defaults to True.
+            precompile (bool, optional): Load preamble from cached format dumped by mylatexformat. Defaults to False.
+            cache (bool | PdfCache, optional): Reuse pdf compiled from the same sources. Defaults to False.
+            pass_timeout (float | None, optional): Limit of duration of one program run in seconds. Defaults to None.
+            timeout (float | None, optional): Limit of duration of compilation in seconds. Defaults to None.
+            limit (asyncio.Semaphore | None, optional): Limit of concurrent builds. Defaults to get_compile_limit().
+            only (Iterable[str | Chapter] | None, optional): Compile only these chapters when file is written, see create.
+                Defaults to None.
+
+        Returns:
+            BuildResult: Outcome of build with return code, durations of passes and path to log.
         """
         if mode not in ['r']:
-            self.create(mode)
-        print('first')
-        os.system(f"pdflatex {self.file_path}")
-        print('bib')
-        os.system(f"bibtex {self.file_name}")
-        print('second')
-        os.system(f"pdflatex {self.file_path}")
-        print('third')
-        os.system(f"pdflatex {self.file_path}")
+            await asyncio.to_thread(self.create, mode, None, only)
+        build = Build(self.file_path, engine, draft, precompile=precompile, cache=cache, pass_timeout=pass_timeout,
+                      timeout=timeout)
+        return await build.run_async(force, limit)
@@ -1,17 +1,155 @@
 """Tables and lists utilities and support for pandas dataframe."""
 
-from typing import Any, Optional, Union
-from collections.abc import Sequence
+from typing import Any, Optional, Union, TYPE_CHECKING
+from collections.abc import Iterable, Iterator, Mapping, Sequence
 from mff_pytex.utils import command, Environment
 from mff_pytex.exceptions import WrongTypeListError
+from mff_pytex.escaping import escape as escape_latex, escape_all, escape_series
 from mff_pytex.packages import add_package, Package
-from pandas import DataFrame
+
+if TYPE_CHECKING:
+    from pandas import DataFrame, Series
+
+
+FAST_STYLES = frozenset({'index', 'header', 'na_rep', 'float_format', 'escape', 'column_format', 'caption', 'label'})
+"""Parameters of to_latex supported by fast renderer."""
+
+
+def _format_column(column: 'Series', na_rep: str, float_format: Any, escape: bool) -> Optional[list[str]]:
+    """Formats all cells of column at once.
+
+    Args:
+        column (Series): Column to format.
+        na_rep (str): Representation of missing values.
+        float_format (str | Callable | None): Format of floats, same as in to_latex.
+        escape (bool): Escape LaTeX special characters in strings.
+
+    Returns:
+        list[str] | None: Formatted cells, None if column needs to_latex.
+    """
+    import numpy as np
+    from pandas.api.types import infer_dtype, is_bool_dtype, is_float_dtype, is_integer_dtype, is_string_dtype
+
+    dtype = column.dtype
+    if isinstance(dtype, np.dtype) and (is_integer_dtype(dtype) or is_bool_dtype(dtype)):
+        return column.to_numpy().astype(str).tolist()
+    if isinstance(dtype, np.dtype) and is_float_dtype(dtype):
+        values = column.to_numpy()
+        if float_format is None:
+            cells = np.char.mod('%.6f', values).astype(object)
+        elif isinstance(float_format, str):
+            cells = np.char.mod(float_format, values).astype(object)
+        else:
+            cells = np.array([float_format(value) for value in values.tolist()], dtype=object)
+        cells[np.isnan(values)] = na_rep
+        return cells.tolist()
+    if is_string_dtype(dtype) and infer_dtype(column, skipna=True) in ('string', 'empty'):
+        cells = (escape_series(column) if escape else column).to_numpy(dtype=object, copy=True)
+        cells[column.isna().to_numpy()] = na_rep
+        return cells.tolist()
+    return None
+
+
+def _header_line(columns: Sequence, index: bool, escape: bool) -> str:
+    """Returns header row of table.
+
+    Args:
+        columns (Sequence): Names of columns.
+        index (bool): Table has index column.
+        escape (bool): Escape LaTeX special characters in names.
+
+    Returns:
+        str: Header row.
+    """
+    names = [str(name) for name in columns]
+    if escape:
+        names = [escape_latex(name) for name in names]
+    return ' & '.join([''] * bool(index) + names) + ' \\\\'
+
+
+def _as_text(value: Any) -> str:
+    """Converts value to text, strings including Raw ones are kept.
+
+    Args:
+        value (Any): Value to convert.
+
+    Returns:
+        str: Text of value.
+    """
+    return value if isinstance(value, str) else str(value)
+
+
+def render_table(df: 'DataFrame | Series', **styles: Any) -> Optional[str]:
+    """Renders dataframe to booktabs tabular with vectorized formatting.
+
+    Output is the same as of to_latex method of DataFrame. Whole columns are
+    formatted at once and rows are assembled with single join, which is much
+    faster than to_latex for large dataframes.
+
+    Args:
+        df (DataFrame | Series): Dataframe to render.
+        **styles (Any): Parameters of to_latex, only those in FAST_STYLES are supported.
+
+    Returns:
+        str | None: TeX table, None if dataframe or styles are not supported and to_latex has to be used.
+    """
+    import pandas as pd
+
+    if not styles.keys() <= FAST_STYLES or int(pd.__version__.split('.')[0]) < 2:
+        return None
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    index = styles.get('index', True)
+    header = styles.get('header', True)
+    escape = bool(styles.get('escape', False))
+    if not isinstance(header, bool) or df.empty or df.columns.nlevels != 1 or df.index.nlevels != 1:
+        return None
+    if df.columns.name is not None or df.index.name is not None or not df.columns.is_unique:
+        return None
+    columns = []
+    if index:
+        if pd.api.types.infer_dtype(df.index, skipna=False) not in ('integer', 'string'):
+            return None
+        labels = df.index.astype(str).tolist()
+        columns.append([escape_latex(label) for label in labels] if escape else labels)
+    column_format = styles.get('column_format')
+    alignment = ['l'] if index else []
+    for name in df.columns:
+        cells = _format_column(df[name], styles.get('na_rep', 'NaN'), styles.get('float_format'), escape)
+        if cells is None:
+            return None
+        columns.append(cells)
+        alignment.append('r' if pd.api.types.is_numeric_dtype(df[name].dtype) else 'l')
+    lines = []
+    caption = styles.get('caption')
+    label = styles.get('label')
+    if caption is not None or label is not None:
+        if not isinstance(caption, (str, type(None))):
+            return None
+        lines.append('\\begin{table}')
+        if caption is not None:
+            lines.append(f"\\caption{{{caption}}}")
+        if label is not None:
+            lines.append(f"\\label{{{label}}}")
+    lines.append(f"\\begin{{tabular}}{{{column_format or ''.join(alignment)}}}")
+    lines.append('\\toprule')
+    if header:
+        lines.append(_header_line(df.columns, index, escape))
+    lines.append('\\midrule')
+    lines.append(' \\\\\n'.join(map(' & '.join, zip(*columns))) + ' \\\\')
+    lines.append('\\bottomrule')
+    lines.append('\\end{tabular}')
+    if caption is not None or label is not None:
+        lines.append('\\end{table}')
+    return '\n'.join(lines) + '\n'
 
 
 class Table:
     """Table structure. Converts pandas' dataframe to TeX table.
     Note:
         Requires booktabs package to import, added with autopackage management.
+        Common dataframes and styles are rendered by fast vectorized renderer,
+        others by to_latex method of DataFrame.
 
     Attributes:
         df (DataFrame): Dataframe containing table.
@@ -19,7 +157,7 @@ class Table:
 
     """
 
-    def __init__(self, dataframe: DataFrame, **styles: Any) -> None:
+    def __init__(self, dataframe: 'DataFrame', **styles: Any) -> None:
         """Initialize Table.
 
         Args:
@@ -31,23 +169,210 @@ class Table:
         add_package(Package('booktabs'))
 
     def __str__(self) -> str:
-        return self.df.to_latex(**self.styles)
+        text = render_table(self.df, **self.styles)
+        if text is None:
+            text = self.df.to_latex(**self.styles)
+        return text
+
+
+class StreamingTable:
+    """Long table streamed from CSV or Parquet file or from chunks of dataframe.
+
+    Source is read chunk by chunk and every chunk is rendered to rows of
+    longtable as soon as it is read, so memory is bounded by size of chunk.
+    Header is repeated on every page. Types of columns, which decide format
+    and alignment of cells, are given by dtypes or taken from the first chunk,
+    and every chunk is converted to them where no value is lost, e.g. column
+    of integers keeps integer format in chunks with missing values, while
+    chunk with fractions or text in it is formatted by its own types.
+
+    Note:
+        Requires longtable and booktabs packages to import, added with autopackage management.
+        Path to Parquet file requires pyarrow. Iterator of chunks can be rendered only once.
+
+    Attributes:
+        source (str | Iterable[DataFrame]): Path to CSV or Parquet file or iterable of dataframes.
+        chunksize (int): Number of rows read at once.
+        dtypes (Mapping[str, Any] | None): Types of columns, types of the first chunk if None.
+        styles: Parameters of table, same as for Table, only those in FAST_STYLES are supported.
+    """
+
+    def __init__(self, source: Union[str, Iterable['DataFrame']], chunksize: int = 10000,
+                 dtypes: Optional[Mapping[str, Any]] = None, **styles: Any) -> None:
+        """Initialize StreamingTable.
+
+        Args:
+            source (str | Iterable[DataFrame]): Path to CSV or Parquet file or iterable of dataframes.
+            chunksize (int, optional): Number of rows read at once. Defaults to 10000.
+            dtypes (Mapping[str, Any] | None, optional): Types of columns, e.g. float64 for column of integers with
+                missing values. Defaults to types of the first chunk.
+            **styles (Any): Parameters of table, only those in FAST_STYLES are supported.
+
+        Raises:
+            ValueError: When unsupported style is given.
+        """
+        if not styles.keys() <= FAST_STYLES:
+            raise ValueError(f"Unsupported styles of streaming table: {', '.join(styles.keys() - FAST_STYLES)}.")
+        self.source = source
+        self.chunksize = chunksize
+        self.dtypes = dtypes
+        self.styles = styles
+        add_package(Package('longtable'), Package('booktabs'))
+
+    def __str__(self) -> str:
+        return ''.join(self.iter_chunks())
+
+    def chunks(self) -> Iterator['DataFrame']:
+        """Reads source chunk by chunk.
+
+        Yields:
+            DataFrame: Chunk of table.
+        """
+        if not isinstance(self.source, str):
+            yield from self.source
+        elif self.source.endswith(('.parquet', '.pq')):
+            from pyarrow.parquet import ParquetFile
+
+            for batch in ParquetFile(self.source).iter_batches(batch_size=self.chunksize):
+                yield batch.to_pandas()
+        else:
+            import pandas as pd
+
+            with pd.read_csv(self.source, chunksize=self.chunksize, dtype=self.dtypes) as reader:
+                yield from reader
+
+    @staticmethod
+    def _conform(chunk: 'DataFrame', dtypes: Mapping[Any, Any]) -> 'DataFrame':
+        """Converts columns of chunk to given types where no value is lost.
+
+        Integer and boolean columns with missing values become nullable ones,
+        so their values keep their format. Columns which cannot be converted
+        without changing some value (e.g. fractions in an integer column or
+        strings in a numeric one) keep their own type.
+
+        Args:
+            chunk (DataFrame): Chunk of table.
+            dtypes (Mapping[Any, Any]): Types by names of columns.
+
+        Returns:
+            DataFrame: Converted chunk.
+        """
+        from pandas.api.types import is_bool_dtype, is_dtype_equal, is_integer_dtype
+
+        converted = None
+        for name, dtype in dtypes.items():
+            if name not in chunk.columns or is_dtype_equal(chunk[name].dtype, dtype):
+                continue
+            column = chunk[name]
+            if column.hasnans and is_integer_dtype(dtype):
+                dtype = 'Int64'
+            elif column.hasnans and is_bool_dtype(dtype):
+                dtype = 'boolean'
+            try:
+                result = column.astype(dtype)
+            except (TypeError, ValueError):
+                continue
+            missing = column.isna()
+            if not (result.isna() == missing).all():
+                continue
+            before = column[~missing].astype(object).to_numpy()
+            after = result[~missing].astype(object).to_numpy()
+            if not all(isinstance(a, str) == isinstance(b, str) and a == b for a, b in zip(before, after)):
+                continue
+            if converted is None:
+                converted = chunk.copy(deep=False)
+            converted[name] = result
+        return chunk if converted is None else converted
+
+    def _rows(self, chunk: 'DataFrame') -> str:
+        """Formats rows of one chunk.
+
+        Args:
+            chunk (DataFrame): Chunk of table, converted to types of table.
+
+        Returns:
+            str: Rows of chunk.
+        """
+        index = self.styles.get('index', True)
+        na_rep = self.styles.get('na_rep', 'NaN')
+        escape = bool(self.styles.get('escape', False))
+        columns = []
+        if index:
+            labels = chunk.index.astype(str).tolist()
+            columns.append([escape_latex(label) for label in labels] if escape else labels)
+        for name in chunk.columns:
+            column = chunk[name]
+            cells = _format_column(column, na_rep, self.styles.get('float_format'), escape)
+            if cells is None:
+                cells = [na_rep if missing else (escape_latex(str(value)) if escape else str(value))
+                         for value, missing in zip(column.tolist(), column.isna().tolist())]
+            columns.append(cells)
+        return ''.join(f"{row} \\\\\n" for row in map(' & '.join, zip(*columns)))
+
+    def iter_chunks(self) -> Iterator[str]:
+        """Iterate over rendered longtable, one chunk of source at a time.
+
+        Yields:
+            str: Successive pieces of table.
+        """
+        index = self.styles.get('index', True)
+        caption = self.styles.get('caption')
+        label = self.styles.get('label')
+        from pandas.api.types import is_numeric_dtype
+
+        dtypes: Optional[Mapping[Any, Any]] = None
+        started = False
+        for chunk in self.chunks():
+            if dtypes is None:
+                dtypes = {**chunk.dtypes.to_dict(), **(self.dtypes or {})}
+            chunk = self._conform(chunk, dtypes)
+            rows = self._rows(chunk)
+            if not started:
+                started = True
+                alignment = ['l'] * bool(index) + ['r' if is_numeric_dtype(chunk[name].dtype) else 'l'
+                                                   for name in chunk.columns]
+                header = ['\\toprule']
+                if self.styles.get('header', True):
+                    header.append(_header_line(chunk.columns, index, bool(self.styles.get('escape', False))))
+                header.append('\\midrule')
+                yield f"\\begin{{longtable}}{{{self.styles.get('column_format') or ''.join(alignment)}}}\n"
+                title = []
+                if caption is not None:
+                    title.append(f"\\caption{{{caption}}}")
+                if label is not None:
+                    title.append(f"\\label{{{label}}}")
+                if title:
+                    yield ' '.join(title) + ' \\\\\n'
+                yield '\n'.join(header) + '\n\\endfirsthead\n'
+                if caption is not None:
+                    yield f"\\caption[]{{{caption}}} \\\\\n"
+                yield '\n'.join(header) + '\n\\endhead\n'
+                yield f"\\midrule\n\\multicolumn{{{len(alignment)}}}{{r}}{{Continued on next page}} \\\\\n\\midrule\n\\endfoot\n"
+                yield '\\bottomrule\n\\endlastfoot\n'
+            yield rows
+        if started:
+            yield '\\end{longtable}\n'
 
 
 class List(Environment):
-    """List structure. Convert python lists to TeX lists."""
+    """List structure. Convert python lists to TeX lists.
+
+    Attributes:
+        escape (bool): Escape LaTeX special characters in items and labels.
+    """
 
-    def __init__(self, arr: Union[Sequence, dict], en_type: str = 'itemize') -> None:
+    def __init__(self, arr: Union[Sequence, dict], en_type: str = 'itemize', escape: bool = False) -> None:
         """Initialize List.
 
         Args:
             arr (Sequence | Dict): Sequence which is iterated. Only dictionary is compactible with 'descrition'.
             en_type (str, optional): Type of list. Defaults to 'itemize'.
+            escape (bool, optional): Escape LaTeX special characters in items and labels, except Raw ones. Defaults to False.
         """
-        self.en_type = en_type
-        if self.en_type == 'description' and not isinstance(arr, dict):
+        if en_type == 'description' and not isinstance(arr, dict):
             WrongTypeListError()
-        self.write(command('begin', self.en_type))
+        super().__init__(en_type)
+        self.escape = escape
         self.items(arr)
 
     def item(self, content: str, label: Optional[str] = None):
@@ -57,14 +382,21 @@ class List(Environment):
             content (str): Main text.
             label (str): Label of item.
         """
+        if self.escape:
+            content = escape_latex(content)
         if label is None:
             self.write(f'\\item {content}')
         else:
+            if self.escape:
+                label = escape_latex(label)
             self.write(f'\\item[{label}] {content}')
 
     def items(self, arr: Union[Sequence, dict]) -> None:
         """Includes given Sequence of dictionary in content.
 
+        Items are added by item. When it is not overridden, they are
+        formatted all at once instead.
+
         Args:
             arr (Sequence | Dict): Sequence which is iterated. Only dictionary is compactible with 'descrition'.
             en_type (str): Type of list
@@ -72,9 +404,21 @@ class List(Environment):
         if self.en_type == 'description' and not isinstance(arr, dict):
             WrongTypeListError()
 
-        if isinstance(arr, dict):
-            for key, value in arr.items():
-                self.item(str(value), str(key))
+        self._ensure_buffer()
+        if type(self).item is not List.item:
+            # Items and labels are given to item as text, so it can work with them as strings.
+            if isinstance(arr, dict):
+                for key, value in arr.items():
+                    self.item(_as_text(value), _as_text(key))
+            else:
+                for item in arr:
+                    self.item(_as_text(item))
+        elif isinstance(arr, dict):
+            keys, values = list(arr.keys()), list(arr.values())
+            if self.escape:
+                keys, values = escape_all(keys), escape_all(values)
+            self._chunks.extend(f'\\item[{key}] {value}\n' for key, value in zip(keys, values))
         else:
-            for item in arr:
-                self.item(str(item))
+            items = escape_all(arr) if self.escape else arr
+            self._chunks.extend(f'\\item {item}\n' for item in items)
+        self._touch()
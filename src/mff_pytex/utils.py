@@ -1,9 +1,25 @@
 """Basic utils for work with LaTeX documents."""
 
 
-from typing import Optional, Any
+from typing import Optional, Any, Iterator, TextIO
+from contextlib import contextmanager
+import filecmp
+import hashlib
+import itertools
+import os
+import secrets
 import sys
+from datetime import date as datum
 from os import path
+from mff_pytex.escaping import escape as escape_latex
+
+
+BUFFER_SIZE = 1 << 16
+"""Size of write buffer used for generated files."""
+
+_revisions = itertools.count(1)
+
+_IMMUTABLE = (str, bytes, int, float, complex, type(None), frozenset, datum)
 
 
 class File:
@@ -24,6 +40,98 @@ class File:
         self.file_path = f"{get_dir()}/{file_name}.{self.file_type}"
 
 
+def _create_temporary(file_path: str) -> tuple[int, str]:
+    """Creates hidden temporary file next to given file.
+
+    Unlike tempfile.mkstemp, which creates files readable only by owner, the
+    file gets the usual permissions of new files given by umask.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        tuple[int, str]: Descriptor of opened file and its path.
+    """
+    directory, name = path.split(file_path)
+    while True:
+        tmp_path = path.join(directory, f".{name}.{secrets.token_hex(4)}.tmp")
+        try:
+            return os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666), tmp_path
+        except FileExistsError:
+            continue
+
+
+@contextmanager
+def open_output(file_path: str, mode: str = 'w+', keep_unchanged: bool = False) -> Iterator[TextIO]:
+    """Opens generated file for buffered writing.
+
+    If the file is overwritten, content goes to a temporary file in the same
+    directory, which atomically replaces the target when writing succeeds,
+    so readers never see a half-written file.
+
+    Args:
+        file_path (str): Path to the file.
+        mode (str, optional): Mode of given file. Same as open() function. Defaults to 'w+'
+        keep_unchanged (bool, optional): Keep the old file and its timestamp if new content is the same. Defaults to False.
+
+    Yields:
+        TextIO: Opened file.
+    """
+    if not mode.startswith('w'):
+        with open(file_path, mode, buffering=BUFFER_SIZE) as fp:
+            yield fp
+        return
+    fd, tmp_path = _create_temporary(file_path)
+    try:
+        with os.fdopen(fd, mode, buffering=BUFFER_SIZE) as fp:
+            yield fp
+        if keep_unchanged and path.isfile(file_path) and filecmp.cmp(tmp_path, file_path, shallow=False):
+            os.unlink(tmp_path)
+            return
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def file_hash(file_path: str) -> Optional[str]:
+    """Returns hash of file content.
+
+    Args:
+        file_path (str): Path to file.
+
+    Returns:
+        str | None: Hex digest of content, None if file does not exist.
+    """
+    if not path.isfile(file_path):
+        return None
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as fp:
+        for block in iter(lambda: fp.read(BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_cache_dir(*parts: str) -> str:
+    """Returns directory for cached files, creating it if needed.
+
+    Location is given by MFF_PYTEX_CACHE environment variable, defaults to
+    mff_pytex directory in XDG cache directory.
+
+    Args:
+        *parts (str): Subdirectories of cache directory.
+
+    Returns:
+        str: Path to directory.
+    """
+    root = os.environ.get('MFF_PYTEX_CACHE')
+    if root is None:
+        root = path.join(os.environ.get('XDG_CACHE_HOME', path.expanduser('~/.cache')), 'mff_pytex')
+    directory = path.join(root, *parts)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
 def get_func_name() -> str:
     """Utility that returns name of function.
 
@@ -36,10 +144,15 @@ def get_func_name() -> str:
 def get_dir() -> str:
     """Returns directory where main file has been executed.
 
+    Without main file, e.g. in interactive session, it is current working directory.
+
     Returns:
         str: Directory name where is main file
     """
-    return str(path.dirname(str(sys.modules['__main__'].__file__)))
+    main_file = getattr(sys.modules['__main__'], '__file__', None)
+    if main_file is None:
+        return os.getcwd()
+    return str(path.dirname(str(main_file)))
 
 
 def get_path() -> str:
@@ -96,11 +209,130 @@ def doublecommand(comm: str, main: str, second: Optional[str] = None, opt: bool
         return f"\\{comm}{{{main}}} {{{second}}}"
 
 
+def _is_immutable(value: Any) -> bool:
+    """Checks if value can not change in place, so it can not make cached rendering stale."""
+    if isinstance(value, tuple):
+        return all(_is_immutable(item) for item in value)
+    return isinstance(value, _IMMUTABLE)
+
+
 class Writing:
-    _text = ""
+    """Buffered TeX content.
+
+    Content is kept as a tree: lines of text are collected as string chunks and
+    added environments are stored as references to their nodes. The tree is
+    rendered only when the content is output, so nested structures are never
+    copied into their parents.
+
+    Rendered text of a node is cached by str() and reused until the node or any
+    of its descendants changes, so a mutated subtree is re-rendered without
+    touching the others. Changes are noticed when content is written or added
+    and when public attribute is assigned. Nodes whose public attributes hold
+    mutable values, e.g. lists or dataframes, which could change in place,
+    and nodes with children which are not Writing are never cached.
+    """
+    _version: int = 0
+    _rendered: Optional[tuple[int, str]] = None
+    _chunks: Optional[list[Any]] = None
+    _nodes: Optional[list[Any]] = None
+
+    def __init__(self) -> None:
+        """Initialize Writing with an empty buffer."""
+        self._ensure_buffer()
+
+    def _ensure_buffer(self) -> None:
+        """Creates empty buffer, unless the node has one already.
+
+        Subclasses which do not call Writing.__init__ get their buffer on the first write.
+        """
+        if self._chunks is None:
+            self._chunks = []
+        if self._nodes is None:
+            self._nodes = []
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if not name.startswith('_'):
+            self._touch()
 
     def __str__(self) -> str:
-        return self._text
+        revision = self._revision()
+        if revision is not None and self._rendered is not None and self._rendered[0] == revision:
+            return self._rendered[1]
+        text = ''.join(part if isinstance(part, str) else str(part) for part in self._parts())
+        if revision is not None:
+            self._rendered = (revision, text)
+        return text
+
+    def _touch(self) -> None:
+        """Marks content as changed."""
+        self._version = next(_revisions)
+
+    def _revision(self) -> Optional[int]:
+        """Returns revision of the whole subtree.
+
+        Returns:
+            int | None: Latest revision of node and its descendants, None if it can not be tracked.
+        """
+        revision = self._version
+        for name, value in vars(self).items():
+            if not name.startswith('_') and not _is_immutable(value):
+                return None
+        for node in self._nodes or ():
+            if not isinstance(node, Writing):
+                return None
+            child = node._revision()
+            if child is None:
+                return None
+            revision = max(revision, child)
+        return revision
+
+    def _parts(self) -> Iterator[Any]:
+        """Iterate over content, children are yielded as nodes.
+
+        Yields:
+            str | Any: Chunk of text or child node.
+        """
+        yield from self._chunks or ()
+
+    def iter_chunks(self) -> Iterator[str]:
+        """Iterate over rendered content without joining it.
+
+        Yields:
+            str: Successive pieces of content.
+        """
+        if self._rendered is not None and self._rendered[0] == self._revision():
+            yield self._rendered[1]
+            return
+        for part in self._parts():
+            if isinstance(part, str):
+                yield part
+            elif hasattr(part, 'iter_chunks'):
+                yield from part.iter_chunks()
+            else:
+                yield str(part)
+
+    def walk(self) -> Iterator[Any]:
+        """Iterate over this node and all its descendants, parents first.
+
+        Yields:
+            Writing | Any: Successive nodes.
+        """
+        yield self
+        for node in self._nodes or ():
+            if isinstance(node, Writing):
+                yield from node.walk()
+            else:
+                yield node
+
+    def write_to(self, fp: TextIO) -> None:
+        """Write rendered content to an open text file.
+
+        Args:
+            fp (TextIO): File object to write to.
+        """
+        for chunk in self.iter_chunks():
+            fp.write(chunk)
 
     def _writeline(self, text: str) -> None:
         """Write single line to the TeX file.
@@ -108,25 +340,39 @@ class Writing:
         Args:
             text (str): Line of text intended for insert to content.
         """
-        self._text += f"{text}\n"
+        self._ensure_buffer()
+        self._chunks.append(f"{text}\n")
+        self._touch()
 
-    def write(self, *lines: Optional[str]) -> None:
+    def write(self, *lines: Optional[str], escape: bool = False) -> None:
         """Write multiple lines to the TeX file.
 
         Args:
             *lines (str): Lines of text intended for insert to content.
+            escape (bool, optional): Escape LaTeX special characters in lines, except Raw ones. Defaults to False.
         """
         for line in lines:
             if line is not None:
-                self._writeline(line)
+                self._writeline(escape_latex(line) if escape else line)
 
     def add(self, environment: Any) -> None:
-        """Writes environment to the TeX file.
+        """Adds environment to the TeX file.
+
+        Environment is stored as a reference and rendered together with the rest of the content.
 
         Args:
             environment (Any): Figure to use.
+
+        Raises:
+            ValueError: When environment contains this node, which would make content infinite.
         """
-        self.write(str(environment))
+        if isinstance(environment, Writing) and any(node is self for node in environment.walk()):
+            raise ValueError('Environment can not be added to itself or to its descendant.')
+        self._ensure_buffer()
+        self._chunks.append(environment)
+        self._chunks.append('\n')
+        self._nodes.append(environment)
+        self._touch()
 
     def math(self, formula: str) -> None:
         """Add math formula to the TeX file.
@@ -142,7 +388,7 @@ class Environment(Writing):
 
     Attributes:
         en_type (str): Type of environment
-        _text (str): Content of environment,
+        _chunks (list[str | Any]): Content of environment,
     """
 
     def __init__(self, en_type: str, *params: str) -> None:
@@ -152,16 +398,26 @@ class Environment(Writing):
             en_type (str): Type of environment
             *params (str): Optional parameters for environment
         """
+        super().__init__()
         self.en_type = en_type
         if params:
             self.write(command('begin', self.en_type, *params))
         else:
             self.write(command('begin', self.en_type))
 
-    def __str__(self) -> str:
-        """Returns content string encapsuled by environment.
+    def _parts(self) -> Iterator[Any]:
+        """Iterate over content encapsuled by environment.
 
-        Returns:
-            str: Content
+        Yields:
+            str | Any: Chunk of text or child node.
+        """
+        yield from super()._parts()
+        yield from self._closing()
+
+    def _closing(self) -> Iterator[str]:
+        """Iterate over lines closing the environment.
+
+        Yields:
+            str: Closing lines.
         """
-        return self._text + command('end', self.en_type) + '\n'
+        yield command('end', self.en_type) + '\n'
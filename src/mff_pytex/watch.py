@@ -0,0 +1,221 @@
+"""Watching generator scripts and running them again when their inputs change."""
+
+from typing import Any, Callable, Optional
+import os
+import runpy
+import sys
+import threading
+import time
+from os import path
+from mff_pytex.assets import resolve_image
+from mff_pytex.images import Picture
+from mff_pytex.structure import TexFile
+from mff_pytex.utils import get_cache_dir
+
+
+DEBOUNCE = 0.3
+"""Seconds without change of inputs after which script is run again."""
+
+BUILD_PRODUCTS = frozenset({'.aux', '.log', '.pdf', '.bbl', '.blg', '.toc', '.lof', '.lot', '.out', '.fls', '.fmt',
+                            '.idx', '.ind', '.nav', '.snm', '.tmp'})
+"""Extensions of files written by builds, which are not treated as inputs."""
+
+BUILD_STATE_SUFFIX = '.mff_pytex.json'
+"""Suffix of files with state of incremental builds, which are not treated as inputs."""
+
+_WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_TRUNC
+
+_recording: Optional[tuple[set[str], set[str]]] = None
+
+
+def _audit(event: str, args: tuple) -> None:
+    """Records files read and written while a watched script runs."""
+    if _recording is None:
+        return
+    read, written = _recording
+    if event == 'open':
+        file_path, mode, flags = args
+        if isinstance(file_path, int):
+            return
+        file_path = path.abspath(os.fsdecode(file_path))
+        if (flags & _WRITE_FLAGS) if mode is None else any(char in mode for char in 'wax+'):
+            written.add(file_path)
+        else:
+            read.add(file_path)
+    elif event in ('os.rename', 'os.replace'):
+        written.add(path.abspath(os.fsdecode(args[1])))
+
+
+_audit_lock = threading.Lock()
+_audit_installed = False
+
+
+class ScriptRun:
+    """Single run of generator script and files it depends on.
+
+    Attributes:
+        script (str): Absolute path to script.
+        inputs (set[str]): Files read and not written by the script, its local modules and images of its documents.
+            TeX files of documents of the script and of their chapters are not inputs, even when they were only read
+            because their content did not change.
+        error (BaseException | None): Exception raised by the script, None if it succeeded.
+        duration (float): Duration of run in seconds.
+    """
+
+    def __init__(self, script: str) -> None:
+        """Initialize ScriptRun
+
+        Args:
+            script (str): Path to script.
+        """
+        self.script = path.abspath(script)
+        self.inputs: set[str] = {self.script}
+        self.error: Optional[BaseException] = None
+        self.duration = 0.0
+
+    def run(self) -> 'ScriptRun':
+        """Executes script as __main__ and records its inputs.
+
+        Modules imported from directory of the script are forgotten afterwards,
+        so the next run imports their current version.
+
+        Returns:
+            ScriptRun: This run.
+        """
+        global _recording, _audit_installed
+        with _audit_lock:
+            if not _audit_installed:
+                sys.addaudithook(_audit)
+                _audit_installed = True
+        directory = path.dirname(self.script)
+        modules = set(sys.modules)
+        read: set[str] = set()
+        written: set[str] = set()
+        argv, sys.argv = sys.argv, [self.script]
+        sys.path.insert(0, directory)
+        start = time.perf_counter()
+        _recording = (read, written)
+        try:
+            namespace = runpy.run_path(self.script, run_name='__main__')
+        except BaseException as error:
+            if isinstance(error, KeyboardInterrupt):
+                raise
+            self.error = error
+            namespace = {}
+        finally:
+            _recording = None
+            self.duration = time.perf_counter() - start
+            sys.argv = argv
+            sys.path.remove(directory)
+        for name in set(sys.modules) - modules:
+            file_path = getattr(sys.modules[name], '__file__', None)
+            if file_path is None:
+                continue
+            file_path = path.abspath(file_path)
+            if _is_local(file_path, directory) and is_input(file_path):
+                self.inputs.add(file_path)
+                del sys.modules[name]
+        generated = set(written)
+        for texfile in namespace.values():
+            if isinstance(texfile, TexFile):
+                generated.add(path.abspath(texfile.file_path))
+                generated.update(path.abspath(texfile.chapter_path(chapter)) for chapter in texfile.document.chapters)
+                tex_directory = path.dirname(texfile.file_path)
+                for picture in texfile.document.walk():
+                    if isinstance(picture, Picture):
+                        self.inputs.add(path.abspath(resolve_image(path.join(tex_directory, picture.picture_path))))
+        self.inputs.update(file_path for file_path in read - generated if is_input(file_path))
+        return self
+
+
+def _is_local(file_path: str, directory: str) -> bool:
+    """Checks if file lies in directory or its subdirectories."""
+    return path.commonpath([file_path, directory]) == directory
+
+
+def _modified_since(file_path: str, timestamp: float) -> bool:
+    """Checks if file was modified after timestamp or removed."""
+    try:
+        return os.stat(file_path).st_mtime > timestamp
+    except OSError:
+        return True
+
+
+def is_input(file_path: str) -> bool:
+    """Checks if file read by script should be watched.
+
+    Files of Python installation, cached files, build products and states of builds are not watched.
+
+    Args:
+        file_path (str): Absolute path to file.
+
+    Returns:
+        bool: True if change of file should run script again.
+    """
+    if (path.splitext(file_path)[1].lower() in BUILD_PRODUCTS or file_path.endswith(BUILD_STATE_SUFFIX)
+            or not path.isfile(file_path)):
+        return False
+    ignored = {sys.prefix, sys.base_prefix, sys.exec_prefix, get_cache_dir()}
+    return not any(_is_local(file_path, directory) for directory in ignored)
+
+
+def watch(script: str, debounce: float = DEBOUNCE, on_run: Optional[Callable[[ScriptRun], None]] = None,
+          stop: Optional[threading.Event] = None) -> None:
+    """Runs script and runs it again whenever its inputs change.
+
+    Changes are debounced, script runs after its inputs do not change for
+    debounce seconds. Documents of the script keep their TeX files when
+    content is the same, and make_pdf runs only passes which are needed.
+    Requires watchdog.
+
+    Args:
+        script (str): Path to script.
+        debounce (float, optional): Seconds to wait for further changes. Defaults to DEBOUNCE.
+        on_run (Callable[[ScriptRun], None] | None, optional): Called after every run. Defaults to None.
+        stop (threading.Event | None, optional): Watching ends when it is set. Defaults to None.
+
+    Raises:
+        ImportError: When watchdog is not installed.
+    """
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+
+    changed = threading.Event()
+    stop = stop or threading.Event()
+    inputs: set[str] = set()
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            paths = {event.src_path, getattr(event, 'dest_path', '')}
+            if not event.is_directory and any(path.abspath(str(name)) in inputs for name in paths if name):
+                changed.set()
+
+    observer = Observer()
+    observer.start()
+    watched: dict[str, Any] = {}
+    try:
+        while not stop.is_set():
+            changed.clear()
+            started = time.time()
+            current = ScriptRun(script).run()
+            inputs.clear()
+            inputs.update(current.inputs)
+            directories = {path.dirname(file_path) for file_path in inputs}
+            for directory in directories - set(watched):
+                if path.isdir(directory):
+                    watched[directory] = observer.schedule(Handler(), directory, recursive=False)
+            for directory in set(watched) - directories:
+                observer.unschedule(watched.pop(directory))
+            if any(_modified_since(file_path, started) for file_path in inputs):
+                changed.set()  # changed while script was running, before it was watched
+            if on_run is not None:
+                on_run(current)
+            while not stop.is_set():
+                if changed.wait(0.1):
+                    # debounce: wait until files stop changing
+                    while changed.wait(debounce):
+                        changed.clear()
+                    break
+    finally:
+        observer.stop()
+        observer.join()
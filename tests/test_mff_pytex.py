@@ -2,8 +2,37 @@
 
 """Tests for `mff_pytex` package."""
 
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
 import pytest
-from src.mff_pytex.utils import command
+from concurrent.futures import ThreadPoolExecutor
+from mff_pytex.utils import command, open_output, Writing, Environment
+from mff_pytex.structure import DocumentClass, TexFile
+from mff_pytex.images import Picture
+from mff_pytex.tables import List, StreamingTable, Table, render_table
+from mff_pytex.escaping import Raw, escape, escape_all, escape_series
+from click.testing import CliRunner
+from mff_pytex.build import Build, Engine, build_all, build_all_async, get_engine
+from mff_pytex.events import add_hook, remove_hook
+from mff_pytex.logs import parse_blg, parse_log
+from mff_pytex.interface.interface import cli, parse_size
+from mff_pytex.cache import PdfCache
+from mff_pytex.fragments import FragmentCache, memoize
+from mff_pytex.assets import AssetSettings, prepare_assets
+from mff_pytex.exceptions import (DuplicateBibError, MissingAssetError, PackageOrderError, RenderServerError,
+                                  UnknownEngineError)
+from mff_pytex.bib import Article, Bibliography, Book, InProceedings, Misc, load_bib, parse_bib
+from mff_pytex.packages import Package, PackageRegistry, add_package, default_registry, get_registry
+from mff_pytex.merge import Placeholder, merge
+from mff_pytex.server import submit
+from mff_pytex.watch import ScriptRun, is_input, watch
 
 
 # def test_document():
@@ -25,3 +54,839 @@ def test_command_begin_document():
 def test_command_usepackage():
     """Test if command usepackage properly"""
     assert command('usepackage', 'inputenc', 'utf8') == "\\usepackage[utf8]{inputenc}"
+
+
+def test_writing_lines():
+    """Test if written lines are rendered in order"""
+    text = Writing()
+    text.write('first', None, 'second')
+    assert str(text) == "first\nsecond\n"
+
+
+def test_writing_write_to():
+    """Test if write_to emits the same content as str"""
+    env = Environment('center')
+    env.write('text')
+    fp = io.StringIO()
+    env.write_to(fp)
+    assert fp.getvalue() == str(env) == "\\begin{center}\ntext\n\\end{center}\n"
+
+
+def test_environment_without_init():
+    """Test if subclass which does not call super().__init__ can write content"""
+    class Quote(Environment):
+        def __init__(self, text):
+            self.en_type = 'quote'
+            self.write(text)
+
+    quote = Quote('text')
+    assert str(quote) == "text\n\\end{quote}\n"
+    quote.add(Writing())
+    assert list(quote.walk())[0] is quote and len(list(quote.walk())) == 2
+
+
+def test_texfile_create(tmp_path):
+    """Test if TexFile is streamed to disk without leftover temporary files"""
+    tex = TexFile('doc')
+    tex.file_path = str(tmp_path / 'doc.tex')
+    tex.document.write('streamed')
+    tex.create()
+    assert (tmp_path / 'doc.tex').read_text() == str(tex.preamble) + str(tex.document)
+    assert [p.name for p in tmp_path.iterdir()] == ['doc.tex']
+
+
+def test_open_output_permissions(tmp_path):
+    """Test if written file gets permissions given by umask, without changing it"""
+    umask = os.umask(0o027)
+    try:
+        with open_output(str(tmp_path / 'out.tex')) as fp:
+            fp.write('text')
+        assert os.umask(0o027) == 0o027
+    finally:
+        os.umask(umask)
+    assert (tmp_path / 'out.tex').stat().st_mode & 0o777 == 0o640
+
+
+def test_pdf_cache_permissions(tmp_path):
+    """Test if cached and restored pdf get permissions given by umask"""
+    (tmp_path / 'doc.pdf').write_bytes(b'%PDF')
+    cache = PdfCache(str(tmp_path / 'cache'))
+    umask = os.umask(0o027)
+    try:
+        cache.put('key', str(tmp_path / 'doc.pdf'))
+        assert cache.get('key', str(tmp_path / 'out.pdf'))
+    finally:
+        os.umask(umask)
+    assert os.stat(cache.path('key')).st_mode & 0o777 == 0o640
+    assert (tmp_path / 'out.pdf').stat().st_mode & 0o777 == 0o640
+
+
+def test_picture_render_is_idempotent():
+    """Test if rendering picture twice gives the same content"""
+    image = Picture('tex.png', caption='Caption')
+    assert str(image) == str(image)
+    assert str(image).count('includegraphics') == 1
+
+
+def test_add_renders_mutated_child():
+    """Test if change of added environment shows up in its parent"""
+    parent = Environment('center')
+    child = Environment('itemize')
+    parent.add(child)
+    before = str(parent)
+    child.write('\\item new')
+    assert str(parent) == before.replace('\\end{itemize}', '\\item new\n\\end{itemize}')
+
+
+def test_render_cache_invalidation():
+    """Test if nodes with mutable attributes are not cached and cycles are rejected"""
+    image = Picture('tex.png', settings=['width=1cm'])
+    str(image)
+    image.settings.append('angle=90')
+    assert 'angle=90' in str(image)
+    parent = Environment('center')
+    child = Environment('itemize')
+    parent.add(child)
+    assert str(parent) is str(parent)
+    with pytest.raises(ValueError):
+        child.add(parent)
+    with pytest.raises(ValueError):
+        child.add(child)
+
+
+def fake_engine(build, draft=False):
+    """Simulate pdflatex writing constant aux and pdf files"""
+    build.drafts.append(draft)
+    for extension in ('aux', 'log') if draft else ('aux', 'pdf', 'log'):
+        with open(build.job_file(extension), 'w') as fp:
+            fp.write(extension)
+
+
+def test_build_skips_up_to_date(tmp_path, monkeypatch):
+    """Test if build runs only passes which are needed"""
+    monkeypatch.setattr(Build, 'run_engine', fake_engine)
+    monkeypatch.setattr(Build, 'drafts', [], raising=False)
+    tex = tmp_path / 'doc.tex'
+    tex.write_text('first')
+    assert Build(str(tex)).run() == 3
+    assert Build.drafts == [True, True, False]
+    assert Build(str(tex)).run() == 0
+    tex.write_text('second')
+    assert Build(str(tex)).run() == 1
+    assert Build.drafts[-1] is False
+
+
+def test_build_max_passes(tmp_path, monkeypatch):
+    """Test if the final pass counts against max_passes of document which always requests rerun"""
+    def rerunning_engine(build, draft=False):
+        fake_engine(build, draft)
+        with open(build.job_file('log'), 'w') as fp:
+            fp.write('LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.\n')
+
+    monkeypatch.setattr(Build, 'run_engine', rerunning_engine)
+    monkeypatch.setattr(Build, 'drafts', [], raising=False)
+    tex = tmp_path / 'doc.tex'
+    tex.write_text('text')
+    assert Build(str(tex), max_passes=4).run() == 4
+    assert Build.drafts == [True, True, True, False]
+    tex.write_text('other')
+    assert Build(str(tex), max_passes=1).run() == 1
+    assert Build.drafts[-1] is False
+
+
+def test_engine_args():
+    """Test if engines use their own draft mode arguments"""
+    assert get_engine('xelatex').args('doc.tex', draft=True)[-2:] == ['-no-pdf', 'doc.tex']
+    assert '-draftmode' not in get_engine('pdflatex').args('doc.tex')
+    with pytest.raises(UnknownEngineError):
+        get_engine('latex2e')
+
+
+def test_preamble_key(tmp_path):
+    """Test if format key depends only on preamble and engine"""
+    tex = tmp_path / 'doc.tex'
+    tex.write_text('\\documentclass{article}\n\\begin{document}\nfirst\n\\end{document}\n')
+    key = Build(str(tex)).preamble_key()
+    tex.write_text('\\documentclass{article}\n\\begin{document}\nsecond\n\\end{document}\n')
+    assert Build(str(tex)).preamble_key() == key
+    assert Build(str(tex), 'xelatex').preamble_key() != key
+    tex.write_text('\\documentclass{article}\n\\usepackage{tikz}\n\\begin{document}\n\\end{document}\n')
+    assert Build(str(tex)).preamble_key() != key
+
+
+def test_build_all(tmp_path, monkeypatch):
+    """Test if batch build reports every document in its own directory"""
+    monkeypatch.setattr(Build, 'run_engine', fake_engine)
+    monkeypatch.setattr(Build, 'drafts', [], raising=False)
+    tex = tmp_path / 'doc.tex'
+    tex.write_text('text')
+    ok, failed = build_all([str(tex), str(tmp_path / 'missing.tex')], jobs=1, output_dir=str(tmp_path / 'out'))
+    assert ok.ok and os.path.dirname(os.path.dirname(ok.pdf_path)) == str(tmp_path / 'out')
+    assert os.path.basename(ok.pdf_path) == 'doc.pdf' and os.path.basename(os.path.dirname(ok.pdf_path)).startswith('doc-')
+    assert not failed.ok and failed.name == 'missing'
+
+
+def test_build_all_same_names(tmp_path, monkeypatch):
+    """Test if documents of the same name from different directories are built apart"""
+    monkeypatch.setattr(Build, 'run_engine', fake_engine)
+    monkeypatch.setattr(Build, 'drafts', [], raising=False)
+    sources = []
+    for directory in ('a', 'b'):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / 'doc.tex').write_text(directory)
+        sources.append(str(tmp_path / directory / 'doc.tex'))
+    first, second = build_all(sources, jobs=1, output_dir=str(tmp_path / 'out'))
+    assert first.ok and second.ok and first.pdf_path != second.pdf_path
+    assert os.path.isfile(first.pdf_path) and os.path.isfile(second.pdf_path)
+
+
+def test_cli_build(tmp_path, monkeypatch):
+    """Test if build command compiles given files"""
+    monkeypatch.setattr(Build, 'run_engine', fake_engine)
+    monkeypatch.setattr(Build, 'drafts', [], raising=False)
+    tex = tmp_path / 'doc.tex'
+    tex.write_text('text')
+    result = CliRunner().invoke(cli, ['build', '-j', '1', str(tex)])
+    assert result.exit_code == 0
+    assert result.output.startswith('doc: ok, 3 passes')
+
+
+def test_texfile_state_is_isolated():
+    """Test if documents built in different threads do not share state"""
+    def render(name, package):
+        with TexFile(name) as tex:
+            add_package(Package(package))
+            tex.document.write(name)
+            return str(tex.preamble) + str(tex.document)
+
+    with ThreadPoolExecutor(2) as executor:
+        first, second = executor.map(render, ['first', 'second'], ['tikz', 'lipsum'])
+    assert 'tikz' in first and 'lipsum' not in first and 'second' not in first
+    assert 'lipsum' in second and 'tikz' not in second and 'first' not in second
+
+
+def test_texfile_context_manager():
+    """Test if TexFile activates its packages only inside with block"""
+    outer = get_registry()
+    with TexFile('doc') as tex:
+        add_package(Package('tikz'))
+    assert get_registry() is outer
+    assert 'tikz' in tex.packages and 'tikz' not in default_registry
+    other = TexFile('other')
+    with tex:
+        assert get_registry() is tex.packages
+    assert get_registry() is outer and 'tikz' not in other.packages
+
+
+def test_texfile_inherits_default_registry(monkeypatch):
+    """Test if packages added outside of with block are used by every TeX file"""
+    registry = PackageRegistry()
+    monkeypatch.setattr('mff_pytex.structure.default_registry', registry)
+    monkeypatch.setattr('mff_pytex.packages.default_registry', registry)
+    add_package(Package('lipsum'))
+    tex = TexFile('doc')
+    with tex:
+        add_package(Package('tikz'))
+    Table(pd.DataFrame({'a': [1]}))
+    assert [package.name for package in tex.packages] == ['lipsum', 'booktabs', 'tikz']
+    assert [package.name for package in TexFile('other').packages] == ['lipsum', 'booktabs']
+
+
+def test_registry_merges_options():
+    """Test if options of package added twice are merged"""
+    registry = PackageRegistry()
+    registry.add(Package('babel', 'czech'), Package('babel', 'english', 'czech'), Package('babel'))
+    assert [str(package) for package in registry] == ['\\usepackage[czech, english]{babel}']
+
+
+def test_registry_order():
+    """Test if hyperref is loaded last and declared order is respected"""
+    registry = PackageRegistry()
+    registry.add(Package('hyperref'), Package('tikz'), Package('cleveref'), Package('xcolor'))
+    registry.order('xcolor', 'tikz')
+    assert [package.name for package in registry] == ['xcolor', 'tikz', 'hyperref', 'cleveref']
+    registry.order('tikz', 'xcolor')
+    with pytest.raises(PackageOrderError):
+        registry.packages
+
+
+def test_import_is_lazy():
+    """Test if importing mff_pytex neither imports pandas nor takes long"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import mff_pytex'],
+                             env=env, capture_output=True, text=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    assert 'pandas' not in times
+    assert times['mff_pytex'] < 200_000
+
+
+@pytest.mark.parametrize('styles', [{}, {'index': False, 'na_rep': '--', 'float_format': '%.2f'},
+                                    {'header': False, 'escape': True}, {'caption': 'Caption', 'label': 'tab:x'}])
+def test_render_table_matches_to_latex(styles):
+    """Test if fast table renderer gives the same output as to_latex"""
+    df = pd.DataFrame({'int': [1, 2, 3], 'float': [1.5, np.nan, 3.25], 'text': ['x_y', 'a&b', None],
+                       'bool': [True, False, True]})
+    assert render_table(df, **styles) == df.to_latex(**styles)
+
+
+def test_render_table_fallback():
+    """Test if unsupported tables are left to to_latex"""
+    df = pd.DataFrame({'a': [1, 2]}, index=pd.MultiIndex.from_tuples([('x', 1), ('x', 2)]))
+    assert render_table(df) is None
+    assert render_table(df.reset_index(drop=True), position='h') is None
+    assert str(Table(df)) == df.to_latex()
+
+
+def test_streaming_table(tmp_path):
+    """Test if table streamed from CSV in chunks matches to_latex longtable"""
+    df = pd.DataFrame({'a': range(5), 'b': list('vwxyz')})
+    df.to_csv(tmp_path / 'data.csv', index=False)
+    table = StreamingTable(str(tmp_path / 'data.csv'), chunksize=2, caption='Data')
+    assert str(table) == df.to_latex(longtable=True, caption='Data')
+    env = Environment('center')
+    env.add(table)
+    assert sum(1 for chunk in env.iter_chunks() if chunk.endswith('\\\\\n')) >= 3
+
+
+def test_streaming_table_fixed_types():
+    """Test if chunks with missing values are formatted by types of the whole table"""
+    first = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+    second = pd.DataFrame({'a': [None, 4.0], 'b': ['z', None]}, index=[2, 3])
+    df = pd.concat([first, second])
+    streamed = str(StreamingTable(iter([first, second]), dtypes={'a': 'float64'}))
+    assert streamed == df.to_latex(longtable=True)
+    rows = [line for line in str(Table(df)).splitlines() if line[:1].isdigit()]
+    assert len(rows) == 4 and all(row in streamed.splitlines() for row in rows)
+    rows = str(StreamingTable(iter([first, second]))).splitlines()
+    assert rows[0] == '\\begin{longtable}{lrl}'
+    assert '2 & NaN & z \\\\' in rows and '3 & 4 & NaN \\\\' in rows
+
+
+def test_streaming_table_keeps_values(tmp_path):
+    """Test if chunks which cannot be converted to types of the first one keep their values"""
+    (tmp_path / 'data.csv').write_text('a\n1\n2\n1.5\n2.5\n')
+    rows = str(StreamingTable(str(tmp_path / 'data.csv'), chunksize=2)).splitlines()
+    assert '2 & 1.500000 \\\\' in rows and '3 & 2.500000 \\\\' in rows
+    first = pd.DataFrame({'a': [1, 2]})
+    rows = str(StreamingTable(iter([first, pd.DataFrame({'a': [3.0, None]}, index=[2, 3])]))).splitlines()
+    assert '2 & 3 \\\\' in rows and '3 & NaN \\\\' in rows
+    rows = str(StreamingTable(iter([first, pd.DataFrame({'a': ['x', '5']}, index=[2, 3])]))).splitlines()
+    assert '2 & x \\\\' in rows and '3 & 5 \\\\' in rows
+
+
+def test_escape():
+    """Test if special characters are escaped and Raw text is kept"""
+    assert escape('50% of a_b & c') == '50\\% of a\\_b \\& c'
+    assert escape('\\ x') == '\\textbackslash \\space x'
+    assert escape(Raw('\\textbf{x}')) == '\\textbf{x}'
+    assert escape_series(pd.Series(['#1', None])).tolist()[0] == '\\#1'
+    assert escape_all(['a&b', Raw('\\x'), 'y']) == ['a\\&b', '\\x', 'y']
+
+
+def test_list_item_override():
+    """Test if items are added by overridden item method"""
+    class Numbered(List):
+        def item(self, content, label=None):
+            super().item(f"{len(self._chunks)}. {content}", label)
+
+    assert '\\item 1. a\n\\item 2. b\n' in str(Numbered(['a', 'b']))
+    assert '\\item[x] 1. y\n' in str(Numbered({'x': 'y'}, 'description'))
+    assert str(List(['a'])) == '\\begin{itemize}\n\\item a\n\\end{itemize}\n'
+
+    class Upper(List):
+        def item(self, content, label=None):
+            super().item(content.upper(), label and label.upper())
+
+    assert '\\item 1\n\\item X\n' in str(Upper([1, 'x']))
+    assert '\\item[2] 3.5\n' in str(Upper({2: 3.5}, 'description'))
+
+
+def test_escape_in_list_and_write():
+    """Test if escaping is opt-in for List and write"""
+    items = List(['a_b', Raw('$x$')], escape=True)
+    assert '\\item a\\_b\n\\item $x$\n' in str(items)
+    assert str(List(['a_b'])).count('a_b') == 1
+    text = Writing()
+    text.write('100%', escape=True)
+    assert str(text) == '100\\%\n'
+
+
+def test_bibliography_only_cited(tmp_path):
+    """Test if bibliography detects duplicates and writes only cited records"""
+    tex = TexFile('doc')
+    bib = Bibliography('refs')
+    bib.file_path = str(tmp_path / 'refs.bib')
+    bib.add(Misc('a', title='A'), Misc('b', title='B'), Misc('a', title='A'))
+    with pytest.raises(DuplicateBibError):
+        bib.add(Book('b', 'B', 2000, 'X', 'Y'))
+    assert len(bib) == 2 and 'b' in bib
+    assert [record.name for record in bib.bib_list] == ['a', 'b']
+    with pytest.raises(AttributeError):
+        bib.bib_list.append(Misc('c'))
+    tex.document.write(f"see {tex.document.cite('b', note='p. 1')}")
+    tex.document.bibliography(bib)
+    assert '\\cite[p. 1]{b}' in str(tex.document)
+    bib.create(only_cited=True)
+    assert (tmp_path / 'refs.bib').read_text() == f"{bib['b']}\n"
+
+
+BIB_SOURCE = """@string{acm = "ACM Press"}
+@Article{knuth84,
+  author = {Donald E. Knuth},
+  title = {Literate {P}rogramming},
+  journal = "The Computer Journal",
+  year = 1984, month = may,
+}
+@inproceedings(conf, author="A", title={T}, booktitle = acm # " Proc", year={2001}, pages={1--2})
+@online{web, title={Site}}
+"""
+
+
+def test_parse_bib():
+    """Test if .bib entries are parsed into records, unknown types into Misc keeping their type"""
+    knuth, conf, web = parse_bib(io.StringIO(BIB_SOURCE))
+    assert knuth == Article('knuth84', 'Literate {P}rogramming', 1984, 'Donald E. Knuth', 'The Computer Journal', 'May')
+    assert isinstance(conf, InProceedings) and conf.booktitle == 'ACM Press Proc' and conf.page == '1--2'
+    assert web == Misc('web', title='Site', entry_type='online')
+
+
+def test_load_bib_cache(tmp_path, monkeypatch):
+    """Test if parsed records are cached and cache follows changes of file"""
+    monkeypatch.setenv('MFF_PYTEX_CACHE', str(tmp_path / 'cache'))
+    source = tmp_path / 'refs.bib'
+    source.write_text(BIB_SOURCE)
+    assert len(load_bib(str(source))) == 3
+    monkeypatch.setattr('mff_pytex.bib.parse_bib', None)
+    assert [record.name for record in load_bib(str(source))] == ['knuth84', 'conf', 'web']
+    monkeypatch.undo()
+    monkeypatch.setenv('MFF_PYTEX_CACHE', str(tmp_path / 'cache'))
+    source.write_text('@misc{only, title={X}}')
+    assert load_bib(str(source)) == [Misc('only', title='X')]
+
+
+def test_bib_render():
+    """Test if slotted records render fields in order with type key"""
+    record = InProceedings('conf', 'A', 'T & U', 'B', 2001, page='1--2')
+    assert not hasattr(record, '__dict__')
+    assert record.render(escape=True) == ('@inproceedings{conf,\n  author = "A" ,\n  title = "T \\& U" ,\n'
+                                          '  booktitle = "B" ,\n  year = "2001" ,\n  pages = "1--2" ,\n}')
+
+
+BIB_ROUND_TRIP = """@article{partial, author={A}, title={T}, year={2020}, doi={10.1/x}}
+@mastersthesis{thesis, author={B}, title={U}, school={MFF}, year={2019}, url={https://example.org}}
+@inproceedings{conf, author={C}, title={V}, booktitle={P}, year={2001}, pages={1--2}, isbn={123}}
+"""
+
+
+def test_bib_round_trip():
+    """Test if rendered records keep entry types, standard names and unknown fields"""
+    records = list(parse_bib(io.StringIO(BIB_ROUND_TRIP)))
+    partial, thesis, conf = records
+    assert partial.entry_type == 'article' and partial.extra == {'doi': '10.1/x'}
+    assert thesis.extra == {'url': 'https://example.org'} and conf.extra == {'isbn': '123'}
+    text = '\n'.join(record.render(escape=False) for record in records)
+    assert text.startswith('@article{partial,') and '@mastersthesis{thesis,' in text and 'pages = "1--2"' in text
+    assert 'doi = {10.1/x}' in text and 'url = {https://example.org}' in text
+    assert list(parse_bib(io.StringIO(text))) == records
+
+
+def test_build_cache(tmp_path, monkeypatch):
+    """Test if pdf built from the same sources is taken from cache"""
+    monkeypatch.setattr(Build, 'run_engine', fake_engine)
+    monkeypatch.setattr(Build, 'drafts', [], raising=False)
+    cache = PdfCache(str(tmp_path / 'cache'))
+    for name in ('a', 'b'):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'doc.tex').write_text('\\includegraphics[width=1cm]{img}')
+        (tmp_path / name / 'img.png').write_text('image')
+    assert Build(str(tmp_path / 'a' / 'doc.tex'), cache=cache).run() == 3
+    assert Build(str(tmp_path / 'b' / 'doc.tex'), cache=cache).run() == 0
+    assert (tmp_path / 'b' / 'doc.pdf').read_text() == 'pdf'
+    (tmp_path / 'b' / 'img.png').write_text('changed')
+    assert Build(str(tmp_path / 'b' / 'doc.tex'), cache=cache).run() == 3
+    assert (tmp_path / 'a' / 'doc.pdf').read_text() == 'pdf' and len(cache.entries()) == 2
+    assert len(cache.prune(3)) == 1 and cache.size() == 3
+
+
+def test_cli_cache(tmp_path, monkeypatch):
+    """Test if cache command reports and prunes entries"""
+    monkeypatch.setenv('MFF_PYTEX_CACHE', str(tmp_path))
+    (tmp_path / 'doc.pdf').write_text('pdf')
+    PdfCache().put('key', str(tmp_path / 'doc.pdf'))
+    runner = CliRunner()
+    assert '1 entries, 3 B' in runner.invoke(cli, ['cache', 'info', '--list']).output
+    assert runner.invoke(cli, ['cache', 'prune', '--all']).output == 'Removed 1 entries, 3 B.\n'
+    assert parse_size('1.5K') == 1536
+
+
+def test_prepare_assets(tmp_path, monkeypatch):
+    """Test if identical images are converted once and pictures include prepared files"""
+    monkeypatch.setenv('MFF_PYTEX_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setattr('mff_pytex.assets.SVG_CONVERTERS', (('cp', ('{source}', '{output}')),))
+    tex = TexFile('doc')
+    tex.file_path = str(tmp_path / 'doc.tex')
+    for name in ('a.svg', 'b.svg'):
+        (tmp_path / name).write_text('<svg/>')
+    (tmp_path / 'c.pdf').write_text('pdf')
+    pictures = [Picture(name) for name in ('a.svg', 'b', 'c.pdf')]
+    for picture in pictures:
+        tex.document.add(picture)
+    prepared = tex.prepare_assets(jobs=1)
+    assert prepared[str(tmp_path / 'a.svg')] == prepared[str(tmp_path / 'b.svg')]
+    assert len(os.listdir(tmp_path / 'cache' / 'assets')) == 1
+    assert prepared[str(tmp_path / 'a.svg')].endswith('.pdf') and pictures[2].prepared_path is None
+    assert f"{{{pictures[1].prepared_path}}}" in str(tex.document)
+    with pytest.raises(ValueError):
+        tex.make_pdf(assets=True)
+    (tmp_path / 'd.svg').write_text('<svg>other</svg>')
+    monkeypatch.setenv('MFF_PYTEX_ASSET_CACHE_SIZE', '1')
+    latest = prepare_assets([str(tmp_path / 'd.svg')], jobs=1)[str(tmp_path / 'd.svg')]
+    assert os.listdir(tmp_path / 'cache' / 'assets') == [os.path.basename(latest)]
+    tex.document.add(Picture('missing.png'))
+    with pytest.raises(MissingAssetError):
+        tex.prepare_assets()
+
+
+def test_prepare_assets_downsample(tmp_path):
+    """Test if large raster images are downsampled and converted"""
+    image = pytest.importorskip('PIL.Image')
+    image.new('RGB', (1000, 500)).save(tmp_path / 'big.tif')
+    image.new('RGB', (100, 50)).save(tmp_path / 'small.png')
+    sources = [str(tmp_path / 'big.tif'), str(tmp_path / 'small.png')]
+    prepared = prepare_assets(sources, AssetSettings(dpi=100, width=2), jobs=1, directory=str(tmp_path))
+    assert prepared[sources[1]] == sources[1]
+    with image.open(prepared[sources[0]]) as result:
+        assert result.size == (200, 100) and result.format == 'PNG'
+
+
+FAKE_ENGINE = Engine(sys.executable, (), ('-c', """
+import pathlib, sys, time
+tex = pathlib.Path(sys.argv[-1])
+if 'sleep' in tex.read_text():
+    time.sleep(30)
+for extension in ('aux', 'log', 'pdf'):
+    tex.with_suffix('.' + extension).write_text(extension)
+"""))
+
+
+FORMAT_ENGINE = Engine(sys.executable, (), ('-c', """
+import pathlib, sys
+args = dict(arg.lstrip('-').split('=', 1) for arg in sys.argv[1:-1] if '=' in arg)
+tex = pathlib.Path(sys.argv[-1])
+if 'jobname' in args:
+    (pathlib.Path(args['output-directory']) / (args['jobname'] + '.fmt')).write_text('fmt')
+else:
+    for extension in ('aux', 'pdf'):
+        tex.with_suffix('.' + extension).write_text(extension)
+    tex.with_suffix('.log').write_text(args.get('fmt', ''))
+"""), ('-ini',))
+
+
+def test_precompiled_formats(tmp_path, monkeypatch):
+    """Test if formats of preambles are kept in format cache and pruned only over its limit"""
+    monkeypatch.setenv('MFF_PYTEX_CACHE', str(tmp_path / 'cache'))
+    tex = tmp_path / 'doc.tex'
+    keys = []
+    for package in ('tikz', 'lipsum'):
+        tex.write_text(f"\\usepackage{{{package}}}\n\\begin{{document}}\n\\end{{document}}\n")
+        build = Build(str(tex), FORMAT_ENGINE, precompile=True)
+        build.run()
+        keys.append(build.preamble_key())
+        assert (tmp_path / 'doc.log').read_text() == keys[-1]
+        assert [event.name for event in build.events][0] == 'format'
+    assert {entry.key for entry in build.formats.entries()} == set(keys)
+    tex.write_text(tex.read_text() + 'changed')
+    build = Build(str(tex), FORMAT_ENGINE, precompile=True)
+    build.run()
+    assert 'format' not in [event.name for event in build.events]
+    monkeypatch.setenv('MFF_PYTEX_FORMAT_CACHE_SIZE', '3')
+    tex.write_text('\\usepackage{xcolor}\n\\begin{document}\n\\end{document}\n')
+    build = Build(str(tex), FORMAT_ENGINE, precompile=True)
+    build.run()
+    assert [entry.key for entry in build.formats.entries()] == [build.preamble_key()]
+
+
+def test_make_pdf_async(tmp_path):
+    """Test if async build reports passes, log and timeouts without blocking"""
+    events = []
+    add_hook(events.append)
+    try:
+        tex = TexFile('doc')
+        tex.file_path = str(tmp_path / 'doc.tex')
+        result = asyncio.run(tex.make_pdf_async('w+', engine=FAKE_ENGINE))
+    finally:
+        remove_hook(events.append)
+    assert result.ok and result.returncode == 0 and result.passes == len(result.pass_durations) == 3
+    assert result.log_path == str(tmp_path / 'doc.log')
+    assert [event.name for event in events] == ['render', 'write', 'engine', 'engine', 'engine']
+    assert [event.draft for event in events[2:]] == [True, True, False]
+    tex.document.write('sleep')
+    result = asyncio.run(tex.make_pdf_async('w+', engine=FAKE_ENGINE, pass_timeout=0.5))
+    assert not result.ok and result.error.startswith('CompilationTimeoutError')
+
+
+def test_make_pdf_async_cancel(tmp_path):
+    """Test if cancelled build stops and concurrent builds share a limit"""
+    async def main():
+        tex = TexFile('slow')
+        tex.file_path = str(tmp_path / 'slow.tex')
+        tex.document.write('sleep')
+        task = asyncio.create_task(tex.make_pdf_async('w+', engine=FAKE_ENGINE))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        sources = []
+        for name in ('a', 'b'):
+            (tmp_path / f'{name}.tex').write_text(name)
+            sources.append(str(tmp_path / f'{name}.tex'))
+        return await build_all_async(sources, jobs=1, engine=FAKE_ENGINE, draft=False)
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    assert time.perf_counter() - start < 10
+    assert [(result.name, result.ok, result.passes) for result in results] == [('a', True, 2), ('b', True, 2)]
+
+
+LOG_SOURCE = """This is pdfTeX, Version 3.141592653
+(./doc.tex
+LaTeX2e <2022-11-01>
+(/usr/share/texlive/texmf-dist/tex/latex/base/article.cls
+Document Class: article 2022/07/02 v1.4n Standard LaTeX document class
+)
+Package hyperref Warning: Token not allowed in a PDF string (Unicode):
+(hyperref)                removing `math shift' on input line 12.
+
+LaTeX Warning: Reference `fig:x' on page 1 undefined on input line 20.
+
+Overfull \\hbox (15.2pt too wide) in paragraph at lines 30--31
+! Undefined control sequence.
+l.42 \\foo
+
+[1] [2] (./doc.aux)
+LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.
+
+ )
+Output written on doc.pdf (2 pages, 12345 bytes).
+"""
+
+
+def test_parse_log():
+    """Test if log of TeX engine and bibtex is parsed to structured report"""
+    report = parse_log(io.StringIO(LOG_SOURCE))
+    assert [(error.message, error.file, error.line) for error in report.errors] == [
+        ('Undefined control sequence.', './doc.tex', 42)]
+    assert report.warnings[0].source == 'hyperref' and report.warnings[0].line == 12
+    assert report.warnings[0].message.endswith("removing `math shift' on input line 12.")
+    assert report.undefined_references == ['fig:x'] and report.badboxes[0].line == 30
+    assert report.rerun and report.pages == 2 and not report.ok
+    blg = parse_blg(io.StringIO('Warning--I didn\'t find a database entry for "knuth"\n'
+                                'I couldn\'t open database file refs.bib\n---line 3 of file doc.aux\n'))
+    assert blg.undefined_citations == ['knuth']
+    assert [(error.message, error.file, error.line) for error in blg.errors] == [
+        ("I couldn't open database file refs.bib", 'doc.aux', 3)]
+
+
+WATCHED_SCRIPT = """
+import helper
+from mff_pytex.structure import TexFile
+from mff_pytex.images import Picture
+tex = TexFile('doc')
+with open('{data}') as fp:
+    tex.document.write(fp.read(), helper.TEXT)
+tex.document.add(Picture('image.png'))
+tex.document.chapter('part', 'Part').write('Chapter.')
+tex.create('w+')
+"""
+
+
+def test_script_run_inputs(tmp_path, monkeypatch):
+    """Test if run of script records data files, local modules and images, and keeps unchanged TeX file"""
+    monkeypatch.setenv('MFF_PYTEX_CACHE', str(tmp_path / 'cache'))
+    (tmp_path / 'data.txt').write_text('data')
+    (tmp_path / 'helper.py').write_text("TEXT = 'helper'\n")
+    (tmp_path / 'image.png').write_bytes(b'png')
+    script = tmp_path / 'script.py'
+    script.write_text(WATCHED_SCRIPT.format(data=tmp_path / 'data.txt'))
+    run = ScriptRun(str(script)).run()
+    assert run.error is None
+    assert run.inputs == {str(tmp_path / name) for name in ('script.py', 'data.txt', 'helper.py', 'image.png')}
+    tex = tmp_path / 'doc.tex'
+    assert 'helper' in tex.read_text()
+    os.utime(tex, (0, 0))
+    second = ScriptRun(str(script)).run()
+    assert tex.stat().st_mtime == 0
+    assert second.inputs == run.inputs
+    (tmp_path / 'doc.mff_pytex.json').write_text('{}')
+    assert not is_input(str(tmp_path / 'doc.mff_pytex.json'))
+    (tmp_path / 'helper.py').write_text("TEXT = 'changed'\n")
+    ScriptRun(str(script)).run()
+    assert 'changed' in tex.read_text() and tex.stat().st_mtime > 0
+
+
+def test_watch_reruns_on_change(tmp_path, monkeypatch):
+    """Test if watched script runs again after its data file changes"""
+    pytest.importorskip('watchdog')
+    monkeypatch.setenv('MFF_PYTEX_CACHE', str(tmp_path / 'cache'))
+    (tmp_path / 'data.txt').write_text('first')
+    (tmp_path / 'helper.py').write_text("TEXT = ''\n")
+    (tmp_path / 'image.png').write_bytes(b'png')
+    script = tmp_path / 'script.py'
+    script.write_text(WATCHED_SCRIPT.format(data=tmp_path / 'data.txt'))
+    runs = []
+    stop = threading.Event()
+
+    def on_run(run):
+        runs.append(run)
+        if len(runs) == 1:
+            (tmp_path / 'data.txt').write_text('second')
+        else:
+            stop.set()
+    thread = threading.Thread(target=watch, args=(str(script), 0.05, on_run, stop))
+    thread.start()
+    thread.join(10)
+    stop.set()
+    assert len(runs) == 2 and 'second' in (tmp_path / 'doc.tex').read_text()
+
+
+def test_chapters_are_included(tmp_path):
+    """Test if chapters are written to their own files, which are rewritten only when they change"""
+    tex = TexFile('manual')
+    tex.file_path = str(tmp_path / 'manual.tex')
+    intro = tex.document.chapter('intro', 'Introduction')
+    intro.write('Hello.')
+    usage = tex.document.chapter('usage', 'Usage')
+    usage.add(Picture('figure.png'))
+    tex.create('w+', only=[usage])
+    text = (tmp_path / 'manual.tex').read_text()
+    assert '\\includeonly{usage}' in text and '\\include{intro}\n\\include{usage}' in text
+    assert (tmp_path / 'intro.tex').read_text() == '\\section{Introduction}\nHello.\n'
+    os.utime(tmp_path / 'intro.tex', (0, 0))
+    usage.write('More.')
+    tex.create('w+')
+    assert (tmp_path / 'intro.tex').stat().st_mtime == 0
+    assert 'includeonly' not in (tmp_path / 'manual.tex').read_text()
+    tex.include_only(['intro'])
+    tex.create('w+')
+    assert '\\includeonly{intro}' in (tmp_path / 'manual.tex').read_text()
+    tex.include_only(None)
+    assert 'More.' in (tmp_path / 'usage.tex').read_text()
+    dependencies = Build(tex.file_path).dependencies()
+    assert dependencies == [str(tmp_path / 'intro.tex'), str(tmp_path / 'usage.tex'), str(tmp_path / 'figure.png')]
+    tex.preamble.documentclass = DocumentClass('report')
+    tex.create('w+')
+    assert (tmp_path / 'intro.tex').read_text() == '\\chapter{Introduction}\nHello.\n'
+
+
+def test_memoize_fragment(tmp_path):
+    """Test if memoized fragment is rendered once per input and brings its packages on hit"""
+    cache = FragmentCache(str(tmp_path))
+    calls = []
+
+    @memoize(cache=cache)
+    def summary(df):
+        calls.append(df)
+        return Table(df)
+
+    df = pd.DataFrame({'a': [1, 2]})
+    tex = TexFile('doc')
+    with tex:
+        first = summary(df)
+        assert 'booktabs' in tex.packages
+    other = TexFile('other')
+    with other:
+        second = summary(df.copy())
+        assert 'booktabs' in other.packages
+    summary(pd.DataFrame({'a': [1, 3]}))
+    assert len(calls) == 2 and str(first) == str(second) == str(Table(df))
+    assert len(cache.entries()) == 2
+    cache.max_size = cache.entries()[0].size
+    summary(pd.DataFrame({'a': [4]}))
+    assert len(cache.entries()) == 1
+
+
+def test_memoize_fragment_files_and_pictures(tmp_path):
+    """Test if fragment follows content of path arguments and keeps its pictures as nodes"""
+    cache = FragmentCache(str(tmp_path / 'cache'))
+    calls = []
+
+    @cache.memoize
+    def figure(data):
+        calls.append(data)
+        env = Environment('center')
+        env.write(data.read_text())
+        env.add(Picture('plot.png'))
+        return env
+
+    data = tmp_path / 'data.txt'
+    data.write_text('first')
+    assert 'first' in str(figure(data))
+    fragment = figure(data)
+    assert len(calls) == 1
+    pictures = [node for node in fragment.walk() if isinstance(node, Picture)]
+    assert [picture.picture_path for picture in pictures] == ['plot.png']
+    pictures[0].prepared_path = 'prepared.png'
+    assert '{prepared.png}' in str(fragment)
+    tex = TexFile('doc')
+    tex.document.add(fragment)
+    assert pictures[0] in list(tex.document.walk())
+    data.write_text('second')
+    assert 'second' in str(figure(data)) and len(calls) == 2
+
+
+def test_render_server(tmp_path):
+    """Test if render server runs scripts and renders document descriptions submitted by client"""
+    socket_file = str(tmp_path / 's.sock')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path), MFF_PYTEX_CACHE=str(tmp_path / 'cache'))
+    server = subprocess.Popen([sys.executable, '-c', f"from mff_pytex.server import serve; serve({socket_file!r})"],
+                              env=env)
+    try:
+        for _ in range(200):
+            if os.path.exists(socket_file):
+                break
+            time.sleep(0.05)
+        script = tmp_path / 'script.py'
+        script.write_text("import sys\nprint('hello', sys.argv[1])\n")
+        messages = list(submit({'action': 'run', 'script': str(script), 'args': ['world']}, socket_file))
+        assert messages[0] == {'type': 'stdout', 'text': 'hello world\n'}
+        assert messages[-1]['type'] == 'result' and messages[-1]['ok']
+        spec = {'name': 'doc', 'directory': str(tmp_path), 'title': 'Title', 'packages': ['amsmath'], 'body': ['Hi.']}
+        result = list(submit({'action': 'render', 'spec': spec, 'pdf': False}, socket_file))[-1]
+        text = (tmp_path / 'doc.tex').read_text()
+        assert result['ok'] and '\\usepackage{amsmath}' in text and 'Hi.' in text
+        script.write_text("raise ValueError('bad')\n")
+        result = list(submit({'action': 'run', 'script': str(script)}, socket_file))[-1]
+        assert not result['ok'] and 'ValueError: bad' in result['error']
+    finally:
+        server.terminate()
+        server.wait(10)
+    with pytest.raises(RenderServerError):
+        list(submit({'action': 'run', 'script': str(script)}, str(tmp_path / 'missing.sock')))
+
+
+def test_merge(tmp_path):
+    """Test if template is filled by every record, to its own file or to one combined document"""
+    template = TexFile('certificate')
+    template.file_path = str(tmp_path / 'certificate.tex')
+    template.preamble.title = 'Certificate'
+    template.document.write(f"Awarded to {Placeholder('name')} for {Placeholder('score')} points.", escape=True)
+    template.document.add(Table(pd.DataFrame({'name': [Placeholder('name')]})))
+    df = pd.DataFrame({'id': [1, 2], 'name': ['A_b', 'C'], 'score': [10, 20]})
+    paths = merge(template, df, name='certificate_{id}')
+    assert paths == [str(tmp_path / 'certificate_1.tex'), str(tmp_path / 'certificate_2.tex')]
+    first = (tmp_path / 'certificate_1.tex').read_text()
+    assert 'Awarded to A\\_b for 10 points.' in first and first.count('A\\_b') == 2 and '\\usepackage{booktabs}' in first
+    [combined] = merge(template, df.to_dict('records'), combined=True)
+    text = (tmp_path / 'certificate_all.tex').read_text()
+    assert combined == str(tmp_path / 'certificate_all.tex')
+    assert text.count('\\begin{document}') == text.count('\\end{document}') == text.count('\\clearpage') == 1
+    assert 'for 10 points' in text and 'for 20 points' in text and text.index('A\\_b') < text.index('\\clearpage')
+    with pytest.raises(KeyError):
+        merge(template, [{'name': 'x'}])
+    df.loc[1, 'score'] = None
+    merge(template, df, name='certificate_{id}', na_rep='--')
+    assert 'for -- points' in (tmp_path / 'certificate_2.tex').read_text()
+    with pytest.raises(ValueError):
+        merge(template, df, name='certificate')